@@ -0,0 +1,525 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from DataStore import DataStore, band_statistics, sketch_statistics
+from QuantileSketch import QuantileSketch
+from Startup import StartupProfile
+import SyntheticData
+from WhatIf import RateSimulator
+
+# Benchmarks by name, each takes the parsed arguments and returns rows of measurements
+benchmarks = {}
+
+
+def benchmark(name):
+    def register(function):
+        benchmarks[name] = function
+        return function
+    return register
+
+
+def timed(function, repeat=5):
+    """
+    Best of repeat runs in milliseconds, with the result of the last run
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+# ===========================================================================
+@benchmark('sketches')
+def sketches(args):
+    """
+    Memory of the premium sketches and latency of the percentile bands per slider state
+    """
+    rows = []
+    for tab, module in SyntheticData.tabs.items():
+        data = SyntheticData.quotes(tab, rows=args.rows)
+        store = DataStore(data, module.lowest_columns, name=tab, statistics=band_statistics)
+        for target_column, (low, high) in SyntheticData.target_ranges[tab].items():
+            start = time.perf_counter()
+            aggregates = store._aggregates(target_column)
+            load_milliseconds = (time.perf_counter() - start) * 1000
+            kept = [sketch for sketch in aggregates.sketches.ravel() if sketch is not None]
+            centroids = max(len(sketch.means) for sketch in kept)
+            compression = kept[0].compression
+            codes = module.registry.codes(module.lowest_columns)
+            for bin_width in [1, 5, (high - low) // 4]:
+                band_milliseconds, bands = timed(lambda: store.premium_statistics(
+                    codes, low, high, bin_width, target_column, band_statistics))
+                # The same bins merged value by value, without the tree
+                cuts = np.searchsorted(aggregates.values, np.arange(low, high + bin_width, bin_width))
+                linear_milliseconds, _ = timed(lambda: [
+                    sketch_statistics(QuantileSketch.merge(aggregates.sketches[a:b, i]), band_statistics)
+                    for a, b in zip(cuts[:-1], cuts[1:]) for i in range(len(module.lowest_columns))])
+                rows.append({'tab': tab, 'target_column': target_column, 'values': len(aggregates.values),
+                             'bin_width': bin_width, 'bins': len(bands['p50']),
+                             'sketch_bytes': max(sketch.nbytes() for sketch in kept),
+                             'centroids': '%d <= %d' % (centroids, compression + 1),
+                             'tree_kib': sum(aggregates._tree(i).nbytes()
+                                             for i in range(len(module.lowest_columns))) / 1024,
+                             'load_ms': load_milliseconds,
+                             'bands_ms': band_milliseconds, 'linear_merge_ms': linear_milliseconds})
+    return rows
+
+
+# ===========================================================================
+# Cold import of the modules Main.py needs, in a new interpreter
+import_code = """
+import sys, time
+start = time.perf_counter()
+import DataStore, PolicyTab, VehicleTab, HomeTab, Startup
+print(time.perf_counter() - start, int('scipy' in sys.modules), int('tkinter' in sys.modules))
+"""
+
+
+@benchmark('startup')
+def startup(args):
+    """
+    Cold start (imports in a new process, loading, first session) and the start of every later session
+    """
+    rows = []
+    best = None
+    for _ in range(3):
+        output = subprocess.run([sys.executable, '-c', import_code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout.split()
+        if best is None or float(output[0]) < float(best[0]):
+            best = output
+    rows.append({'session': 'cold import', 'import_ms': float(best[0]) * 1000, 'load_ms': 0.0,
+                 'aggregation_ms': 0.0, 'document_ms': 0.0, 'total_ms': float(best[0]) * 1000,
+                 'scipy_loaded': bool(int(best[1])), 'tkinter_loaded': bool(int(best[2]))})
+
+    from bokeh.document import Document
+    from bokeh.models.widgets import Tabs
+    data = dict((tab, SyntheticData.quotes(tab, rows=args.rows)) for tab in SyntheticData.tabs)
+    stores = []
+    for session in range(4):
+        profile = StartupProfile()
+        profile.mark('import')
+        if not stores:
+            for tab, module in SyntheticData.tabs.items():
+                start = time.perf_counter()
+                stores.append(DataStore(data[tab], module.lowest_columns, name='%s-benchmark' % tab))
+                stores[-1].load_seconds = time.perf_counter() - start
+        profile.mark('load')
+        aggregated = sum(store.aggregate_seconds for store in stores)
+        panels = [module._tab(store, backend=store) for module, store in zip(SyntheticData.tabs.values(), stores)]
+        Document().add_root(Tabs(tabs=panels))
+        profile.mark('document')
+        report = profile.report(stores, aggregated)
+        rows.append({'session': 'first' if session == 0 else 'later %d' % session,
+                     'import_ms': report['import_seconds'] * 1000, 'load_ms': report['load_seconds'] * 1000,
+                     'aggregation_ms': report['aggregation_seconds'] * 1000,
+                     'document_ms': report['document_seconds'] * 1000, 'total_ms': report['total_seconds'] * 1000,
+                     'scipy_loaded': 'scipy' in sys.modules, 'tkinter_loaded': 'tkinter' in sys.modules})
+    return rows
+
+
+# ===========================================================================
+@benchmark('markets')
+def markets(args):
+    """
+    Partition build time and query latency of each market against the whole store
+    """
+    rows = []
+    data = SyntheticData.quotes('policy', rows=args.rows)
+    store = DataStore(data, SyntheticData.tabs['policy'].lowest_columns, name='policy', market_column='State')
+    codes = SyntheticData.tabs['policy'].registry.codes(SyntheticData.tabs['policy'].lowest_columns)
+
+    def queries(engine):
+        engine.average_premiums(codes, 16, 95, 'Age Max')
+        engine.histogram(codes, 16, 95, 3, 'Age Max')
+        engine.lowest_counts(16, 95, 'Age Max')
+
+    for market in ['All'] + store.markets():
+        start = time.perf_counter()
+        engine = store if market == 'All' else store.partition(market)
+        partition_milliseconds = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        engine._aggregates('Age Max')
+        aggregate_milliseconds = (time.perf_counter() - start) * 1000
+        query_milliseconds, _ = timed(lambda: queries(engine))
+        rows.append({'market': market, 'rows': len(engine.frame), 'partition_ms': partition_milliseconds,
+                     'aggregate_ms': aggregate_milliseconds, 'query_ms': query_milliseconds})
+    return rows
+
+
+@benchmark('whatif')
+def whatif(args):
+    """
+    Win rate of a GFB rate change from the sorted premium ratios against an argmin over the scaled premiums
+    """
+    rows = []
+    data = SyntheticData.quotes('policy', rows=args.rows)
+    columns = SyntheticData.tabs['policy'].lowest_columns
+    gfb_column = SyntheticData.tabs['policy'].policy_dictionary['GFB'][1]
+    simulator = RateSimulator(DataStore(data, columns, name='policy'), gfb_column)
+    start = time.perf_counter()
+    simulator._index('Age Max')
+    build_milliseconds = (time.perf_counter() - start) * 1000
+    for factor, bin_width, bin in [(0.9, None, None), (1.1, 3, 5)]:
+        engine = simulator.engine(factor, bin_width, bin)
+        query_milliseconds, _ = timed(lambda: engine.lowest_counts(16, 95, 'Age Max'))
+
+        def argmin():
+            premiums = data[columns].copy()
+            premiums[gfb_column] = premiums[gfb_column] * engine._factors(16, 95)(data['Age Max'].to_numpy(float))
+            return premiums[(16 <= data['Age Max']) & (data['Age Max'] < 95)].idxmin(axis=1).value_counts()
+
+        argmin_milliseconds, _ = timed(argmin, repeat=2)
+        rows.append({'factor': factor, 'bin': 'all' if bin is None else bin, 'build_ms': build_milliseconds,
+                     'query_ms': query_milliseconds, 'argmin_ms': argmin_milliseconds})
+    return rows
+
+
+@benchmark('cache')
+def cache(args):
+    """
+    Bursts of sessions opening the policy tab at once, on a cold result cache and then on a warm one
+    """
+    import threading
+    from ResultCache import result_cache
+    rows = []
+    module = SyntheticData.tabs['policy']
+    store = DataStore(SyntheticData.quotes('policy', rows=args.rows), module.lowest_columns, name='policy-benchmark')
+    # The per value aggregates are built once, the bursts only measure the tab queries
+    store._aggregates('Age Max')
+    result_cache.clear()
+    for burst in ['cold', 'warm']:
+        before = result_cache.metrics()
+        sessions = [threading.Thread(target=module._tab, args=(store,), kwargs={'backend': store})
+                    for _ in range(8)]
+        start = time.perf_counter()
+        for session in sessions:
+            session.start()
+        for session in sessions:
+            session.join()
+        milliseconds = (time.perf_counter() - start) * 1000
+        after = result_cache.metrics()
+        rows.append({'burst': burst, 'sessions': len(sessions), 'total_ms': milliseconds,
+                     'hits': after['hits'] - before['hits'], 'coalesced': after['coalesced'] - before['coalesced'],
+                     'misses': after['misses'] - before['misses']})
+    return rows
+
+
+
+@benchmark('prefetch')
+def prefetch(args):
+    """
+    Latency of nudging the range and bin width sliders of the policy tab, without and with the neighbouring
+    states prefetched while the session was idle
+    """
+    from bokeh.io import curdoc
+    from bokeh.models.widgets import RangeSlider, Slider
+    from Prefetch import PrefetchBudget
+    from ResultCache import result_cache
+    rows = []
+    module = SyntheticData.tabs['policy']
+    data = SyntheticData.quotes('policy', rows=args.rows)
+    for prefetched in [False, True]:
+        store = DataStore(data, module.lowest_columns, name='policy-benchmark')
+        store._aggregates('Age Max')
+        result_cache.clear()
+        doc = curdoc()
+        panel = module._tab(store, backend=store, prefetch=PrefetchBudget(1.0) if prefetched else None)
+        range_select = panel.select_one({'type': RangeSlider})
+        binwidth_select = panel.select_one({'type': Slider, 'title': 'Bin Width'})
+        for nudge, move in [('range', lambda: setattr(range_select, 'value', (range_select.value[0] +
+                                                                               range_select.step,
+                                                                               range_select.value[1]))),
+                            ('bin width', lambda: setattr(binwidth_select, 'value', binwidth_select.value +
+                                                          binwidth_select.step))]:
+            # The server loop runs the idle callbacks of the session before the next move
+            while doc.session_callbacks:
+                callback = doc.session_callbacks[0]
+                doc.remove_timeout_callback(callback)
+                callback.callback()
+            before = result_cache.metrics()
+            start = time.perf_counter()
+            move()
+            milliseconds = (time.perf_counter() - start) * 1000
+            after = result_cache.metrics()
+            rows.append({'prefetch': prefetched, 'nudge': nudge, 'update_ms': milliseconds,
+                         'hits': after['hits'] - before['hits'], 'misses': after['misses'] - before['misses']})
+    return rows
+
+
+@benchmark('sampled')
+def sampled(args):
+    """
+    Latency of moving the range slider of the policy tab with every panel shown, the baseline scenario included,
+    answered exactly and from the sample, then of the refinement once the slider stops, over the per value
+    aggregates and over the pandas code. The sampled moves leave the panels without a sampled answer to the
+    refinement
+    """
+    from bokeh.io import curdoc
+    from bokeh.models.widgets import RangeSlider
+    from ResultCache import result_cache
+    from Sampling import SampledBackend
+    rows = []
+    module = SyntheticData.tabs['policy']
+    data = SyntheticData.quotes('policy', rows=args.rows)
+    store = DataStore(data, module.lowest_columns, name='policy-benchmark')
+    baseline = DataStore(data, module.lowest_columns, name='policy-benchmark-baseline')
+    sample = SampledBackend(store)
+    sample.sample('Age Max')
+    doc = curdoc()
+    for backend, engine in [('index', 'exact'), ('index', 'sample'), ('pandas', 'exact'), ('pandas', 'sample')]:
+        panel = module._tab(store, backend=store if backend == 'index' else None,
+                            sample=sample if engine == 'sample' else None, baseline=baseline)
+        range_select = panel.select_one({'type': RangeSlider})
+        start, end = range_select.value
+        moves, refines = [], []
+        for step in range(1, 6):
+            result_cache.clear()
+            begin = time.perf_counter()
+            range_select.value = (start + step * range_select.step, end)
+            moves.append((time.perf_counter() - begin) * 1000)
+            # The server loop runs the refinement once the slider stops
+            begin = time.perf_counter()
+            while doc.session_callbacks:
+                callback = doc.session_callbacks[0]
+                doc.remove_timeout_callback(callback)
+                callback.callback()
+            refines.append((time.perf_counter() - begin) * 1000)
+        rows.append({'backend': backend, 'engine': engine, 'move_ms': float(np.median(moves)),
+                     'refine_ms': float(np.median(refines))})
+    return rows
+
+
+
+@benchmark('drilldown')
+def drilldown(args):
+    """
+    Latency of a page of the drill-down table for bins of growing size, by X axis value and by premium
+    """
+    from DrillDown import QuoteIndex
+    rows = []
+    module = SyntheticData.tabs['policy']
+    data = SyntheticData.quotes('policy', rows=args.rows)
+    store = DataStore(data, module.lowest_columns, name='policy-benchmark')
+    index = QuoteIndex(store.frame, 'Age Max', store.premiums())
+    gfb = module.lowest_columns.index(module.policy_dictionary['GFB'][1])
+    start = time.perf_counter()
+    index._order(gfb, True)
+    build_milliseconds = (time.perf_counter() - start) * 1000
+    for left, right in [(40, 41), (40, 43), (30, 60), (0, 120)]:
+        for column in [None, gfb]:
+            page_milliseconds, _ = timed(lambda: index.page(left, right, index.count(left, right) // 2, 20, column,
+                                                            True, include_end=True))
+            rows.append({'bin': '%d to %d' % (left, right), 'quotes': index.count(left, right, True),
+                         'sort': 'value' if column is None else 'GFB premium', 'build_ms': build_milliseconds,
+                         'page_ms': page_milliseconds})
+    return rows
+
+
+
+@benchmark('similar')
+def similar(args):
+    """
+    Nearest quotes to a profile from the risk index against scaled distances to every quote
+    """
+    from SimilarRisks import RiskIndex
+    rows = []
+    for tab, module in SyntheticData.tabs.items():
+        data = SyntheticData.quotes(tab, rows=args.rows)
+        columns = list(SyntheticData.target_ranges[tab])
+        start = time.perf_counter()
+        index = RiskIndex(data, columns)
+        build_milliseconds = (time.perf_counter() - start) * 1000
+        profile = data[columns].median().to_numpy()
+        for k in [10, 200]:
+            query_milliseconds, _ = timed(lambda: index.nearest(profile, k))
+
+            def scan():
+                values = (data[columns].to_numpy(dtype=float) - index.center) / index.scale
+                return np.argsort(((values - (profile - index.center) / index.scale) ** 2).sum(axis=1))[:k]
+
+            scan_milliseconds, _ = timed(scan, repeat=2)
+            rows.append({'tab': tab, 'columns': len(columns), 'k': k, 'build_ms': build_milliseconds,
+                         'query_ms': query_milliseconds, 'scan_ms': scan_milliseconds})
+    return rows
+
+
+
+@benchmark('scatter')
+def scatter(args):
+    """
+    Latency and size of an update of the quote scatter for viewports holding fewer and fewer quotes, against
+    sending every quote in view as a point
+    """
+    import json
+    from bokeh.util.serialization import transform_column_source_data
+    from QuoteScatter import ScatterIndex
+    rows = []
+    module = SyntheticData.tabs['policy']
+    data = SyntheticData.quotes('policy', rows=args.rows)
+    store = DataStore(data, module.lowest_columns, name='policy-benchmark')
+    gfb = module.lowest_columns.index(module.policy_dictionary['GFB'][1])
+    start = time.perf_counter()
+    index = ScatterIndex(store.frame, store.premiums(), gfb)
+    selected = index.select('Age Max', 0, 120)
+    build_milliseconds = (time.perf_counter() - start) * 1000
+
+    def size(data):
+        return len(json.dumps(transform_column_source_data(data))) / 1024.0
+
+    (x_start, x_end), (y_start, y_end) = index.extent(selected)
+    # Zoomed in on the median quote, the premiums are skewed
+    x_middle, y_middle = float(np.median(selected.x)), float(np.median(selected.y))
+    for zoom in [1, 4, 16, 64]:
+        x_range = (x_middle - (x_end - x_start) / zoom / 2, x_middle + (x_end - x_start) / zoom / 2)
+        y_range = (y_middle - (y_end - y_start) / zoom / 2, y_middle + (y_end - y_start) / zoom / 2)
+        view_milliseconds, (count, kept, density) = timed(lambda: index.view(selected, x_range, y_range, 2000,
+                                                                             120, 60))
+        update = {'x': selected.x[kept], 'y': selected.y[kept], 'value': selected.values[kept].astype(np.float32)}
+        image = {} if density is None else {'image': [np.where(density > 0, density, np.nan).astype(np.float32)]}
+        inside = (x_range[0] <= selected.x) & (selected.x <= x_range[1]) & (y_range[0] <= selected.y) & \
+                 (selected.y <= y_range[1])
+        every = {'x': selected.x[inside], 'y': selected.y[inside], 'value': selected.values[inside]}
+        rows.append({'zoom': zoom, 'quotes_in_view': count, 'points_sent': len(kept), 'build_ms': build_milliseconds,
+                     'view_ms': view_milliseconds, 'update_kib': size(update) + size(image),
+                     'every_point_kib': size(every)})
+    return rows
+
+
+@benchmark('kernels')
+def kernels(args):
+    """
+    Per value aggregates and rank counts of the policy quotes with the numpy kernels and the fused numba loops,
+    with the time numba takes to compile them. The numba rows are left out when it is not installed
+    """
+    import Kernels
+    rows = []
+    module = SyntheticData.tabs['policy']
+    data = SyntheticData.quotes('policy', rows=args.rows)
+    premiums = DataStore(data, module.lowest_columns).premiums()
+    values, inverse = np.unique(data['Age Max'].to_numpy(dtype=float), return_inverse=True)
+    for name in Kernels.kernels:
+        start = time.perf_counter()
+        try:
+            Kernels.use_kernel(name)
+        except ImportError:
+            continue
+        # The first call compiles
+        Kernels.value_aggregates(inverse[:10], len(values), premiums[:10])
+        Kernels.rank_counts(inverse[:10], len(values), premiums[:10])
+        compile_milliseconds = (time.perf_counter() - start) * 1000
+        aggregate_milliseconds, _ = timed(lambda: Kernels.value_aggregates(inverse, len(values), premiums))
+        rank_milliseconds, _ = timed(lambda: Kernels.rank_counts(inverse, len(values), premiums))
+        store_milliseconds, _ = timed(lambda: DataStore(data, module.lowest_columns,
+                                                        premiums=premiums)._aggregates('Age Max'), repeat=3)
+        rows.append({'kernel': name, 'compile_ms': compile_milliseconds, 'aggregates_ms': aggregate_milliseconds,
+                     'ranks_ms': rank_milliseconds, 'store_aggregates_ms': store_milliseconds})
+    Kernels.use_kernel('numpy')
+    return rows
+
+
+@benchmark('document')
+def document(args):
+    """
+    Size of the document of a new session, its number of models, and the time to build and serialize it once the
+    results are cached, with the glyphs and hover tools of the premium chart. The size is also given with the
+    lines and points of the premium chart filled by the server in single precision, as they were sent before the
+    browser filled them
+    """
+    from bokeh.document import Document
+    from bokeh.models import CustomJS, HoverTool, Plot
+
+    def fill_premium_lines(doc):
+        for callback in doc.select({'type': CustomJS, 'name': 'premium_lines'}):
+            data, series = callback.args['src'].data, callback.args['series']
+            left = np.asarray(data['left'], dtype=np.float32)
+            premiums = [np.asarray(data[column], dtype=np.float32) for label, column, color in series]
+            callback.args['lines'].data = {'xs': [left] * len(series), 'ys': premiums,
+                                           'color': [color for label, column, color in series],
+                                           'none': [np.zeros(0, dtype=np.float32) for _ in series]}
+            callback.args['points'].data = {'x': np.tile(left, len(series)), 'y': np.concatenate(premiums),
+                                            'code': np.repeat(np.arange(len(series), dtype=np.int8), len(left))}
+
+    rows = []
+    for tab, module in SyntheticData.tabs.items():
+        store = DataStore(SyntheticData.quotes(tab, rows=args.rows), module.lowest_columns, name=tab + '-benchmark')
+        module._tab(store, backend=store)
+
+        def session():
+            doc = Document()
+            doc.add_root(module._tab(store, backend=store))
+            return doc, doc.to_json_string()
+
+        milliseconds, (doc, text) = timed(session)
+        premium = [plot for plot in doc.select({'type': Plot}) if plot.yaxis[0].axis_label == 'Premium'][0]
+        fill_premium_lines(doc)
+        rows.append({'tab': tab, 'models': len(doc._all_models), 'json_kib': len(text) / 1024.0,
+                     'json_kib_filled': len(doc.to_json_string()) / 1024.0,
+                     'session_ms': milliseconds, 'premium_renderers': len(premium.renderers),
+                     'premium_hover_tools': len(premium.select({'type': HoverTool}))})
+    return rows
+
+
+@benchmark('templates')
+def templates_burst(args):
+    """
+    A burst of sessions opening all the tabs one after the other, as the server loop creates them, with every chart
+    built for each session and then copied from the templates of the process. The result cache and the per value
+    aggregates are warm, the first session of the templated burst builds the templates
+    """
+    from bokeh.document import Document
+    from bokeh.models.widgets import Tabs
+    from Templates import templates
+    rows = []
+    stores = [(module, DataStore(SyntheticData.quotes(tab, rows=args.rows), module.lowest_columns,
+                                 name=tab + '-benchmark')) for tab, module in SyntheticData.tabs.items()]
+
+    def session():
+        start = time.perf_counter()
+        doc = Document()
+        doc.add_root(Tabs(tabs=[module._tab(store, backend=store) for module, store in stores]))
+        # Sent to the browser when it connects
+        doc.to_json_string()
+        return (time.perf_counter() - start) * 1000
+
+    templates.enabled = False
+    session()
+    for enabled in [False, True]:
+        templates.enabled = enabled
+        templates.templates.clear()
+        start = time.perf_counter()
+        milliseconds = [session() for _ in range(16)]
+        burst_milliseconds = (time.perf_counter() - start) * 1000
+        rows.append({'templates': enabled, 'sessions': len(milliseconds), 'first_ms': milliseconds[0],
+                     'median_ms': float(np.median(milliseconds)), 'p95_ms': float(np.percentile(milliseconds, 95)),
+                     'burst_ms': burst_milliseconds, 'sessions_per_s': len(milliseconds) / burst_milliseconds * 1000})
+    templates.enabled = True
+    return rows
+
+
+# ===========================================================================
+def report(name, rows):
+    print('== %s' % name)
+    if not rows:
+        return
+    columns = list(rows[0])
+    cells = [[('%.2f' % value) if isinstance(value, float) else str(value) for value in row.values()]
+             for row in rows]
+    widths = [max(len(column), *(len(cell[n]) for cell in cells)) for n, column in enumerate(columns)]
+    print('  '.join(column.rjust(width) for column, width in zip(columns, widths)))
+    for cell in cells:
+        print('  '.join(value.rjust(width) for value, width in zip(cell, widths)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the dashboard engines on synthetic quotes')
+    parser.add_argument('names', nargs='*', help='Benchmarks to run, all of them by default: %s'
+                                                 % ', '.join(benchmarks))
+    parser.add_argument('--rows', type=int, default=200000, help='Quotes per tab')
+    args = parser.parse_args()
+    for name in args.names or list(benchmarks):
+        report(name, benchmarks[name](args))
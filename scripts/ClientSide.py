@@ -0,0 +1,167 @@
+from bokeh.models import CustomJS
+
+# Re-bins the fine bins of the X axis column for the slider values, same results as the tab builders
+rebin_code = """
+if (statistic_select.value != 'mean' || bands || rate_select.value != 0 || baseline) {
+    // The other statistics and the bands come from the sketches of the server, the what-if rates from its
+    // rate simulator and the changes since the baseline from its scenario
+    return;
+}
+var start = range_select.value[0], end = range_select.value[1], width = binwidth_select.value;
+var fine = fine_src.data, values = fine['values'], n = values.length, k = config.lowest.length;
+
+function fixed(x, digits) { return isNaN(x) ? 'nan' : x.toFixed(digits); }
+function percent(x) { return isNaN(x) ? 'nan%' : (x * 100).toFixed(0) + '%'; }
+function zeros(length) { var array = new Array(length); for (var i = 0; i < length; i++) { array[i] = 0; } return array; }
+function index(length) { var array = new Array(length); for (var i = 0; i < length; i++) { array[i] = i; } return array; }
+
+// ===========================================================================
+// Average premium bars and win rates, start <= value < end
+var nonzero_sum = zeros(k), nonzero_count = zeros(k), wins = zeros(k), subset_count = 0;
+for (var v = 0; v < n; v++) {
+    if (values[v] < start || values[v] >= end) { continue; }
+    subset_count += fine['policy_count'][v];
+    for (var i = 0; i < k; i++) {
+        nonzero_sum[i] += fine['nonzero_sum_' + i][v];
+        nonzero_count[i] += fine['nonzero_count_' + i][v];
+        wins[i] += fine['wins_' + i][v];
+    }
+}
+
+var companies = config.companies, tops = [];
+var bars = {'index': index(companies.length), 'x': [], 'top': [], 'lower': [], 'upper': [], 'color': [], 'text': []};
+for (var c = 0; c < companies.length; c++) {
+    var top = nonzero_sum[companies[c].column] / nonzero_count[companies[c].column];
+    tops.push(top);
+    bars['x'].push(companies[c].name);
+    bars['top'].push(top);
+    bars['lower'].push(NaN);
+    bars['upper'].push(NaN);
+    bars['color'].push(companies[c].color);
+    bars['text'].push('$' + fixed(top, 0));
+}
+for (var c = 0; c < companies.length; c++) {
+    var key = companies[c].key;
+    bars[key] = [];
+    bars[key + '_text'] = [];
+    for (var r = 0; r < companies.length; r++) {
+        var ratio = 1 - tops[c] / tops[r];
+        bars[key].push(ratio);
+        bars[key + '_text'].push(ratio > 0 ? 'is more expensive than ' + key + ' by ' + percent(ratio) :
+                                 (ratio == 0 ? '' : 'is less expensive than ' + key + ' by ' + percent(ratio)));
+    }
+}
+src.data = bars;
+
+// Cheapest company counts sorted like value_counts, ties in lowest_columns order
+var order = [], total = 0;
+for (var i = 0; i < k; i++) {
+    if (wins[i] > 0) { order.push(i); total += wins[i]; }
+}
+order.sort(function (a, b) { return wins[b] - wins[a] || a - b; });
+var win = {'index': index(order.length), 'VS': [], 'value': [], 'angle': [], 'ratio': [], 'text': [], 'key': [],
+           'name': [], 'color': [], 'cumulative_angle': [], 'cos': [], 'sin': [], 'policy_count': [],
+           'subset_count': []};
+var cumulative = 0;
+for (var o = 0; o < order.length; o++) {
+    var lowest = config.lowest[order[o]], value = wins[order[o]];
+    cumulative += value;
+    var angle = (cumulative - value / 2) / total * 2 * Math.PI;
+    win['VS'].push(lowest.column);
+    win['value'].push(value);
+    win['angle'].push(value / total * 2 * Math.PI);
+    win['ratio'].push(fixed(value / total, 4));
+    win['text'].push(percent(value / total));
+    win['key'].push(lowest.key);
+    win['name'].push(lowest.name);
+    win['color'].push(lowest.color);
+    win['cumulative_angle'].push(angle);
+    win['cos'].push(Math.cos(angle) * 0.3);
+    win['sin'].push(Math.sin(angle) * 0.3);
+    win['policy_count'].push(n ? fine['policy_total'][0] : 0);
+    win['subset_count'].push(subset_count);
+}
+src_win.data = win;
+
+// ===========================================================================
+// Distribution and premium per bin, bins as np.histogram with the last edge included
+var nbins = Math.trunc((end - start) / width), step = (end - start) / nbins;
+var edges = [];
+for (var b = 0; b <= nbins; b++) { edges.push(b == nbins ? end : start + b * step); }
+var counts = zeros(nbins), sums = [], missing = [], bin_wins = [];
+for (var a = 0; a < config.average.length; a++) { sums.push(zeros(nbins)); missing.push(zeros(nbins)); }
+for (var i = 0; i < k; i++) { bin_wins.push(zeros(nbins)); }
+for (var v = 0; v < n; v++) {
+    if (values[v] < start || values[v] > end) { continue; }
+    // Last edge not above the value
+    var low = 0, high = nbins;
+    while (low < high) {
+        var middle = (low + high + 1) >> 1;
+        if (edges[middle] <= values[v]) { low = middle; } else { high = middle - 1; }
+    }
+    var bin = Math.min(low, nbins - 1);
+    counts[bin] += fine['count'][v];
+    for (var a = 0; a < config.average.length; a++) {
+        sums[a][bin] += fine['premium_sum_' + config.average[a].column][v];
+        missing[a][bin] += fine['premium_missing_' + config.average[a].column][v];
+    }
+    for (var i = 0; i < k; i++) { bin_wins[i][bin] += fine['wins_' + i][v]; }
+}
+var all = counts.reduce(function (x, y) { return x + y; }, 0);
+var dist = {'index': index(nbins), 'proportion': [], 'left': edges.slice(0, nbins), 'right': edges.slice(1),
+            '_proportion': [], '_interval': [], 'count': counts};
+for (var b = 0; b < nbins; b++) {
+    var proportion = counts[b] / all;
+    dist['proportion'].push(proportion);
+    dist['_proportion'].push(fixed(proportion, 5));
+    dist['_interval'].push(Math.trunc(edges[b]) + ' to ' + Math.trunc(edges[b + 1]));
+}
+for (var a = 0; a < config.average.length; a++) {
+    dist[config.average[a].name] = [];
+    for (var b = 0; b < nbins; b++) {
+        dist[config.average[a].name].push(missing[a][b] > 0 ? NaN : sums[a][b] / counts[b]);
+    }
+}
+// Share of the quotes of each bin where each company is the cheapest
+var quoted = zeros(nbins);
+for (var i = 0; i < k; i++) {
+    for (var b = 0; b < nbins; b++) { quoted[b] += bin_wins[i][b]; }
+}
+for (var i = 0; i < k; i++) {
+    dist[config.lowest[i].share] = [];
+    for (var b = 0; b < nbins; b++) { dist[config.lowest[i].share].push(quoted[b] > 0 ? bin_wins[i][b] / quoted[b] : 0); }
+}
+src_dist.data = dist;
+"""
+
+
+def tab_config(companies, company_dictionary, lowest_columns, average_columns, companies_convert):
+    """
+    What the browser needs to know about the companies of a tab, premium columns given by their
+    position in lowest_columns
+    """
+    return {'companies': [{'key': key, 'name': company_dictionary[key][4], 'color': company_dictionary[key][2],
+                           'column': lowest_columns.index(company_dictionary[key][1])} for key in companies],
+            'average': [{'name': name, 'column': lowest_columns.index(column)}
+                        for column, name in average_columns.items()],
+            'lowest': [{'column': column, 'key': companies_convert[column],
+                        'name': company_dictionary[companies_convert[column]][4],
+                        'color': company_dictionary[companies_convert[column]][2],
+                        'share': average_columns[column].replace('average_premium', 'win_share')}
+                       for column in lowest_columns]}
+
+
+def rebin_callback(fine_src, config, src, src_dist, src_win, range_select, binwidth_select, statistic_select,
+                   bands, rate_select, baseline):
+    """
+    CustomJS recomputing the three sources of a tab in the browser when a slider moves
+
+    fine_src = ColumnDataSource of DataStore.fine_bins for the selected X axis column
+    config = tab_config of the tab
+    baseline = whether the tab shows the changes since a baseline, the server recomputes the sources then
+    """
+    return CustomJS(args=dict(fine_src=fine_src, config=config, src=src, src_dist=src_dist, src_win=src_win,
+                              range_select=range_select, binwidth_select=binwidth_select,
+                              statistic_select=statistic_select, bands=bands, rate_select=rate_select,
+                              baseline=baseline),
+                    code=rebin_code)
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+
+class Company(object):
+    """
+    One company of a tab
+
+    code = position of its premium column in lowest_columns, and its column in the premium matrix
+    key = key of the company in the company dictionary of the tab
+    """
+
+    def __init__(self, code, key, column, color, dash, name, average_column):
+        self.code = code
+        self.key = key
+        self.column = column
+        self.color = color
+        self.dash = dash
+        self.name = name
+        self.average_column = average_column
+
+    def __repr__(self):
+        return 'Company(%d, %r)' % (self.code, self.key)
+
+
+class CompanyRegistry(object):
+    """
+    The companies of a tab under integer codes. Code i is column i of lowest_columns, so the code order decides
+    ties for the cheapest company, and the premiums of all the quotes are kept as one contiguous
+    (rows x companies) array in code order which the aggregations slice by code instead of looking columns up
+    by name.
+
+    company_dictionary = key -> [premium name, premium column, color, line dash, display name], as in the tabs
+    lowest_columns = premium columns, ties for the cheapest go to the first one
+    average_columns = premium column -> distribution column of its average premium
+    """
+
+    def __init__(self, company_dictionary, lowest_columns, average_columns=None):
+        keys = dict((entry[1], key) for key, entry in company_dictionary.items())
+        average_columns = average_columns or {}
+        self.companies = []
+        for code, column in enumerate(lowest_columns):
+            entry = company_dictionary[keys[column]]
+            self.companies.append(Company(code, keys[column], column, entry[2], entry[3], entry[4],
+                                          average_columns.get(column)))
+        self.columns = list(lowest_columns)
+        self._codes = dict((company.key, company.code) for company in self.companies)
+        self._codes.update((company.column, company.code) for company in self.companies)
+
+    def __len__(self):
+        return len(self.companies)
+
+    def __iter__(self):
+        return iter(self.companies)
+
+    def __getitem__(self, key):
+        """
+        Company by code, key or premium column
+        """
+        return self.companies[key if isinstance(key, (int, np.integer)) else self._codes[key]]
+
+    def code(self, key):
+        """
+        Code of a company given by key or premium column
+        """
+        return self._codes[key]
+
+    def codes(self, keys):
+        return np.array([self._codes[key] for key in keys], dtype=np.intp)
+
+    def ranked(self, counts):
+        """
+        Counts by code as value_counts() of the cheapest premium column gives them: by premium column, largest
+        first, ties in code order and zeros left out
+        """
+        counts = np.asarray(counts)
+        order = np.argsort(-counts, kind='stable')
+        order = order[counts[order] > 0]
+        return pd.Series(counts[order], index=[self.columns[code] for code in order])
+
+
+def premium_matrix(data, columns):
+    """
+    Premiums of the given columns of a dataframe as a C contiguous float64 array, rows x columns
+    """
+    return np.ascontiguousarray(data[list(columns)].to_numpy(dtype=float))
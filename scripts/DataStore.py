@@ -0,0 +1,601 @@
+import itertools
+import threading
+import time
+import numpy as np
+import pandas as pd
+from QuantileSketch import QuantileSketch, SketchTree
+from Companies import premium_matrix
+from Kernels import value_aggregates
+
+# Premium statistics the aggregates can add to the average, computed over the non zero premiums.
+# Percentiles are written p followed by the percent, for example p10 or p90
+statistic_labels = {'mean': 'Average', 'weighted_mean': 'Weighted Average',
+                    'median': 'Median', 'trimmed_mean': 'Trimmed Average'}
+
+# Percentiles drawn as bands on the premium chart
+band_statistics = ['p10', 'p50', 'p90']
+
+# Versions of the stores, unique in the process so results cached for a store never match another one
+_versions = itertools.count(1)
+
+
+def statistic_label(statistic):
+    if statistic in statistic_labels:
+        return statistic_labels[statistic]
+    if statistic.startswith('p') and statistic[1:].isdigit() and 0 <= int(statistic[1:]) <= 100:
+        return '%sth Percentile' % statistic[1:]
+    raise ValueError("Unknown premium statistic %r" % statistic)
+
+
+def sketch_statistic(sketch, statistic):
+    """
+    Reads a statistic off a quantile sketch
+    """
+    if statistic == 'median':
+        return sketch.quantile(0.5)
+    if statistic == 'trimmed_mean':
+        # 10% trimmed on each side
+        return sketch.trimmed_mean(0.1, 0.9)
+    return sketch.quantile(int(statistic[1:]) / 100.0)
+
+
+def sketch_statistics(sketch, statistics):
+    """
+    Reads several statistics off a quantile sketch, the percentiles with a single interpolation
+    """
+    quantiles = [0.5 if statistic == 'median' else int(statistic[1:]) / 100.0
+                 for statistic in statistics if statistic != 'trimmed_mean']
+    values = iter(np.broadcast_to(sketch.quantile(quantiles), len(quantiles)))
+    return [sketch_statistic(sketch, statistic) if statistic == 'trimmed_mean' else next(values)
+            for statistic in statistics]
+
+
+def histogram_bins(values, range_start, range_end, bin_width):
+    """
+    Places sorted values into the same bins np.histogram and binned_statistic use for the slider settings.
+    Returns the bin of each value (-1 when outside the range) and the bin edges
+    """
+    edges = np.histogram_bin_edges([], bins=int((range_end - range_start) / bin_width),
+                                   range=[range_start, range_end])
+    bins = np.searchsorted(edges, values, side='right') - 1
+    # The last bin includes the right edge
+    bins[values == edges[-1]] = len(edges) - 2
+    bins[(values < edges[0]) | (values > edges[-1])] = -1
+    return bins, edges
+
+
+def binned_averages(values, count, premium_sum, premium_missing, range_start, range_end, bin_width, wins=None):
+    """
+    Rolls per value counts and premium sums up into the slider bins.
+    Returns the count per bin, the bin edges and the average premium per bin and column
+
+    wins = optional per value counts of the quotes where each company is the cheapest, their counts per bin and
+           company are returned last, placed in the same bins with a single 2-D bincount
+    """
+    bins, edges = histogram_bins(values, range_start, range_end, bin_width)
+    inside = bins >= 0
+    bins, nbins = bins[inside], len(edges) - 1
+    counts = np.bincount(bins, weights=count[inside], minlength=nbins).astype(np.int64)
+    averages = np.empty((nbins, premium_sum.shape[1]))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i in range(premium_sum.shape[1]):
+            sums = np.bincount(bins, weights=premium_sum[inside, i], minlength=nbins)
+            missing = np.bincount(bins, weights=premium_missing[inside, i], minlength=nbins)
+            # A missing premium makes the bin average missing, as in binned_statistic
+            averages[:, i] = np.where(missing > 0, np.nan, sums / counts)
+    if wins is None:
+        return counts, edges, averages
+    k = wins.shape[1]
+    cell = (bins[:, None] * k + np.arange(k)).ravel()
+    bin_wins = np.bincount(cell, weights=wins[inside].ravel(), minlength=nbins * k).reshape(nbins, k)
+    # Sampled engines estimate the counts, rounded to whole quotes
+    return counts, edges, averages, np.rint(bin_wins).astype(np.int64)
+
+
+class ValueAggregates(object):
+    """
+    Counts, premium sums and cheapest company tallies per distinct value of one target column.
+    Any range and bin width can be answered from these without going back to the rows, and a new
+    batch of quotes only needs its own rows aggregated and merged in.
+
+    columns = premium columns in lowest_columns order, ties for the cheapest go to the first column
+    statistics = extra premium statistics to support, they are aggregated in the same pass as the sums
+    weight_column = exposure column weighting weighted_mean and the sketch based statistics, unit weights if None
+    """
+
+    def __init__(self, columns, statistics=(), weight_column=None):
+        k = len(columns)
+        self.columns = list(columns)
+        self.statistics = list(statistics)
+        self.weight_column = weight_column
+        # Quantile sketch of the non zero premiums per value and column, for medians, trimmed means, percentiles
+        self.sketched = any(statistic not in ('mean', 'weighted_mean') for statistic in self.statistics)
+        self.sketches = np.empty((0, k), dtype=object)
+        self.trees = {}
+        # Exposure and exposure weighted sum of the non zero premiums
+        self.weight_sum = np.zeros((0, k))
+        self.weighted_sum = np.zeros((0, k))
+        self.values = np.empty(0)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.policy_count = np.zeros(0, dtype=np.int64)
+        # Sum and number of missing premiums, zeros included (binned_statistic mean)
+        self.premium_sum = np.zeros((0, k))
+        self.premium_missing = np.zeros((0, k), dtype=np.int64)
+        # Sum and number of non zero premiums (average premium bars)
+        self.nonzero_sum = np.zeros((0, k))
+        self.nonzero_count = np.zeros((0, k), dtype=np.int64)
+        # Number of quotes where each column is the cheapest
+        self.wins = np.zeros((0, k), dtype=np.int64)
+
+    def add(self, data, target_column, premiums=None):
+        """
+        premiums = premium matrix of data in columns order, extracted from data when not given
+        """
+        target = data[target_column].to_numpy(dtype=float)
+        keep = ~np.isnan(target)
+        premiums = (premium_matrix(data, self.columns) if premiums is None else premiums)[keep]
+        policy_known = data['Policy No'].notna().to_numpy()[keep] if 'Policy No' in data else np.zeros(keep.sum())
+        values, inverse = np.unique(target[keep], return_inverse=True)
+        n, k = len(values), len(self.columns)
+
+        # Counts, sums and cheapest company tallies in one kernel call
+        batch = value_aggregates(inverse, n, premiums)
+        batch['policy_count'] = np.bincount(inverse, weights=policy_known, minlength=n).astype(np.int64)
+        if 'weighted_mean' in self.statistics or self.sketched:
+            nonzero = ~np.isnan(premiums) & (premiums != 0)
+            filled = np.where(np.isnan(premiums), 0, premiums)
+            cell = (inverse[:, None] * k + np.arange(k)).ravel()
+
+            def by_cell(weights):
+                return np.bincount(cell, weights=weights.ravel(), minlength=n * k).reshape(n, k)
+
+            if self.weight_column is not None:
+                weight = data[self.weight_column].to_numpy(dtype=float)[keep]
+            else:
+                weight = np.ones(len(inverse))
+            batch['weight_sum'] = by_cell(np.where(nonzero, weight[:, None], 0))
+            batch['weighted_sum'] = by_cell(np.where(nonzero, weight[:, None] * filled, 0))
+        sketches = self._sketch(inverse, n, premiums, nonzero, weight) if self.sketched else None
+        self._merge(values, batch, sketches)
+
+    def _sketch(self, inverse, n, premiums, nonzero, weight):
+        """
+        One sketch per value and column, the rows are sorted once per column and cut into values
+        """
+        sketches = np.empty((n, len(self.columns)), dtype=object)
+        for i in range(len(self.columns)):
+            rows = np.flatnonzero(nonzero[:, i])
+            rows = rows[np.lexsort((premiums[rows, i], inverse[rows]))]
+            cuts = np.searchsorted(inverse[rows], np.arange(n + 1))
+            for value in range(n):
+                chunk = rows[cuts[value]:cuts[value + 1]]
+                sketches[value, i] = QuantileSketch.from_values(premiums[chunk, i], weight[chunk])
+        return sketches
+
+    def _merge(self, values, batch, sketches=None):
+        merged = np.union1d(self.values, values)
+        if len(merged) != len(self.values):
+            # New distinct values, grow every array to the merged value list
+            position = np.searchsorted(merged, self.values)
+            for name in list(batch) + ['sketches']:
+                old = getattr(self, name)
+                grown = np.zeros((len(merged),) + old.shape[1:], dtype=old.dtype)
+                if old.dtype == object:
+                    grown.fill(None)
+                grown[position] = old
+                setattr(self, name, grown)
+            self.values = merged
+        position = np.searchsorted(self.values, values)
+        for name in batch:
+            getattr(self, name)[position] += batch[name]
+        if sketches is not None:
+            self.trees = {}
+            for row, value in enumerate(position):
+                for i in range(len(self.columns)):
+                    self.sketches[value, i] = QuantileSketch.merge([self.sketches[value, i], sketches[row, i]])
+
+    def _range(self, range_start, range_end, include_end=False):
+        return slice(np.searchsorted(self.values, range_start, side='left'),
+                     np.searchsorted(self.values, range_end, side='right' if include_end else 'left'))
+
+    def average_premiums(self, codes, range_start, range_end):
+        selected = self._range(range_start, range_end)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return list(self.nonzero_sum[selected][:, codes].sum(axis=0) /
+                        self.nonzero_count[selected][:, codes].sum(axis=0))
+
+    def histogram(self, codes, range_start, range_end, bin_width, wins=False):
+        selected = self._range(range_start, range_end, include_end=True)
+        return binned_averages(self.values[selected], self.count[selected],
+                               self.premium_sum[selected][:, codes], self.premium_missing[selected][:, codes],
+                               range_start, range_end, bin_width, self.wins[selected] if wins else None)
+
+    def _tree(self, i):
+        """
+        Segment tree over the value sketches of column i, rebuilt after the sketches change
+        """
+        if i not in self.trees:
+            self.trees[i] = SketchTree(self.sketches[:, i])
+        return self.trees[i]
+
+    def premium_statistics(self, codes, range_start, range_end, bin_width, statistics):
+        """
+        Extra premium statistics per bin and column, bins as in histogram. Returns an array per statistic.
+        The sketch of a bin is merged once, from at most two tree nodes per level, whatever the values it holds
+        """
+        selected = self._range(range_start, range_end, include_end=True)
+        index = list(codes)
+        bins, edges = histogram_bins(self.values[selected], range_start, range_end, bin_width)
+        inside = bins >= 0
+        nbins = len(edges) - 1
+        result = {}
+        if 'weighted_mean' in statistics:
+            result['weighted_mean'] = np.empty((nbins, len(index)))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                for n, i in enumerate(index):
+                    result['weighted_mean'][:, n] = (
+                        np.bincount(bins[inside], weights=self.weighted_sum[selected][inside, i], minlength=nbins) /
+                        np.bincount(bins[inside], weights=self.weight_sum[selected][inside, i], minlength=nbins))
+        sketched = [statistic for statistic in statistics if statistic != 'weighted_mean']
+        if sketched:
+            # The values are sorted, so the values of a bin are next to each other
+            cuts = np.searchsorted(bins, np.arange(nbins + 1)) + selected.start
+            for statistic in sketched:
+                result[statistic] = np.full((nbins, len(index)), np.nan)
+            for n, i in enumerate(index):
+                tree = self._tree(i)
+                for b in range(nbins):
+                    values = sketch_statistics(tree.query(cuts[b], cuts[b + 1]), sketched)
+                    for statistic, value in zip(sketched, values):
+                        result[statistic][b, n] = value
+        return result
+
+    def statistic(self, codes, range_start, range_end, bin_width, statistic):
+        return self.premium_statistics(codes, range_start, range_end, bin_width, [statistic])[statistic]
+
+    def lowest_counts(self, range_start, range_end):
+        selected = self._range(range_start, range_end)
+        return self.wins[selected].sum(axis=0), self.policy_count[selected].sum()
+
+
+class DataStore(object):
+    """
+    Holds the quotes of one tab, shared by every session of the process.
+    New batches are appended without reloading: the per value aggregates already built are updated with
+    only the batch rows, attached SQL backends get the batch, and the open sessions are told to refresh.
+
+    data = the dataframe the tab is built with
+    lowest_columns = the premium columns of the tab, ties for the cheapest go to the first column
+    name = short name of the tab
+    prepare = optional function applied to the initial data and every appended batch
+    path = file the data was read from, used to reload it
+    statistics = extra premium statistics (see statistic_labels) aggregated along with the sums
+    weight_column = exposure column for the weighted statistics
+    market_column = column of the market (state, territory or rating region) the quotes are partitioned on
+    premiums = premium matrix of data when it is already built
+    """
+
+    def __init__(self, data, lowest_columns, name='quotes', prepare=None, path=None, statistics=(),
+                 weight_column=None, market_column=None, premiums=None):
+        for statistic in statistics:
+            statistic_label(statistic)
+        self.name = name
+        self.path = path
+        self.statistics = [statistic for statistic in statistics if statistic != 'mean']
+        self.weight_column = weight_column
+        self.market_column = market_column
+        self.lowest_columns = list(lowest_columns)
+        self.prepare = prepare
+        if prepare is not None:
+            data = prepare(data)
+        self.batches = [data]
+        self._frame = data
+        # Premiums of the quotes as one (rows x lowest_columns) array, extracted once per batch
+        self.premium_batches = [premium_matrix(data, self.lowest_columns) if premiums is None else premiums]
+        self._premiums = self.premium_batches[0]
+        self.aggregates = {}
+        self.backends = []
+        self.listeners = []
+        self.total_policies = data['Policy No'].count() if 'Policy No' in data else 0
+        self.lock = threading.RLock()
+        # Changes with every append and replace
+        self.version = next(_versions)
+        # Row positions of each market in frame, and the stores of the markets asked for so far
+        self._market_rows = None
+        self.partitions = {}
+        # Objects derived from the quotes (indexes, cubes, simulators) by key, they live as long as the store
+        self._derived = {}
+        # Batches appended while a reload is rebuilding, with their premiums, applied to the reloaded data when it
+        # is swapped in (None when no reload is running). Reloads run one at a time
+        self.pending = None
+        self.replace_lock = threading.Lock()
+        # Seconds spent reading the file (set by get_store) and building per value aggregates
+        self.load_seconds = 0.0
+        self.aggregate_seconds = 0.0
+
+    @property
+    def frame(self):
+        """
+        All the quotes as one dataframe, only concatenated when the rows are actually needed
+        """
+        with self.lock:
+            if self._frame is None:
+                self._frame = pd.concat(self.batches, ignore_index=True)
+                self.batches = [self._frame]
+            return self._frame
+
+    def premiums(self):
+        """
+        Premium matrix of frame, rows x lowest_columns, only concatenated when it is actually needed
+        """
+        with self.lock:
+            if self._premiums is None:
+                self._premiums = np.concatenate(self.premium_batches)
+                self.premium_batches = [self._premiums]
+            return self._premiums
+
+    # ===========================================================================
+    # Market partitions
+    # ===========================================================================
+    def _markets(self):
+        with self.lock:
+            if self._market_rows is None:
+                self._market_rows = self.frame.groupby(self.market_column, sort=True).indices
+            return self._market_rows
+
+    def markets(self):
+        """
+        The markets found in the market column, sorted
+        """
+        if self.market_column is None or self.market_column not in self.frame:
+            return []
+        return [str(market) for market in self._markets()]
+
+    def partition(self, market):
+        """
+        Store of the quotes of one market, built on first use. It has its own aggregates, so its queries cost in
+        proportion to the rows of the market
+        """
+        with self.lock:
+            if market not in self.partitions:
+                # A market missing from this store gets an empty partition
+                rows = dict((str(key), value) for key, value in self._markets().items()).get(market, [])
+                self.partitions[market] = DataStore(self.frame.iloc[rows].reset_index(drop=True),
+                                                    self.lowest_columns, name='%s/%s' % (self.name, market),
+                                                    statistics=self.statistics, weight_column=self.weight_column,
+                                                    premiums=self.premiums()[rows])
+            return self.partitions[market]
+
+    def _aggregates(self, target_column):
+        with self.lock:
+            if target_column not in self.aggregates:
+                start = time.perf_counter()
+                aggregates = ValueAggregates(self.lowest_columns, self.statistics, self.weight_column)
+                aggregates.add(self.frame, target_column, self.premiums())
+                self.aggregates[target_column] = aggregates
+                self.aggregate_seconds += time.perf_counter() - start
+            return self.aggregates[target_column]
+
+    # ===========================================================================
+    # Same queries as SqlBackend, answered from the per value aggregates. The companies are given by code, the
+    # position of their premium column in lowest_columns
+    # ===========================================================================
+    def average_premiums(self, codes, range_start, range_end, target_column):
+        with self.lock:
+            return self._aggregates(target_column).average_premiums(codes, range_start, range_end)
+
+    def histogram(self, codes, range_start, range_end, bin_width, target_column, wins=False):
+        """
+        wins = also return the number of quotes where each of lowest_columns is the cheapest, per bin
+        """
+        with self.lock:
+            return self._aggregates(target_column).histogram(codes, range_start, range_end, bin_width, wins)
+
+    def premium_statistic(self, codes, range_start, range_end, bin_width, target_column, statistic):
+        """
+        One of the configured extra statistics per bin and column, bins as in histogram
+        """
+        assert statistic in self.statistics, "%s is not aggregated by this store" % statistic
+        with self.lock:
+            return self._aggregates(target_column).statistic(codes, range_start, range_end, bin_width, statistic)
+
+    def fine_bins(self, target_column):
+        """
+        The per value aggregates of a target column as flat columns, column i of lowest_columns suffixed _i,
+        for re-binning outside the store. policy_total repeats the number of policies of the store
+        """
+        with self.lock:
+            aggregates = self._aggregates(target_column)
+            data = {'values': aggregates.values.copy(), 'count': aggregates.count.copy(),
+                    'policy_count': aggregates.policy_count.copy(),
+                    'policy_total': np.full(len(aggregates.values), self.policy_count())}
+            for name in ['premium_sum', 'premium_missing', 'nonzero_sum', 'nonzero_count', 'wins']:
+                for i in range(len(self.lowest_columns)):
+                    data['%s_%d' % (name, i)] = getattr(aggregates, name)[:, i].copy()
+        return data
+
+    def premium_statistics(self, codes, range_start, range_end, bin_width, target_column, statistics):
+        """
+        Several of the configured extra statistics at once, the sketches of each bin are merged a single time
+        """
+        for statistic in statistics:
+            assert statistic in self.statistics, "%s is not aggregated by this store" % statistic
+        with self.lock:
+            return self._aggregates(target_column).premium_statistics(codes, range_start, range_end, bin_width,
+                                                                      statistics)
+
+    def lowest_counts(self, range_start, range_end, target_column):
+        """
+        Number of quotes where each company is the cheapest for range_start <= target_column < range_end, by
+        code, and the number of policies in the range
+        """
+        with self.lock:
+            return self._aggregates(target_column).lowest_counts(range_start, range_end)
+
+    def policy_count(self):
+        return self.total_policies
+
+    # ===========================================================================
+    # Incremental updates
+    # ===========================================================================
+    def attach(self, backend):
+        """
+        Appended batches are also sent to this backend
+        """
+        self.backends.append(backend)
+
+    def append(self, batch):
+        """
+        Adds a batch of quotes, the cost depends on the batch size and not on the history already loaded
+        """
+        if self.prepare is not None:
+            batch = self.prepare(batch)
+        premiums = premium_matrix(batch, self.lowest_columns)
+        with self.lock:
+            self.batches.append(batch)
+            self._frame = None
+            self.premium_batches.append(premiums)
+            self._premiums = None
+            self.version = next(_versions)
+            for target_column, aggregates in self.aggregates.items():
+                aggregates.add(batch, target_column, premiums)
+            if self.pending is None:
+                for backend in self.backends:
+                    backend.append(batch)
+            else:
+                # The backends are being reloaded, they get the batch once they are swapped in
+                self.pending.append((batch, premiums))
+            if 'Policy No' in batch:
+                self.total_policies += batch['Policy No'].count()
+            if self.market_column is not None:
+                # The partitions built so far only get their own rows, the others are cut from frame when asked for
+                self._market_rows = None
+                for market, rows in batch.groupby(self.market_column).indices.items():
+                    if str(market) in self.partitions:
+                        self.partitions[str(market)].append(batch.iloc[rows])
+        self._notify()
+
+    def replace(self, data):
+        """
+        Swaps in a reloaded dataset. The aggregates already in use are rebuilt first while the current data keeps
+        answering queries, then everything is swapped at once and the open sessions are told to refresh. Batches
+        appended during the rebuild are added to the reloaded data before the swap.
+        Returns the time the store was locked for the swap, in seconds
+        """
+        if self.prepare is not None:
+            data = self.prepare(data)
+        with self.replace_lock:
+            with self.lock:
+                target_columns = list(self.aggregates)
+                backends = list(self.backends)
+                self.pending = []
+            try:
+                premiums = premium_matrix(data, self.lowest_columns)
+                aggregates = {}
+                for target_column in target_columns:
+                    aggregates[target_column] = ValueAggregates(self.lowest_columns, self.statistics,
+                                                                self.weight_column)
+                    aggregates[target_column].add(data, target_column, premiums)
+                for backend in backends:
+                    backend.replace(data)
+                swap_start = time.perf_counter()
+                with self.lock:
+                    pending = self.pending
+                    for batch, batch_premiums in pending:
+                        for target_column, column_aggregates in aggregates.items():
+                            column_aggregates.add(batch, target_column, batch_premiums)
+                        for backend in backends:
+                            backend.append(batch)
+                    self.batches = [data] + [batch for batch, batch_premiums in pending]
+                    self._frame = None if pending else data
+                    self.premium_batches = [premiums] + [batch_premiums for batch, batch_premiums in pending]
+                    self._premiums = None if pending else premiums
+                    self.aggregates = aggregates
+                    self.total_policies = sum(batch['Policy No'].count() for batch in self.batches
+                                              if 'Policy No' in batch)
+                    self._market_rows = None
+                    self.partitions = {}
+                    self.version = next(_versions)
+                    self.pending = None
+                swap_seconds = time.perf_counter() - swap_start
+            finally:
+                # A failed reload leaves the current data, which already has the batches appended meanwhile
+                with self.lock:
+                    if self.pending is not None:
+                        for batch, batch_premiums in self.pending:
+                            for backend in backends:
+                                backend.append(batch)
+                        self.pending = None
+        self._notify()
+        return swap_seconds
+
+    def derived(self, key, build):
+        """
+        Object derived from the quotes made by build(store) the first time key is asked for. The store keeps it, so
+        the stores of the markets dropped by a reload take their indexes with them
+        """
+        with self.lock:
+            if key not in self._derived:
+                self._derived[key] = build(self)
+            return self._derived[key]
+
+    def add_listener(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def _notify(self):
+        with self.lock:
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener()
+
+
+# One store per tab for the whole process, so every session shares the data and its aggregates
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(name, loader, lowest_columns, prepare=None, select=None, statistics=(), weight_column=None,
+              market_column=None):
+    """
+    Returns the shared store of a tab, loader is only called for the first session.
+    When select is given it returns the file to load and loader reads that path
+    """
+    with _stores_lock:
+        if name not in _stores:
+            path = select() if select is not None else None
+            start = time.perf_counter()
+            data = loader(path) if select is not None else loader()
+            _stores[name] = DataStore(data, lowest_columns, name=name, prepare=prepare, path=path,
+                                      statistics=statistics, weight_column=weight_column,
+                                      market_column=market_column)
+            _stores[name].load_seconds = time.perf_counter() - start
+        return _stores[name]
+
+
+def append_batch(name, batch):
+    """
+    Appends a new batch of quotes to a loaded tab, the open sessions refresh themselves
+    """
+    _stores[name].append(batch)
+
+
+def read_file(path):
+    """
+    Reads a csv or pickle file of quotes
+    """
+    if path.lower().endswith('.csv'):
+        return pd.read_csv(path, low_memory=False)
+    return pd.read_pickle(path)
+
+
+def append_file(name, path):
+    """
+    Appends a csv or pickle file of quotes to a loaded tab
+    """
+    append_batch(name, read_file(path))
@@ -0,0 +1,231 @@
+import threading
+import numpy as np
+from bokeh.layouts import column, row
+from bokeh.models import ColumnDataSource
+from bokeh.models.widgets import Button, DataTable, Div, NumberFormatter, Select, TableColumn
+from DataStore import histogram_bins
+
+
+class QuoteIndex(object):
+    """
+    Rows of the quotes sorted on one target column, for paging through the quotes of a bin. Per premium column
+    and direction the rows are also sorted by premium within each target value, with every row keyed by
+    (target value, position in the premium order of all the quotes). A bin covers consecutive target values, so
+    a page of it sorted by premium is a merge of one sorted run per value, and its first row is found by a
+    bisection over the premium order: a page costs a few searches per target value of the bin whatever the
+    number of quotes in it.
+    Missing premiums sort last in both directions.
+
+    data = dataframe of quotes
+    premiums = premium matrix of data, rows x premium columns
+    """
+
+    def __init__(self, data, target_column, premiums):
+        target = data[target_column].to_numpy(dtype=float)
+        rows = np.flatnonzero(~np.isnan(target))
+        self.values, inverse = np.unique(target[rows], return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        # Rows by target value, and where the rows of each value start
+        self.rows = rows[order]
+        self.starts = np.searchsorted(inverse[order], np.arange(len(self.values) + 1))
+        self.inverse = inverse
+        self.target_rows = rows
+        self.premiums = premiums
+        self.orders = {}
+        self.lock = threading.Lock()
+
+    def _order(self, column, descending):
+        """
+        Keys (target value index * rows + premium position) sorted, and the rows in the same order
+        """
+        with self.lock:
+            if (column, descending) not in self.orders:
+                premium = self.premiums[self.target_rows, column]
+                key = np.where(np.isnan(premium), np.inf, -premium if descending else premium)
+                position = np.empty(len(key), dtype=np.int64)
+                position[np.argsort(key, kind='stable')] = np.arange(len(key))
+                keys = self.inverse * np.int64(len(key)) + position
+                order = np.argsort(keys, kind='stable')
+                self.orders[column, descending] = (keys[order], self.target_rows[order])
+            return self.orders[column, descending]
+
+    def bin_values(self, left, right, include_end=False):
+        """
+        First and last + 1 target value index of left <= value < right, or value <= right with include_end
+        """
+        return (np.searchsorted(self.values, left, side='left'),
+                np.searchsorted(self.values, right, side='right' if include_end else 'left'))
+
+    def count(self, left, right, include_end=False):
+        first, last = self.bin_values(left, right, include_end)
+        return int(self.starts[last] - self.starts[first])
+
+    def page(self, left, right, offset, size, column=None, descending=False, include_end=False):
+        """
+        Rows offset to offset + size of the quotes with left <= value < right (value <= right with include_end),
+        by target value or by the premium of column (index in the premium matrix). Returns the rows and the
+        number of quotes in the bin
+        """
+        first, last = self.bin_values(left, right, include_end)
+        total = int(self.starts[last] - self.starts[first])
+        offset = min(max(offset, 0), total)
+        if column is None:
+            start = self.starts[first] + offset
+            return self.rows[start:min(start + size, self.starts[last])], total
+        keys, rows = self._order(column, descending)
+        n = np.int64(len(keys))
+        bases = np.arange(first, last, dtype=np.int64) * n
+        run_starts, run_ends = self.starts[first:last], self.starts[first + 1:last + 1]
+
+        # Highest premium position with exactly offset quotes of the bin before it
+        low, high = 0, int(n)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if (np.searchsorted(keys, bases + middle) - run_starts).sum() <= offset:
+                low = middle
+            else:
+                high = middle - 1
+        cuts = np.searchsorted(keys, bases + low)
+        # The next size quotes of each run hold the page
+        candidates = np.concatenate([np.arange(cut, min(cut + size, end)) for cut, end in zip(cuts, run_ends)]
+                                    or [np.zeros(0, dtype=np.int64)])
+        candidates = candidates[np.argsort(keys[candidates] % n, kind='stable')][:size]
+        return rows[candidates], total
+
+
+class DrillDown(object):
+    """
+    Quote indexes of a store per target column, built the first time a bin of the column is opened and dropped
+    when the store changes
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.indexes = {}
+        self.lock = threading.Lock()
+        store.add_listener(self.indexes.clear)
+
+    def index(self, target_column):
+        with self.lock:
+            if target_column not in self.indexes:
+                self.indexes[target_column] = QuoteIndex(self.store.frame, target_column, self.store.premiums())
+            return self.indexes[target_column]
+
+
+# One set of quote indexes per store, kept by the store
+def get_drilldown(store):
+    return store.derived(__name__, DrillDown)
+
+
+class DrillDownTable(object):
+    """
+    Quotes of the distribution bar selected in a session, a page at a time, sorted by the X axis value or by the
+    premium of a company, with the premium of every company and the cheapest one. Holds the source of the table
+    and its sorting and paging widgets; table is the DataTable make_plot drew from them, its X axis column follows
+    the axis
+
+    registry = CompanyRegistry of the tab
+    market_store = function returning the store of the market shown
+    src_dist = distribution source, the quotes of its selected bar are listed
+    x_axis, range_select, binwidth_select = widgets of the tab giving the X axis column and its bins
+    rows = quotes per page
+    """
+
+    def __init__(self, registry, market_store, src_dist, x_axis, range_select, binwidth_select, rows=20):
+        self.registry = registry
+        self.market_store = market_store
+        self.src_dist = src_dist
+        self.x_axis = x_axis
+        self.range_select = range_select
+        self.binwidth_select = binwidth_select
+        self.rows = rows
+        self.page = 0
+        self.sort_select = Select(title="Sort Quotes By", value='value',
+                                  options=[('value', 'X Axis')] + [(str(company.code), company.name)
+                                                                   for company in registry])
+        self.sort_select.on_change('value', self.update)
+        self.order_select = Select(title="Order", value='ascending',
+                                   options=[('ascending', 'Ascending'), ('descending', 'Descending')])
+        self.order_select.on_change('value', self.update)
+        self.previous_button = Button(label='Previous', width=100)
+        self.previous_button.on_click(lambda: self.turn_page(-1))
+        self.next_button = Button(label='Next', width=100)
+        self.next_button.on_click(lambda: self.turn_page(1))
+        self.status = Div(width=800)
+        self.src = ColumnDataSource(self.make_dataset()[0])
+        self.table = None
+        src_dist.selected.on_change('indices', self.update)
+
+    def make_dataset(self, page=0):
+        """
+        One page of the quotes of the bar selected. Returns the data, the number of quotes of the bar and its
+        edges, None when no bar is selected
+        """
+        registry = self.registry
+        data = dict((name, []) for name in ['policy', 'value', 'cheapest'] +
+                    ['premium_%d' % company.code for company in registry])
+        selected = self.src_dist.selected.indices
+        edges = histogram_bins(np.zeros(0), self.range_select.value[0], self.range_select.value[1],
+                               self.binwidth_select.value)[1]
+        if not selected or selected[0] >= len(edges) - 1:
+            return data, 0, None
+        i = selected[0]
+        current = self.market_store()
+        index = get_drilldown(current).index(self.x_axis.value)
+        rows, total = index.page(edges[i], edges[i + 1], page * self.rows, self.rows,
+                                 None if self.sort_select.value == 'value' else int(self.sort_select.value),
+                                 self.order_select.value == 'descending', include_end=i == len(edges) - 2)
+        frame = current.frame
+        premiums = current.premiums()[rows]
+        data['policy'] = (frame['Policy No'].to_numpy()[rows] if 'Policy No' in frame else rows).tolist()
+        data['value'] = frame[self.x_axis.value].to_numpy(dtype=float)[rows]
+        # Cheapest as idxmin, missing premiums skipped
+        cheapest = np.where(np.isnan(premiums), np.inf, premiums).argmin(axis=1)
+        data['cheapest'] = [registry[int(code)].name if quoted else ''
+                            for code, quoted in zip(cheapest, ~np.isnan(premiums).all(axis=1))]
+        for company in registry:
+            data['premium_%d' % company.code] = premiums[:, company.code]
+        return data, total, (edges[i], edges[i + 1])
+
+    def make_plot(self, src, sort_select, order_select, previous_button, next_button, status):
+        """
+        Table of the quotes of the selected distribution bar under its sorting and paging controls
+        """
+        columns = ([TableColumn(field='policy', title='Policy No'),
+                    TableColumn(field='value', title=self.x_axis.value)] +
+                   [TableColumn(field='premium_%d' % company.code, title=company.name,
+                                formatter=NumberFormatter(format='$0,0')) for company in self.registry] +
+                   [TableColumn(field='cheapest', title='Cheapest')])
+        # Only one page is sent, sorting happens on the server
+        table = DataTable(source=src, columns=columns, width=1200, height=550, sortable=False,
+                          index_position=None)
+        return column(row(sort_select, order_select), row(previous_button, next_button, status), table,
+                      name='drilldown')
+
+    def refresh(self):
+        data, total, edges = self.make_dataset(self.page)
+        self.src.data = data
+        x_column = self.x_axis.value
+        if self.table is not None:
+            self.table.columns[1].title = x_column
+        if edges is None:
+            self.status.text = 'Click a bar of the distribution to list its quotes'
+        elif total == 0:
+            self.status.text = 'No quotes with %s from %g to %g' % (x_column, edges[0], edges[1])
+        else:
+            first = self.page * self.rows
+            self.status.text = 'Quotes %d to %d of %d with %s from %g to %g' % (
+                min(first + 1, total), min(first + self.rows, total), total, x_column, edges[0], edges[1])
+        self.previous_button.disabled = self.page == 0
+        self.next_button.disabled = (self.page + 1) * self.rows >= total
+
+    def first_page(self):
+        self.page = 0
+        self.refresh()
+
+    def update(self, attr, old, new):
+        self.first_page()
+
+    def turn_page(self, step):
+        self.page = max(self.page + step, 0)
+        self.refresh()
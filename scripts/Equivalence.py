@@ -0,0 +1,285 @@
+import argparse
+import multiprocessing
+import sys
+import warnings
+import numpy as np
+import pandas as pd
+from bokeh.models import ColumnDataSource
+from bokeh.models.widgets import RangeSlider, Select, Slider
+from Benchmark import report
+from DataStore import DataStore
+from GridCube import grid_y_bins
+import Kernels
+import SyntheticData
+
+# Sources of the builders checked, found in a tab by a column only they have
+builders = {'dataset': 'top', 'distribution': 'proportion', 'winrate': 'VS', 'heatmap': 'premium_gap'}
+# Columns of the heatmap checked against the raw quotes
+heatmap_columns = ['count', 'win_rate', 'premium_gap']
+# Columns that only depend on the order of the win rate rows, which is arbitrary among companies with the same count
+order_columns = ['index', 'cumulative_angle', 'cos', 'sin']
+
+
+# ===========================================================================
+# Engines checked against the pandas reference (the tabs without a backend)
+# ===========================================================================
+def index_engine(store):
+    return store
+
+
+def numba_engine(store):
+    Kernels.use_kernel('numba')
+    return store
+
+
+def sql_engine(name):
+    def engine(store):
+        from SqlBackend import SqlBackend
+        return SqlBackend(store.frame, store.lowest_columns, name=store.name, engine=name)
+    return engine
+
+
+engines = {'index': index_engine, 'numba': numba_engine, 'sqlite': sql_engine('sqlite'),
+           'duckdb': sql_engine('duckdb')}
+
+
+def random_quotes(tab, rows, rng):
+    """
+    Synthetic quotes with a random share of missing and zero premiums and a random rounding, down to premiums
+    rounded to 100 where ties between companies are frequent
+    """
+    return SyntheticData.quotes(tab, rows=rows, seed=rng.randint(2 ** 31), missing=rng.uniform(0, 0.15),
+                                zeros=rng.uniform(0, 0.15), rounding=rng.choice([0.01, 1, 100]))
+
+
+def select_column(panel, target_column):
+    """
+    Switches the X axis from the finest bins, the range of the new column is set before its bin width
+    """
+    binwidth_select = panel.select_one({'type': Slider, 'title': 'Bin Width'})
+    x_axis = panel.select_one({'type': Select, 'title': 'X Axis'})
+    if x_axis.value != target_column:
+        binwidth_select.value = binwidth_select.start
+        x_axis.value = target_column
+
+
+def states(panel, rng, count):
+    """
+    Slider states of each X axis option: the whole range with the finest bins, a narrow range with the widest
+    ones, then count random ranges and bin widths. Ranges narrower than a bin have no bins and are left out
+    """
+    x_axis = panel.select_one({'type': Select, 'title': 'X Axis'})
+    range_select = panel.select_one({'type': RangeSlider})
+    binwidth_select = panel.select_one({'type': Slider, 'title': 'Bin Width'})
+    for target_column in x_axis.options:
+        select_column(panel, target_column)
+        start, end, step = range_select.start, range_select.end, range_select.step
+        yield target_column, (start, end), binwidth_select.start
+        narrow = step * max(2, -(-binwidth_select.end // step))
+        yield target_column, (start + step, start + step + narrow), binwidth_select.end
+        handles = np.arange(start, end + step, step)
+        bin_widths = np.arange(binwidth_select.start, binwidth_select.end + binwidth_select.step,
+                               binwidth_select.step)
+        for _ in range(count):
+            low, high = sorted(rng.choice(len(handles), 2, replace=False))
+            bin_width = rng.choice(bin_widths[bin_widths <= handles[high] - handles[low]])
+            yield target_column, (handles[low], handles[high]), bin_width
+
+
+def set_state(panel, target_column, value, bin_width):
+    range_select = panel.select_one({'type': RangeSlider})
+    select_column(panel, target_column)
+    # Through the whole range, no intermediate state is narrower than a bin
+    range_select.value = (range_select.start, range_select.end)
+    panel.select_one({'type': Slider, 'title': 'Bin Width'}).value = int(bin_width)
+    range_select.value = (int(value[0]), int(value[1]))
+
+
+def sources(panel):
+    """
+    Data of the builder sources of a tab, the win rate rows sorted by company
+    """
+    found = {}
+    for source in panel.select({'type': ColumnDataSource}):
+        for name, column in builders.items():
+            if column in source.data:
+                data = dict(source.data)
+                if name == 'winrate':
+                    order = np.argsort(np.asarray(data['VS'], dtype=str), kind='stable')
+                    data = {key: np.asarray(values)[order] for key, values in data.items()
+                            if key not in order_columns}
+                found[name] = data
+    return found
+
+
+def heatmap_reference(data, module, target_column, value, bin_width, y_column):
+    """
+    Heatmap values of the quotes counted with pandas crosstabs of the raw rows: the X bins of the slider settings
+    by equal bins over all the Y values, in the order of the heatmap source (X bin major)
+    """
+    quotes = data.dropna(subset=[target_column, y_column])
+    x_edges = np.histogram_bin_edges([], bins=int((value[1] - value[0]) / bin_width), range=value)
+    y_edges = np.histogram_bin_edges(quotes[y_column], bins=grid_y_bins)
+    quotes = quotes[(value[0] <= quotes[target_column]) & (quotes[target_column] <= value[1])]
+    x_bin = pd.Series(np.clip(np.digitize(quotes[target_column], x_edges) - 1, 0, len(x_edges) - 2),
+                      index=quotes.index, name='x')
+    y_bin = pd.Series(np.clip(np.digitize(quotes[y_column], y_edges) - 1, 0, len(y_edges) - 2),
+                      index=quotes.index, name='y')
+    gfb_column = module.policy_dictionary['GFB'][1]
+    premiums = quotes[module.lowest_columns]
+    nonzero = premiums.where(premiums != 0)
+    others = nonzero.drop(columns=gfb_column)
+    quoted = premiums.notna().any(axis=1)
+
+    def crosstab(values=None):
+        if values is None:
+            table = pd.crosstab(x_bin, y_bin)
+        else:
+            table = pd.crosstab(x_bin, y_bin, values=values, aggfunc='sum')
+        return table.reindex(index=range(len(x_edges) - 1), columns=range(grid_y_bins),
+                             fill_value=0).fillna(0).to_numpy().ravel()
+
+    wins = crosstab((quoted & (premiums.idxmin(axis=1) == gfb_column)).astype(int))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gfb_average = crosstab(nonzero[gfb_column].fillna(0)) / crosstab(nonzero[gfb_column].notna().astype(int))
+        other_average = crosstab(others.sum(axis=1)) / crosstab(others.notna().sum(axis=1))
+        return {'count': crosstab(), 'win_rate': wins / crosstab(quoted.astype(int)),
+                'premium_gap': gfb_average / other_average - 1}
+
+
+class Differences(object):
+    """
+    Largest differences between the reference and an engine over the states checked, per builder
+    """
+
+    def __init__(self):
+        self.states = 0
+        self.max_abs = 0.0
+        self.max_rel = 0.0
+        self.worst = ''
+        # NaN on one side only (an empty bin or a company without a non zero quote against a number)
+        self.nan_mismatches = 0
+        self.nan_cells = 0
+        # Text, company and count cells that differ, and columns or rows missing on one side
+        self.other_mismatches = 0
+
+    def compare(self, reference, optimized, where):
+        self.states += 1
+        if set(reference) != set(optimized):
+            self.other_mismatches += len(set(reference) ^ set(optimized))
+        for column in set(reference) & set(optimized):
+            left, right = np.asarray(reference[column]), np.asarray(optimized[column])
+            if left.shape != right.shape:
+                self.other_mismatches += 1
+            elif left.dtype.kind in 'fc' or right.dtype.kind in 'fc':
+                left, right = left.astype(float), right.astype(float)
+                left_nan, right_nan = np.isnan(left), np.isnan(right)
+                self.nan_cells += int((left_nan & right_nan).sum())
+                self.nan_mismatches += int((left_nan != right_nan).sum())
+                both = ~left_nan & ~right_nan
+                if not both.any():
+                    continue
+                difference = np.abs(left[both] - right[both])
+                scale = np.maximum(np.abs(left[both]), np.abs(right[both]))
+                relative = np.where(scale > 0, difference / np.where(scale > 0, scale, 1), 0)
+                if relative.max() > self.max_rel:
+                    self.worst = '%s %s' % (column, where)
+                self.max_abs = max(self.max_abs, difference.max())
+                self.max_rel = max(self.max_rel, relative.max())
+            else:
+                self.other_mismatches += int((left.astype(str) != right.astype(str)).sum())
+
+    def add(self, other):
+        if other.max_rel > self.max_rel:
+            self.worst = other.worst
+        self.states += other.states
+        self.max_abs = max(self.max_abs, other.max_abs)
+        self.max_rel = max(self.max_rel, other.max_rel)
+        self.nan_mismatches += other.nan_mismatches
+        self.nan_cells += other.nan_cells
+        self.other_mismatches += other.other_mismatches
+
+    def passed(self, tolerance):
+        return self.max_rel <= tolerance and self.nan_mismatches == 0 and self.other_mismatches == 0
+
+
+def check(tab, engine_name, seed, rows, count):
+    """
+    Differences per builder of the tab on engine_name against the pandas reference, on the random quotes of seed
+    and over the states of every X axis option. The heatmap, which every engine reads from the same cubes, is
+    held to crosstabs of the raw quotes instead. Run in a process of its own, as the kernel of an engine and the
+    shared result cache last for the life of the process
+    """
+    module = SyntheticData.tabs[tab]
+    rng = np.random.RandomState(seed)
+    data = random_quotes(tab, rows, rng)
+    # A store of its own per side, so neither reads results or aggregates the other computed
+    reference = module._tab(DataStore(data, module.lowest_columns, name=tab + '-reference'))
+    store = DataStore(data, module.lowest_columns, name=tab + '-' + engine_name)
+    optimized = module._tab(store, backend=engines[engine_name](store))
+    differences = {name: Differences() for name in builders}
+    for target_column, value, bin_width in states(reference, rng, count):
+        for panel in [reference, optimized]:
+            set_state(panel, target_column, value, bin_width)
+        where = '(%s %s to %s by %s)' % (target_column, value[0], value[1], bin_width)
+        expected, found = sources(reference), sources(optimized)
+        y_column = optimized.select_one({'type': Select, 'title': 'Heatmap Y Axis'}).value
+        expected['heatmap'] = heatmap_reference(data, module, target_column, value, bin_width, y_column)
+        found['heatmap'] = dict((column, found['heatmap'][column]) for column in heatmap_columns)
+        for name in builders:
+            differences[name].compare(expected[name], found[name], where)
+    return differences
+
+
+def available(engine_name):
+    """
+    Whether the optional package an engine needs is installed
+    """
+    if engine_name in ['numba', 'duckdb']:
+        try:
+            __import__(engine_name)
+        except ImportError:
+            return False
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Checks that the optimised engines build the same chart data as '
+                                                 'the pandas reference, on random synthetic quotes')
+    parser.add_argument('--tabs', nargs='*', default=list(SyntheticData.tabs), choices=list(SyntheticData.tabs))
+    parser.add_argument('--engines', nargs='*', default=list(engines), choices=list(engines),
+                        help='Engines to check, the ones whose package is not installed are skipped')
+    parser.add_argument('--rows', type=int, default=20000,
+                        help='Quotes of the largest data set, every other seed uses a tenth of it so that bins are '
+                             'empty')
+    parser.add_argument('--seeds', type=int, default=4, help='Random data sets per tab')
+    parser.add_argument('--states', type=int, default=3, help='Random slider states per X axis option')
+    parser.add_argument('--tolerance', type=float, default=1e-9, help='Largest relative difference accepted')
+    args = parser.parse_args()
+    # The pandas and bokeh deprecation warnings of the reference code would bury the report
+    warnings.simplefilter('ignore')
+
+    rows = []
+    # A new process per check, started afresh rather than forked from this one
+    pool = multiprocessing.get_context('spawn').Pool(1, initializer=warnings.simplefilter, initargs=('ignore',),
+                                                     maxtasksperchild=1)
+    for engine_name in args.engines:
+        if not available(engine_name):
+            print('Skipping %s, its package is not installed' % engine_name)
+            continue
+        for tab in args.tabs:
+            totals = {name: Differences() for name in builders}
+            for seed in range(args.seeds):
+                checked = pool.apply(check, (tab, engine_name, seed, args.rows if seed % 2 == 0 else args.rows // 10,
+                                             args.states))
+                for name, differences in checked.items():
+                    totals[name].add(differences)
+            for name, total in totals.items():
+                rows.append({'engine': engine_name, 'tab': tab, 'builder': name, 'states': total.states,
+                             'max_abs': '%.3g' % total.max_abs, 'max_rel': '%.3g' % total.max_rel,
+                             'nan_cells': total.nan_cells, 'nan_mismatches': total.nan_mismatches,
+                             'other_mismatches': total.other_mismatches,
+                             'result': 'ok' if total.passed(args.tolerance) else 'FAILED ' + total.worst})
+    pool.close()
+    report('equivalence', rows)
+    sys.exit(0 if all(row['result'] == 'ok' for row in rows) else 1)
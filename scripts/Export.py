@@ -0,0 +1,127 @@
+import argparse
+import numpy as np
+from bokeh.embed import file_html
+from bokeh.models import ColumnDataSource, CustomJS, LinearAxis
+from bokeh.models.widgets import Tabs, Select, Slider, RangeSlider
+from bokeh.resources import INLINE
+import PolicyTab
+import VehicleTab
+import HomeTab
+from DataStore import DataStore, read_file
+from PremiumChart import browser_sources
+
+# Same tabs and data preparation as Main.py
+tabs = [('policy', PolicyTab, None),
+        ('vehicle', VehicleTab, lambda data: data.fillna(0)),
+        ('home', HomeTab, None)]
+
+# Copies the precomputed state of the selected X axis into the plots, nothing is sent to a server
+switch_code = """
+var state = states[cb_obj.value];
+for (var i = 0; i < sources.length; i++) {
+    sources[i].data = state.sources[i].data;
+}
+range_select.start = state.range_start;
+range_select.end = state.range_end;
+range_select.value = state.range;
+binwidth_select.start = state.bin_start;
+binwidth_select.end = state.bin_end;
+binwidth_select.value = state.bin_width;
+for (var i = 0; i < axes.length; i++) {
+    axes[i].axis_label = state.labels[i];
+}
+"""
+
+
+def _packed(data):
+    """
+    Copy of the data of a source with 32 bit numbers, which are sent as binary arrays
+    """
+    packed = {}
+    for column, values in data.items():
+        values = np.asarray(values)
+        if values.dtype.kind == 'f':
+            values = values.astype(np.float32)
+        elif values.dtype.kind in 'iu':
+            values = values.astype(np.int32)
+        else:
+            values = list(values)
+        packed[column] = values
+    return packed
+
+
+def freeze(tab):
+    """
+    Precomputes a tab for every X axis option with the range and bin width update_axis presets for it,
+    then replaces the server callbacks with a CustomJS switching between the precomputed states and hides the
+    charts that need the server
+    """
+    x_axis = tab.select_one({'type': Select, 'title': 'X Axis'})
+    range_select = tab.select_one({'type': RangeSlider})
+    binwidth_select = tab.select_one({'type': Slider, 'title': 'Bin Width'})
+    # The lines of the premium chart follow the distribution in the browser
+    sources = [source for source in tab.select({'type': ColumnDataSource}) if source.name not in browser_sources]
+    axes = list(tab.select({'type': LinearAxis}))
+
+    states = {}
+    for option in x_axis.options:
+        if x_axis.value == option:
+            x_axis.trigger('value', option, option)
+        else:
+            x_axis.value = option
+        states[option] = {'sources': [ColumnDataSource(_packed(source.data)) for source in sources],
+                          'range_start': range_select.start, 'range_end': range_select.end,
+                          'range': list(range_select.value),
+                          'bin_start': binwidth_select.start, 'bin_end': binwidth_select.end,
+                          'bin_width': binwidth_select.value,
+                          'labels': [axis.axis_label for axis in axes]}
+
+    x_axis.value = x_axis.options[0]
+
+    # Only the presets were computed, the sliders show them but cannot move
+    for widget in list(tab.select({'type': Select})) + list(tab.select({'type': Slider})):
+        if widget is not x_axis and widget is not binwidth_select:
+            widget.visible = False
+    range_select.disabled = True
+    binwidth_select.disabled = True
+    # The quotes of a bar, the similar quotes and the quotes in view of the scatter are looked up by the server
+    tab.select_one({'name': 'drilldown'}).visible = False
+    tab.select_one({'name': 'similar'}).visible = False
+    tab.select_one({'name': 'scatter'}).visible = False
+    # Nor can the server callbacks of the widgets and ranges run, bokeh warns about them when the file is written
+    for model in tab.references():
+        model._callbacks.clear()
+        model._event_callbacks.clear()
+    x_axis.js_on_change('value', CustomJS(args=dict(states=states, sources=sources, axes=axes,
+                                                    range_select=range_select,
+                                                    binwidth_select=binwidth_select),
+                                          code=switch_code))
+    return tab
+
+
+def export(paths, filename, title='Insurance Competitive Dashboard'):
+    """
+    Writes a standalone html dashboard of the given data files, read only and without a server
+
+    paths = data file of each tab by name ('policy', 'vehicle', 'home'), tabs without a file are left out
+    """
+    panels = []
+    for name, module, prepare in tabs:
+        if paths.get(name):
+            store = DataStore(read_file(paths[name]), module.lowest_columns, name=name, prepare=prepare)
+            panels.append(freeze(module._tab(store, backend=store)))
+    html = file_html(Tabs(tabs=panels), INLINE, title)
+    with open(filename, 'w', encoding='utf-8') as output:
+        output.write(html)
+    return len(html)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports the dashboard as a standalone html file')
+    parser.add_argument('--policy', help='Policy data file (pickle or csv)')
+    parser.add_argument('--vehicle', help='Vehicle data file (pickle or csv)')
+    parser.add_argument('--home', help='Home data file (csv or pickle)')
+    parser.add_argument('--output', default='dashboard.html', help='html file to write')
+    args = parser.parse_args()
+    size = export({'policy': args.policy, 'vehicle': args.vehicle, 'home': args.home}, args.output)
+    print('Wrote %s (%.1f MB)' % (args.output, size / 1e6))
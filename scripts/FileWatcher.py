@@ -0,0 +1,100 @@
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FileWatcher(object):
+    """
+    Polls the data files of the shared stores and hot reloads a file once it has changed and stopped changing.
+    Reading the file and rebuilding the aggregates happen on the watcher thread, so the session callbacks are
+    never blocked; the store swaps the new data in at once and each open session recomputes one time.
+
+    interval = seconds between two polls
+    """
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self.watched = {}
+        self.reports = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name='FileWatcher')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def watch(self, store, reader):
+        """
+        store = DataStore loaded from store.path
+        reader = function reading the file at a path into a dataframe
+        """
+        with self.lock:
+            if store.path not in self.watched:
+                signature = _signature(store.path)
+                self.watched[store.path] = {'store': store, 'reader': reader,
+                                            'signature': signature, 'pending': signature}
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                watched = list(self.watched.values())
+            for entry in watched:
+                signature = _signature(entry['store'].path)
+                if signature is None or signature == entry['signature']:
+                    entry['pending'] = entry['signature']
+                elif signature != entry['pending']:
+                    # Still being written, wait until it stays the same for a whole interval
+                    entry['pending'] = signature
+                else:
+                    entry['signature'] = signature
+                    try:
+                        self.reload(entry['store'], entry['reader'])
+                    except Exception:
+                        log.exception("Reloading %s failed, the previous data is still served", entry['store'].path)
+
+    def reload(self, store, reader):
+        """
+        Reads the file of the store again and swaps it in, returns the timings
+        """
+        start = time.perf_counter()
+        data = reader(store.path)
+        read_seconds = time.perf_counter() - start
+        swap_seconds = store.replace(data)
+        report = {'store': store.name, 'path': store.path, 'rows': len(data),
+                  'read_seconds': read_seconds,
+                  'reload_seconds': time.perf_counter() - start,
+                  'swap_seconds': swap_seconds}
+        self.reports.append(report)
+        log.info("Reloaded %(store)s from %(path)s: %(rows)d rows, read %(read_seconds).3fs, "
+                 "reload %(reload_seconds).3fs, swap %(swap_seconds).6fs", report)
+        return report
+
+
+# One watcher thread for the whole process
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def watch(store, reader, interval=2.0):
+    """
+    Starts watching the file of a store, only the first call starts the thread
+    """
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = FileWatcher(interval)
+            _watcher.start()
+        _watcher.watch(store, reader)
+    return _watcher
@@ -0,0 +1,206 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from bokeh.models import ColorBar, ColumnDataSource, HoverTool, LinearColorMapper, NumeralTickFormatter
+from bokeh.models.widgets import Select
+from bokeh.palettes import Viridis256, RdYlGn11
+from bokeh.plotting import figure
+from Companies import premium_matrix
+from DataStore import histogram_bins
+
+# Heatmap values a grid offers, with their labels
+grid_metrics = [('win_rate', 'GFB Win Rate'), ('premium_gap', 'GFB Premium Gap')]
+# Equal bins over the Y axis column of the heatmaps
+grid_y_bins = 10
+# Cubes kept per store, the least recently shown go first
+max_cubes = 8
+
+
+def _running(cells):
+    """
+    Running sums of per cell values over the first axis, padded with a leading row of zeros
+    """
+    table = np.zeros((cells.shape[0] + 1,) + cells.shape[1:], dtype=cells.dtype)
+    table[1:] = cells.cumsum(axis=0)
+    return table
+
+
+class GridCube(object):
+    """
+    Aggregates of the quotes for every distinct value of one target column by y_bins equal bins over all the
+    values of another: quote count, sum and number of the non zero GFB premiums and of the other premiums, number
+    of quoted quotes and of GFB wins. The slider bins of the X axis can fall anywhere between two distinct values,
+    so X is never bucketed further; the Y bins are the ones the heatmap shows, so they are aggregated directly and
+    a cube is (distinct X values x y_bins) cells whatever the number of quotes. The rows are read once; the cells
+    are kept as running sums over X, so any X range and bin width costs two lookups per grid bin.
+
+    data = dataframe of quotes
+    columns = premium columns in lowest_columns order, ties for the cheapest go to the first one
+    gfb_column = premium column the grid values are computed for
+    y_bins = equal bins over all the Y values
+    premiums = premium matrix of data in columns order, extracted from data when not given
+    """
+
+    def __init__(self, data, columns, x_column, y_column, gfb_column, y_bins, premiums=None):
+        self.columns = list(columns)
+        self.gfb = self.columns.index(gfb_column)
+        x = data[x_column].to_numpy(dtype=float)
+        y = data[y_column].to_numpy(dtype=float)
+        keep = ~np.isnan(x) & ~np.isnan(y)
+        premiums = (premium_matrix(data, columns) if premiums is None else premiums)[keep]
+        self.x_values, x_index = np.unique(x[keep], return_inverse=True)
+        # Y bins as np.histogram over all the values, the last bin includes the largest value
+        self.y_edges = np.histogram_bin_edges(y[keep], bins=y_bins)
+        y_index = np.clip(np.searchsorted(self.y_edges, y[keep], side='right') - 1, 0, y_bins - 1)
+        nx = len(self.x_values)
+        cell = x_index * y_bins + y_index
+
+        def by_cell(rows, weights=None):
+            return _running(np.bincount(cell[rows], None if weights is None else weights[rows],
+                                        minlength=nx * y_bins).reshape(nx, y_bins))
+
+        missing = np.isnan(premiums)
+        nonzero = ~missing & (premiums != 0)
+        others = np.arange(len(self.columns)) != self.gfb
+        # Cheapest company as idxmin: missing premiums skipped, ties to the first column
+        lowest = np.where(missing, np.inf, premiums).argmin(axis=1)
+        quoted = ~missing.all(axis=1)
+        every = slice(None)
+        self.count = by_cell(every)
+        self.gfb_sum = by_cell(nonzero[:, self.gfb], premiums[:, self.gfb])
+        self.gfb_count = by_cell(nonzero[:, self.gfb])
+        self.other_sum = by_cell(every, np.where(nonzero[:, others], premiums[:, others], 0).sum(axis=1))
+        self.other_count = by_cell(every, nonzero[:, others].sum(axis=1).astype(float))
+        self.quoted = by_cell(quoted)
+        self.gfb_wins = by_cell(quoted & (lowest == self.gfb))
+
+    def grid(self, x_start, x_end, x_width):
+        """
+        Grid of the X bins of the slider settings (as np.histogram) by the Y bins of the cube.
+        Returns the X and Y bin edges and, per grid bin, the quote count, the GFB win rate among the quoted quotes
+        and the gap of the GFB average non zero premium to the average of the other companies
+        """
+        x_bins, x_edges = histogram_bins(self.x_values, x_start, x_end, x_width)
+        inside = np.flatnonzero(x_bins >= 0)
+        first = inside[0] if len(inside) else 0
+        x_cuts = first + np.searchsorted(x_bins[first:first + len(inside)], np.arange(len(x_edges)))
+
+        def binned(table):
+            return table[x_cuts[1:]] - table[x_cuts[:-1]]
+
+        count = binned(self.count)
+        gfb_count, other_count = binned(self.gfb_count), binned(self.other_count)
+        # Empty bins keep the rounding left by the table differences, their averages are missing
+        with np.errstate(invalid='ignore', divide='ignore'):
+            win_rate = binned(self.gfb_wins) / binned(self.quoted)
+            gfb_average = np.where(gfb_count > 0, binned(self.gfb_sum) / gfb_count, np.nan)
+            other_average = np.where(other_count > 0, binned(self.other_sum) / other_count, np.nan)
+            premium_gap = gfb_average / other_average - 1
+        return x_edges, self.y_edges, {'count': count, 'win_rate': win_rate, 'premium_gap': premium_gap}
+
+
+class GridCubes(object):
+    """
+    Cubes of a store per pair of target columns and number of Y bins, built the first time they are shown and
+    dropped when the store changes. The size most recently shown are kept
+    """
+
+    def __init__(self, store, gfb_column, size=max_cubes):
+        self.store = store
+        self.gfb_column = gfb_column
+        self.size = size
+        self.cubes = OrderedDict()
+        self.lock = threading.Lock()
+        store.add_listener(self.cubes.clear)
+
+    def cube(self, x_column, y_column, y_bins):
+        key = (x_column, y_column, y_bins)
+        with self.lock:
+            if key in self.cubes:
+                self.cubes.move_to_end(key)
+            else:
+                self.cubes[key] = GridCube(self.store.frame, self.store.lowest_columns, x_column, y_column,
+                                           self.gfb_column, y_bins, self.store.premiums())
+                while len(self.cubes) > self.size:
+                    self.cubes.popitem(last=False)
+            return self.cubes[key]
+
+
+# One set of cubes per store, kept by the store
+def get_cubes(store, gfb_column):
+    return store.derived(__name__, lambda store: GridCubes(store, gfb_column))
+
+
+class HeatmapChart(object):
+    """
+    GFB win rate or premium gap to the other companies over the X axis bins by equal bins of a second column, in a
+    session. Holds the source of the heatmap, its color mapper and the widgets picking the second column and the
+    value shown; plot is the figure make_plot drew, its Y axis label follows the column
+
+    market_store = function returning the store of the market shown
+    gfb_column = premium column the values are computed for
+    target_columns = columns offered for the Y axis
+    y_column = Y axis column shown first
+    x_axis, range_select, binwidth_select = widgets of the tab giving the X axis column and its bins
+    """
+
+    def __init__(self, market_store, gfb_column, target_columns, y_column, x_axis, range_select, binwidth_select):
+        self.market_store = market_store
+        self.gfb_column = gfb_column
+        self.x_axis = x_axis
+        self.range_select = range_select
+        self.binwidth_select = binwidth_select
+        self.y_axis = Select(title="Heatmap Y Axis", options=target_columns, value=y_column)
+        self.y_axis.on_change('value', self.update)
+        self.metric_select = Select(title="Heatmap", value='win_rate', options=grid_metrics)
+        self.metric_select.on_change('value', self.update)
+        self.mapper = LinearColorMapper(palette=Viridis256, low=0, high=1)
+        self.src = ColumnDataSource(self.make_dataset())
+        self.plot = None
+
+    def make_dataset(self):
+        """
+        Grid bins with their values, value holds the metric the heatmap is colored by
+        """
+        cube = get_cubes(self.market_store(), self.gfb_column).cube(self.x_axis.value, self.y_axis.value, grid_y_bins)
+        x_edges, y_edges, grid = cube.grid(self.range_select.value[0], self.range_select.value[1],
+                                           self.binwidth_select.value)
+        x_bin, y_bin = [index.ravel() for index in np.meshgrid(np.arange(len(x_edges) - 1),
+                                                               np.arange(len(y_edges) - 1), indexing='ij')]
+        data = {'x': (x_edges[:-1] + x_edges[1:])[x_bin] / 2, 'width': np.diff(x_edges)[x_bin],
+                'y': (y_edges[:-1] + y_edges[1:])[y_bin] / 2, 'height': np.diff(y_edges)[y_bin]}
+        for column, values in grid.items():
+            data[column] = values.ravel()
+        data['value'] = data[self.metric_select.value]
+        data['_x_interval'] = ['%d to %d' % (x_edges[b], x_edges[b + 1]) for b in x_bin]
+        data['_y_interval'] = ['%d to %d' % (y_edges[b], y_edges[b + 1]) for b in y_bin]
+        return data
+
+    def color(self, metric):
+        if metric == 'win_rate':
+            self.mapper.update(palette=Viridis256, low=0, high=1)
+        else:
+            # Green where GFB is cheaper than the other companies on average
+            self.mapper.update(palette=RdYlGn11, low=-0.3, high=0.3)
+
+    def make_plot(self, src, mapper):
+        p = figure(plot_width=1200, plot_height=300, title='Georgia Farm Competitiveness',
+                   x_axis_label=self.x_axis.value, y_axis_label=self.y_axis.value, tools="")
+        p.rect(x='x', y='y', width='width', height='height', source=src, line_color=None,
+               fill_color={'field': 'value', 'transform': mapper})
+        p.add_layout(ColorBar(color_mapper=mapper, formatter=NumeralTickFormatter(format='0%'),
+                              label_standoff=8, width=10, location=(0, 0)), 'right')
+        p.add_tools(HoverTool(tooltips=[('X', '[@_x_interval)'), ('Y', '[@_y_interval)'),
+                                        ('Win Rate', '@win_rate{0.0%}'), ('Premium Gap', '@premium_gap{+0.0%}'),
+                                        ('Policy Count', '@count')], toggleable=False))
+        p.toolbar.logo = None
+        return p
+
+    def refresh(self):
+        self.src.data.update(self.make_dataset())
+
+    def update(self, attr, old, new):
+        if self.plot is not None:
+            self.plot.yaxis.axis_label = self.y_axis.value
+        self.color(self.metric_select.value)
+        self.refresh()
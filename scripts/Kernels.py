@@ -0,0 +1,157 @@
+import numpy as np
+
+# Implementations of the aggregation kernels. numpy runs a few vectorised passes with temporary arrays, numba
+# compiles a single loop over the rows that fills every aggregate at once. Both give the same numbers
+kernels = ['numpy', 'numba']
+_selected = ['numpy']
+_compiled = {}
+
+
+# ===========================================================================
+# NumPy
+# ===========================================================================
+def _value_aggregates_numpy(inverse, n, premiums):
+    k = premiums.shape[1]
+    missing = np.isnan(premiums)
+    nonzero = ~missing & (premiums != 0)
+    lowest = np.where(missing, np.inf, premiums).argmin(axis=1)
+    quoted = ~missing.all(axis=1)
+    cell = (inverse[:, None] * k + np.arange(k)).ravel()
+
+    def by_cell(weights):
+        return np.bincount(cell, weights=weights.ravel(), minlength=n * k).reshape(n, k)
+
+    return {'count': np.bincount(inverse, minlength=n),
+            'premium_sum': by_cell(np.where(missing, 0, premiums)),
+            'premium_missing': by_cell(missing.astype(float)).astype(np.int64),
+            'nonzero_sum': by_cell(np.where(nonzero, premiums, 0)),
+            'nonzero_count': by_cell(nonzero.astype(float)).astype(np.int64),
+            'wins': np.bincount(inverse[quoted] * k + lowest[quoted], minlength=n * k).reshape(n, k)}
+
+
+def _rank_counts_numpy(inverse, n, premiums):
+    k = premiums.shape[1]
+    quoted = ~np.isnan(premiums) & (premiums != 0)
+    # Row-wise sort, the unranked premiums go last
+    order = np.argsort(np.where(quoted, premiums, np.inf), axis=1, kind='stable')
+    rank = np.empty_like(order)
+    rank[np.arange(len(premiums))[:, None], order] = np.arange(k)
+    cell = ((inverse[:, None] * k + np.arange(k)) * k + rank)[quoted]
+    return np.bincount(cell, minlength=n * k * k).reshape(n, k, k), np.where(quoted, rank, -1)
+
+
+# ===========================================================================
+# Numba, compiled the first time it is selected
+# ===========================================================================
+def _value_aggregates_loop(inverse, n, premiums):
+    rows, k = premiums.shape
+    count = np.zeros(n, dtype=np.int64)
+    premium_sum = np.zeros((n, k))
+    premium_missing = np.zeros((n, k), dtype=np.int64)
+    nonzero_sum = np.zeros((n, k))
+    nonzero_count = np.zeros((n, k), dtype=np.int64)
+    wins = np.zeros((n, k), dtype=np.int64)
+    for row in range(rows):
+        value = inverse[row]
+        count[value] += 1
+        lowest = -1
+        for i in range(k):
+            premium = premiums[row, i]
+            if np.isnan(premium):
+                premium_missing[value, i] += 1
+                continue
+            premium_sum[value, i] += premium
+            if premium != 0:
+                nonzero_sum[value, i] += premium
+                nonzero_count[value, i] += 1
+            # First of the cheapest, as argmin
+            if lowest < 0 or premium < premiums[row, lowest]:
+                lowest = i
+        if lowest >= 0:
+            wins[value, lowest] += 1
+    return count, premium_sum, premium_missing, nonzero_sum, nonzero_count, wins
+
+
+def _rank_counts_loop(inverse, n, premiums):
+    rows, k = premiums.shape
+    ranks = np.zeros((n, k, k), dtype=np.int64)
+    rank = np.full((rows, k), -1, dtype=np.int64)
+    # Quoted premiums of the row in ascending order and their columns
+    ordered = np.empty(k)
+    columns = np.empty(k, dtype=np.int64)
+    for row in range(rows):
+        quoted = 0
+        for i in range(k):
+            premium = premiums[row, i]
+            if np.isnan(premium) or premium == 0:
+                continue
+            # Insertion sort, equal premiums stay in column order
+            j = quoted
+            while j > 0 and ordered[j - 1] > premium:
+                ordered[j] = ordered[j - 1]
+                columns[j] = columns[j - 1]
+                j -= 1
+            ordered[j] = premium
+            columns[j] = i
+            quoted += 1
+        value = inverse[row]
+        for position in range(quoted):
+            rank[row, columns[position]] = position
+            ranks[value, columns[position], position] += 1
+    return ranks, rank
+
+
+def _compile():
+    if not _compiled:
+        try:
+            import numba
+        except ImportError:
+            raise ImportError("The numba kernels need the numba package, use the numpy kernels instead")
+        _compiled['value_aggregates'] = numba.njit(nogil=True)(_value_aggregates_loop)
+        _compiled['rank_counts'] = numba.njit(nogil=True)(_rank_counts_loop)
+    return _compiled
+
+
+# ===========================================================================
+# Selection
+# ===========================================================================
+def use_kernel(name):
+    """
+    Selects the kernels every later aggregation of the process runs on, 'numpy' or 'numba'
+    """
+    assert name in kernels, "Kernel must be one of %s" % kernels
+    if name == 'numba':
+        _compile()
+    _selected[0] = name
+
+
+def kernel():
+    return _selected[0]
+
+
+def value_aggregates(inverse, n, premiums):
+    """
+    Per value (or any cell) aggregates of the premium matrix: number of rows, sum and number of missing premiums
+    (zeros included), sum and number of the non zero premiums, and number of rows where each column is the
+    cheapest (missing premiums skipped, ties to the first column)
+
+    inverse = value index of each row, in 0..n - 1
+    premiums = premium matrix, rows x columns
+    """
+    if _selected[0] == 'numpy':
+        return _value_aggregates_numpy(inverse, n, premiums)
+    names = ['count', 'premium_sum', 'premium_missing', 'nonzero_sum', 'nonzero_count', 'wins']
+    return dict(zip(names, _compile()['value_aggregates'](np.ascontiguousarray(inverse, dtype=np.int64), n,
+                                                         np.ascontiguousarray(premiums, dtype=np.float64))))
+
+
+def rank_counts(inverse, n, premiums):
+    """
+    Number of the rows of each value where each column ranks 1st, 2nd... among the quoted (non zero, non missing)
+    premiums of the row (values x columns x positions), ties to the first column, and the rank of every premium,
+    -1 when it is not quoted
+    """
+    if _selected[0] == 'numpy':
+        return _rank_counts_numpy(inverse, n, premiums)
+    return _compile()['rank_counts'](np.ascontiguousarray(inverse, dtype=np.int64), n,
+                                     np.ascontiguousarray(premiums, dtype=np.float64))
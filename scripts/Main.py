@@ -1,37 +1,176 @@
-# Pandas for data management
-import pandas as pd
+# Every session runs this script, the imports are only slow for the first one of the process
+import time
+started = time.perf_counter()
+
 from bokeh.io import curdoc
 from bokeh.models.widgets import Tabs, Panel
 import pickle
+import PolicyTab
+import VehicleTab
+import HomeTab
 from PolicyTab import _tab as policy_tab
 from VehicleTab import _tab as vehicle_tab
 from HomeTab import _tab as home_tab
+from DataStore import get_store, band_statistics, read_file
+from Startup import StartupProfile
+from ResultCache import result_cache
+from Templates import templates
+from Kernels import kernels, use_kernel
 import sys, os
-import tkinter as tk
-from tkinter.filedialog import askopenfilename
+import argparse
+
+profile = StartupProfile(started)
+profile.mark('import')
+
 
+# Optional arguments, passed with: bokeh serve --show Main.py --args --backend sqlite
+parser = argparse.ArgumentParser()
+parser.add_argument('--backend', choices=['index', 'pandas', 'duckdb', 'sqlite'], default='index',
+                    help='Engine the range filtering and aggregation run on')
+parser.add_argument('--watch', type=float, nargs='?', const=2.0, default=None, metavar='SECONDS',
+                    help='Hot reload the data files when they change, polling every SECONDS (default 2)')
+parser.add_argument('--sample', type=int, nargs='?', const=20000, default=None, metavar='ROWS',
+                    help='Answer from a stratified sample of ROWS quotes while the widgets move (default 20000)')
+parser.add_argument('--statistics', default='', metavar='NAMES',
+                    help='Comma separated premium statistics to add to the average, for example '
+                         'weighted_mean,median,trimmed_mean,p10,p90')
+parser.add_argument('--weight-column', default=None, metavar='COLUMN',
+                    help='Exposure column weighting weighted_mean, medians, trimmed means and percentiles')
+parser.add_argument('--market-column', default=None, metavar='COLUMN',
+                    help='Partition the quotes by this market column (state, territory, rating region) and add '
+                         'a market selector')
+parser.add_argument('--baseline', action='store_true',
+                    help='Also select the data files from before a rate change and show the changes since then')
+parser.add_argument('--client', action='store_true',
+                    help='Re-bin in the browser while the range and bin width sliders move')
+parser.add_argument('--bands', action='store_true',
+                    help='Draw the 10th to 90th percentile band and the median of each company on the premium chart')
+parser.add_argument('--prefetch', type=float, nargs='?', const=0.2, default=None, metavar='FRACTION',
+                    help='Compute the slider states next to the shown one while a session is idle, using at most '
+                         'FRACTION of the server time (default 0.2)')
+parser.add_argument('--kernel', choices=kernels, default='numpy',
+                    help='Aggregation kernels: numpy, or numba to compile fused loops over the quotes (needs numba)')
+parser.add_argument('--no-templates', action='store_true',
+                    help='Build the charts of every session instead of copying the ones of the first session')
+args, unknown = parser.parse_known_args()
+use_kernel(args.kernel)
+templates.enabled = not args.no_templates
+statistics = [statistic for statistic in args.statistics.split(',') if statistic]
+if args.bands:
+    statistics += [statistic for statistic in band_statistics if statistic not in statistics]
 
-root = tk.Tk()
-root.withdraw()
 # location and file name
 pathname = os.path.dirname(sys.argv[0])
 location = os.path.abspath(pathname)
-file_select_home = askopenfilename(initialdir=location+"/Data", title='Select Home Data')
-homeowners_data = pd.read_csv(file_select_home, low_memory=False)
+
+
+def select_file(title):
+    # Only the first session opens the dialogs
+    import tkinter as tk
+    from tkinter.filedialog import askopenfilename
+    root = tk.Tk()
+    root.withdraw()
+    return askopenfilename(initialdir=location+"/Data", title=title)
+
+
+def read_home(path):
+    return read_file(path)
+
+
 # In the future, change these to be csv imports and not pickles
-file_select_vehicle = askopenfilename(initialdir=location+"/Data", title='Select Policy Data')
-policy_pickle_in = open(file_select_vehicle, "rb")
-file_select_policy = askopenfilename(initialdir=location+"/Data", title='Select Vehicle Data')
-vehicle_pickle_in = open(file_select_policy, "rb")
+def read_pickle(path):
+    with open(path, "rb") as pickle_in:
+        return pickle.load(pickle_in)
+
+
+# The data is loaded by the first session only, every later session shares the same stores
+home_store = get_store('home', read_home, HomeTab.lowest_columns,
+                       select=lambda: select_file('Select Home Data'),
+                       statistics=statistics, weight_column=args.weight_column,
+                       market_column=args.market_column)
+policy_store = get_store('policy', read_pickle, PolicyTab.lowest_columns,
+                         select=lambda: select_file('Select Policy Data'),
+                         statistics=statistics, weight_column=args.weight_column,
+                         market_column=args.market_column)
+vehicle_store = get_store('vehicle', read_pickle, VehicleTab.lowest_columns, prepare=lambda data: data.fillna(0),
+                          select=lambda: select_file('Select Vehicle Data'),
+                          statistics=statistics, weight_column=args.weight_column,
+                          market_column=args.market_column)
+
+# Snapshots from before a rate change, shared by all the sessions like the current data
+baseline_stores = {}
+if args.baseline:
+    baseline_stores['home'] = get_store('home-baseline', read_home, HomeTab.lowest_columns,
+                                        select=lambda: select_file('Select Baseline Home Data'),
+                                        market_column=args.market_column)
+    baseline_stores['policy'] = get_store('policy-baseline', read_pickle, PolicyTab.lowest_columns,
+                                          select=lambda: select_file('Select Baseline Policy Data'),
+                                          market_column=args.market_column)
+    baseline_stores['vehicle'] = get_store('vehicle-baseline', read_pickle, VehicleTab.lowest_columns,
+                                           prepare=lambda data: data.fillna(0),
+                                           select=lambda: select_file('Select Baseline Vehicle Data'),
+                                           market_column=args.market_column)
+
+# Reload the data files in the background when they change
+if args.watch:
+    from FileWatcher import watch
+    watch(home_store, read_home, interval=args.watch)
+    watch(policy_store, read_pickle, interval=args.watch)
+    watch(vehicle_store, read_pickle, interval=args.watch)
+
+
+def tab_backend(store):
+    """
+    Engine the tab queries run on, shared by all the sessions
+    """
+    if args.backend == 'pandas':
+        return None
+    if args.backend == 'index':
+        return store
+    # Push the queries down to an embedded SQL engine, appended batches are written to it as well
+    if not store.backends:
+        from SqlBackend import SqlBackend
+        store.attach(SqlBackend(store.frame, store.lowest_columns, name=store.name, engine=args.backend))
+    return store.backends[0]
+
+
+def tab_sample(store):
+    """
+    Sampled engine used while the widgets move, shared by all the sessions
+    """
+    if args.sample is None:
+        return None
+    from Sampling import get_sample
+    return get_sample(store, args.sample)
+
+
+def tab_prefetch():
+    """
+    Budget of the speculative computations, shared by all the sessions
+    """
+    if args.prefetch is None:
+        return None
+    from Prefetch import get_budget
+    return get_budget(args.prefetch)
+
+
+profile.mark('load')
+stores = [policy_store, vehicle_store, home_store] + list(baseline_stores.values())
+aggregated = sum(store.aggregate_seconds for store in stores)
 
-policy_data = pickle.load(policy_pickle_in)
-vehicle_data = pickle.load(vehicle_pickle_in).fillna(0)
 # Create each of the tabs
-tab1 = policy_tab(policy_data)
-tab2 = vehicle_tab(vehicle_data)
-tab3 = home_tab(homeowners_data)
+tab1 = policy_tab(policy_store, backend=tab_backend(policy_store), sample=tab_sample(policy_store),
+                  client=args.client, baseline=baseline_stores.get('policy'), prefetch=tab_prefetch())
+tab2 = vehicle_tab(vehicle_store, backend=tab_backend(vehicle_store), sample=tab_sample(vehicle_store),
+                   client=args.client, baseline=baseline_stores.get('vehicle'), prefetch=tab_prefetch())
+tab3 = home_tab(home_store, backend=tab_backend(home_store), sample=tab_sample(home_store),
+                client=args.client, baseline=baseline_stores.get('home'), prefetch=tab_prefetch())
 
 TABS = Tabs(tabs=[tab1, tab2, tab3])
 
 # Put the tabs in the current document for display
 curdoc().add_root(TABS)
+profile.mark('document')
+profile.report(stores, aggregated)
+result_cache.log_metrics()
+templates.log_metrics()
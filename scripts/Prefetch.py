@@ -0,0 +1,127 @@
+import threading
+import time
+
+
+class PrefetchBudget(object):
+    """
+    Share of the server time the speculative computations of all the sessions may use together. Time is earned
+    at fraction of a second per second, up to fraction * window seconds saved while nothing is prefetched, and
+    every prefetch spends what it took, so prefetching cannot crowd out the requests of the users.
+
+    fraction = share of the wall time, 0.2 lets prefetching run at most a fifth of the time
+    window = seconds over which unused time can be saved up
+    """
+
+    def __init__(self, fraction=0.2, window=1.0):
+        assert 0 < fraction <= 1, "The prefetch budget is a share of the time"
+        self.fraction = fraction
+        self.window = window
+        self.available = fraction * window
+        self.updated = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def _earn(self):
+        now = time.perf_counter()
+        self.available = min(self.available + (now - self.updated) * self.fraction, self.fraction * self.window)
+        self.updated = now
+
+    def delay(self):
+        """
+        Seconds to wait before the next prefetch, 0 when it can run now
+        """
+        with self.lock:
+            self._earn()
+            return max(-self.available / self.fraction, 0.0)
+
+    def spend(self, seconds):
+        with self.lock:
+            self._earn()
+            self.available -= seconds
+
+
+class Prefetcher(object):
+    """
+    Runs the speculative tasks of one session on the server loop of its document, one task per callback, once
+    the session has been idle for idle_milliseconds. The loop stays free for real work between two tasks, and
+    scheduling new tasks or cancelling drops the ones not run yet.
+
+    doc = document of the session
+    budget = PrefetchBudget shared by the sessions of the process
+    """
+
+    def __init__(self, doc, budget, idle_milliseconds=300):
+        self.doc = doc
+        self.budget = budget
+        self.idle_milliseconds = idle_milliseconds
+        self.tasks = []
+        self.callback = None
+
+    def schedule(self, tasks):
+        """
+        tasks = functions computing one result each, most likely first. They return whether they computed
+                anything, the ones that found their result already cached cost no budget
+        """
+        self.cancel()
+        self.tasks = list(tasks)
+        if self.tasks:
+            self._wait(self.idle_milliseconds)
+
+    def schedule_neighbours(self, shared, sources, range_select, binwidth_select):
+        """
+        Schedules the results of the slider states one step away: each handle of the range moved by a step, then
+        the bin width changed by a step
+
+        shared = SharedResults of the session
+        sources = function of range_start, range_end and bin_width returning the (name, build, args, settings) of
+                  the sources the sliders change, the bin width moves only prefetch the ones with a bin_width setting
+        range_select, binwidth_select = sliders of the tab
+        """
+        (start, end), step = range_select.value, range_select.step
+        tasks = []
+        for range_start, range_end in [(start - step, end), (start + step, end), (start, end - step),
+                                       (start, end + step)]:
+            if range_select.start <= range_start < range_end <= range_select.end:
+                tasks += [shared.prefetch(name, build, *args, **settings)
+                          for name, build, args, settings in sources(range_start, range_end, binwidth_select.value)]
+        for bin_width in [binwidth_select.value - binwidth_select.step, binwidth_select.value + binwidth_select.step]:
+            if binwidth_select.start <= bin_width <= binwidth_select.end:
+                tasks += [shared.prefetch(name, build, *args, **settings)
+                          for name, build, args, settings in sources(start, end, bin_width) if 'bin_width' in settings]
+        self.schedule(tasks)
+
+    def cancel(self):
+        self.tasks = []
+        if self.callback is not None:
+            self.doc.remove_timeout_callback(self.callback)
+            self.callback = None
+
+    def _wait(self, milliseconds):
+        self.callback = self.doc.add_timeout_callback(self._run, milliseconds)
+
+    def _run(self):
+        self.callback = None
+        delay = self.budget.delay()
+        if delay > 0:
+            self._wait(delay * 1000)
+            return
+        while self.tasks:
+            start = time.perf_counter()
+            computed = self.tasks.pop(0)()
+            if computed:
+                self.budget.spend(time.perf_counter() - start)
+                break
+        if self.tasks:
+            self._wait(self.budget.delay() * 1000)
+
+
+# One budget for the whole process, every session prefetches out of it
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_budget(fraction=0.2):
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = PrefetchBudget(fraction)
+        return _budget
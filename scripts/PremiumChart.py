@@ -0,0 +1,120 @@
+import json
+from bokeh.models import (CDSView, ColumnDataSource, CustomJS, CustomJSFilter, CustomJSHover, GlyphRenderer,
+                          HoverTool, Legend, LegendItem, LinearColorMapper)
+from bokeh.models.glyphs import MultiLine
+from DataStore import statistic_label
+
+# Sources the browser derives from the distribution, sent empty and never sent by the server
+browser_sources = ['premium_lines', 'premium_points']
+
+# Rebuilds the lines and points of the shown companies whenever the distribution data or a legend item changes.
+# The data is replaced in place and the change signalled, so it is not sent back to the server
+lines_code = """
+var data = src.data, left = data['left'];
+var xs = [], ys = [], color = [], none = [], x = [], y = [], code = [];
+for (var i = 0; i < series.length; i++) {
+    var values = data[series[i][1]], shown = toggles[i].visible, line = [];
+    for (var j = 0; j < left.length; j++) {
+        line.push(shown ? values[j] : NaN);
+        if (shown) {
+            x.push(left[j]);
+            y.push(values[j]);
+            code.push(i);
+        }
+    }
+    xs.push(left);
+    ys.push(line);
+    color.push(series[i][2]);
+    none.push([]);
+}
+lines.data['xs'] = xs;
+lines.data['ys'] = ys;
+lines.data['color'] = color;
+lines.data['none'] = none;
+lines.change.emit();
+points.data['x'] = x;
+points.data['y'] = y;
+points.data['code'] = code;
+points.change.emit();
+"""
+
+# Fills the empty lines once the document is loaded. Bokeh 1.3 has no document ready event: the filter runs when
+# the browser initializes the view of the legend renderers and again on every change of the lines, it keeps every
+# line and, while there are none, runs the lines callback once the models of the document are all initialized
+ready_code = """
+if (lines.data['xs'].length == 0) {
+    setTimeout(function () { callback.execute(lines, {}); }, 0);
+}
+return source.get_indices();
+"""
+
+# Company (from the list of labels) and interval of a hovered point, looked up rather than sent with every point
+company_code = "return %s[value];"
+interval_code = "return src.data['_interval'][src.data['left'].indexOf(value)];"
+
+
+def premium_tooltips(statistic):
+    """
+    Tooltips of the premium points, the premium named after the statistic drawn
+    """
+    return [('Company', '@code{custom}'), ('%s Premium' % statistic_label(statistic), '@y{$0,}'),
+            ('Interval', '[@x{custom})')]
+
+
+def premium_statistic(p, statistic):
+    """
+    Names the hovered premium of a chart drawn by premium_lines after the statistic it now shows
+    """
+    p.select_one({'type': HoverTool}).tooltips = premium_tooltips(statistic)
+
+
+def premium_lines(p, src, series, bands=False, statistic='mean'):
+    """
+    Draws the premium of each company over the bins of the distribution source src on p as one multi line and
+    one scatter renderer, with a single hover tool on the points. Each legend item hides its company: the item
+    holds an empty renderer of its own, and the browser rebuilds the lines and points from src without the
+    hidden companies. The lines and points are built in the browser only, the document carries them empty
+
+    series = (legend label, distribution column, color) of each company, drawn in this order
+    bands = also draw the 10th to 90th percentile band and the dashed median of each company, from the p10, p90
+            and p50 columns of src, hidden with its line
+    statistic = premium statistic of the distribution columns, named by the hover tool
+    """
+    lines = ColumnDataSource({'xs': [], 'ys': [], 'color': [], 'none': []}, name='premium_lines')
+    points = ColumnDataSource({'x': [], 'y': [], 'code': []}, name='premium_points')
+    p.multi_line(xs='xs', ys='ys', source=lines, line_color='color', line_width=4)
+    colors = LinearColorMapper(palette=[color for label, column, color in series], low=-0.5,
+                               high=len(series) - 0.5)
+    circles = p.scatter(x='x', y='y', source=points, marker='circle', fill_color='white', size=6,
+                        line_color={'field': 'code', 'transform': colors})
+
+    # Legend glyph of every company, drawn from its row of the lines and empty elsewhere
+    glyph = MultiLine(xs='none', ys='none', line_color='color', line_width=4)
+    view = CDSView(source=lines)
+    toggles = [GlyphRenderer(data_source=lines, glyph=glyph, view=view, name=label)
+               for label, column, color in series]
+    p.renderers.extend(toggles)
+    items = [LegendItem(label=label, renderers=[toggle], index=i)
+             for i, ((label, column, color), toggle) in enumerate(zip(series, toggles))]
+    p.add_layout(Legend(items=items))
+
+    if bands:
+        for (label, column, color), item in zip(series, items):
+            band = p.varea(x='left', y1=column.replace('average', 'p10'), y2=column.replace('average', 'p90'),
+                           source=src, fill_color=color, fill_alpha=0.15, level='underlay')
+            median = p.line(x='left', y=column.replace('average', 'p50'), source=src, color=color, line_width=1,
+                            line_dash='dashed')
+            item.renderers.extend([band, median])
+
+    callback = CustomJS(args=dict(src=src, lines=lines, points=points, toggles=toggles,
+                                  series=[list(entry) for entry in series]),
+                        code=lines_code, name='premium_lines')
+    src.js_on_change('data', callback)
+    for toggle in toggles:
+        toggle.js_on_change('visible', callback)
+    view.filters = [CustomJSFilter(args=dict(lines=lines, callback=callback), code=ready_code)]
+
+    p.add_tools(HoverTool(renderers=[circles], tooltips=premium_tooltips(statistic), formatters={
+        'code': CustomJSHover(code=company_code % json.dumps([label for label, column, color in series])),
+        'x': CustomJSHover(args=dict(src=src), code=interval_code)}, mode='mouse', toggleable=False))
+
@@ -0,0 +1,129 @@
+import numpy as np
+
+
+def _compress(means, weights, compression):
+    """
+    Merges neighbouring points whose quantiles fall on the same step of the t-digest scale function,
+    which keeps the clusters small in the tails and at most compression + 1 of them
+    """
+    order = np.argsort(means, kind='mergesort')
+    means, weights = means[order], weights[order]
+    total = weights.sum()
+    quantile = (np.cumsum(weights) - weights / 2) / total
+    step = np.floor(compression * (np.arcsin(2 * quantile - 1) / np.pi + 0.5))
+    group = np.concatenate(([0], np.cumsum(step[1:] != step[:-1])))
+    merged_weights = np.bincount(group, weights=weights)
+    return np.bincount(group, weights=weights * means) / merged_weights, merged_weights
+
+
+class QuantileSketch(object):
+    """
+    Mergeable quantile sketch in the style of a merging t-digest: sorted centroids (mean, weight) plus the
+    exact minimum and maximum. Its size is bounded by the compression whatever the number of values, and two
+    sketches merge into one with the same bound, so per bin sketches can be combined for any range.
+
+    compression = at most compression + 1 centroids are kept
+    """
+
+    def __init__(self, means=(), weights=(), minimum=np.nan, maximum=np.nan, compression=100):
+        self.means = np.asarray(means, dtype=float)
+        self.weights = np.asarray(weights, dtype=float)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.compression = compression
+
+    @classmethod
+    def from_values(cls, values, weights=None, compression=100):
+        """
+        values = sorted or unsorted premiums, missing values must be removed first
+        """
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return cls(compression=compression)
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=float)
+        means, weights = _compress(values, weights, compression)
+        return cls(means, weights, values.min(), values.max(), compression)
+
+    @classmethod
+    def merge(cls, sketches, compression=None):
+        sketches = [sketch for sketch in sketches if sketch is not None and len(sketch.means)]
+        if compression is None:
+            compression = max([sketch.compression for sketch in sketches] or [100])
+        if not sketches:
+            return cls(compression=compression)
+        if len(sketches) == 1:
+            return sketches[0]
+        means, weights = _compress(np.concatenate([sketch.means for sketch in sketches]),
+                                   np.concatenate([sketch.weights for sketch in sketches]), compression)
+        return cls(means, weights, min(sketch.minimum for sketch in sketches),
+                   max(sketch.maximum for sketch in sketches), compression)
+
+    def __add__(self, other):
+        return QuantileSketch.merge([self, other])
+
+    @property
+    def count(self):
+        return self.weights.sum()
+
+    def quantile(self, q):
+        """
+        Value below which a fraction q of the weight falls, interpolated between the centroid centres
+        """
+        total = self.count
+        if total == 0:
+            return np.nan
+        centres = np.cumsum(self.weights) - self.weights / 2
+        return np.interp(np.asarray(q) * total, np.concatenate(([0], centres, [total])),
+                         np.concatenate(([self.minimum], self.means, [self.maximum])))
+
+    def trimmed_mean(self, lower=0.1, upper=0.9):
+        """
+        Mean of the values between the lower and upper quantiles, centroids cut by a bound count in part
+        """
+        total = self.count
+        if total == 0:
+            return np.nan
+        end = np.cumsum(self.weights)
+        start = end - self.weights
+        inside = np.clip(np.minimum(end, upper * total) - np.maximum(start, lower * total), 0, None)
+        if inside.sum() == 0:
+            return self.quantile((lower + upper) / 2)
+        return (inside * self.means).sum() / inside.sum()
+
+    def nbytes(self):
+        return self.means.nbytes + self.weights.nbytes
+
+
+class SketchTree(object):
+    """
+    Segment tree of sketches: level 0 holds the given sketches and each node of a level above merges two
+    neighbouring nodes below it. Any contiguous run of sketches is the merge of at most two nodes per level,
+    so the merge cost of a range grows with the log of its length instead of the length itself.
+    """
+
+    def __init__(self, sketches):
+        self.levels = [list(sketches)]
+        while len(self.levels[-1]) > 1:
+            below = self.levels[-1]
+            self.levels.append([QuantileSketch.merge(below[i:i + 2]) for i in range(0, len(below), 2)])
+
+    def query(self, start, end):
+        """
+        Merged sketch of the sketches start to end - 1
+        """
+        nodes = []
+        level = 0
+        while start < end:
+            if start % 2:
+                nodes.append(self.levels[level][start])
+                start += 1
+            if end % 2:
+                end -= 1
+                nodes.append(self.levels[level][end])
+            start //= 2
+            end //= 2
+            level += 1
+        return QuantileSketch.merge(nodes)
+
+    def nbytes(self):
+        return sum(sketch.nbytes() for level in self.levels for sketch in level if sketch is not None)
@@ -0,0 +1,238 @@
+import threading
+from collections import namedtuple
+import numpy as np
+from bokeh.layouts import column
+from bokeh.models import ColumnDataSource, HoverTool, LogColorMapper, NumeralTickFormatter, Range1d, Slope
+from bokeh.models.widgets import Div
+from bokeh.palettes import Viridis256
+from bokeh.plotting import figure
+
+
+# Quotes of a range of a target column: views of the quotes sorted on the column, with their value of it
+Selection = namedtuple('Selection', ['values', 'x', 'y', 'priority'])
+
+
+class ScatterIndex(object):
+    """
+    GFB premium against the cheapest competitor premium of every quote, for drawing the quotes one by one. Quotes
+    without a non zero GFB premium or without any non zero competitor premium are left out. Per target column the
+    quotes are sorted once, so the quotes of a range of the column are contiguous slices and a viewport is
+    aggregated without gathering them.
+    Every quote has a random priority: when more quotes are in view than can be sent, the ones of highest priority
+    are, so a point stays on the chart as the view zooms in on it and the points sent are a uniform sample.
+
+    data = dataframe of quotes
+    premiums = premium matrix of data, rows x premium columns
+    gfb = column of GFB in premiums
+    """
+
+    def __init__(self, data, premiums, gfb):
+        own = premiums[:, gfb]
+        competitors = np.delete(premiums, gfb, axis=1)
+        # Missing premiums compare false and are skipped like the zeros
+        with np.errstate(invalid='ignore'):
+            cheapest = np.where(competitors > 0, competitors, np.inf).min(axis=1, initial=np.inf)
+            keep = (own > 0) & np.isfinite(cheapest)
+        self.data = data
+        self.rows = np.flatnonzero(keep)
+        # Single precision is plenty for premiums drawn to the pixel
+        self.x = cheapest[keep].astype(np.float32)
+        self.y = own[keep].astype(np.float32)
+        self.priority = np.random.RandomState(0).permutation(len(self.rows)).astype(np.int32)
+        self.columns = {}
+        self.lock = threading.Lock()
+
+    def _sorted(self, target_column):
+        """
+        The quotes sorted on target_column
+        """
+        with self.lock:
+            if target_column not in self.columns:
+                values = self.data[target_column].to_numpy(dtype=float)[self.rows]
+                order = np.argsort(values, kind='stable')
+                self.columns[target_column] = Selection(values[order], self.x[order], self.y[order],
+                                                        self.priority[order])
+            return self.columns[target_column]
+
+    def select(self, target_column, range_start, range_end):
+        """
+        The quotes with range_start <= value < range_end
+        """
+        quotes = self._sorted(target_column)
+        found = slice(np.searchsorted(quotes.values, range_start, side='left'),
+                      np.searchsorted(quotes.values, range_end, side='left'))
+        return Selection(*[array[found] for array in quotes])
+
+    def extent(self, selected):
+        """
+        Smallest and largest cheapest competitor and GFB premiums of the selected quotes, None when there are none
+        """
+        if len(selected.x) == 0:
+            return None
+        return (float(selected.x.min()), float(selected.x.max())), (float(selected.y.min()), float(selected.y.max()))
+
+    def view(self, selected, x_range, y_range, points, width, height):
+        """
+        The selected quotes inside the viewport x_range by y_range. Returns the number of them, the positions in
+        selected of at most points of them and, when they are not all sent, the number of them in each cell of a
+        height by width grid over the viewport (None otherwise)
+        """
+        (x_start, x_end), (y_start, y_end) = x_range, y_range
+        x, y = selected.x, selected.y
+        inside = (x_start <= x) & (x <= x_end) & (y_start <= y) & (y <= y_end)
+        count = int(np.count_nonzero(inside))
+        if count <= points:
+            return count, np.flatnonzero(inside), None
+        columns = np.clip(((x[inside] - x_start) * (width / (x_end - x_start))).astype(np.int32), 0, width - 1)
+        rows = np.clip(((y[inside] - y_start) * (height / (y_end - y_start))).astype(np.int32), 0, height - 1)
+        density = np.bincount(rows * width + columns, minlength=width * height).reshape(height, width)
+        # The priorities are a permutation over all the quotes, so about twice points of the quotes in view are
+        # under this threshold and the ones of highest priority are found among them
+        threshold = 2 * points * len(self.priority) // count + 1
+        candidates = np.flatnonzero(inside & (selected.priority < threshold))
+        if len(candidates) < points:
+            candidates = np.flatnonzero(inside)
+        kept = candidates[np.argpartition(selected.priority[candidates], points - 1)[:points]] if points else \
+            candidates[:0]
+        return count, kept, density
+
+
+class QuoteScatter(object):
+    """
+    Scatter index of a store, built the first time its quotes are drawn and dropped when the store changes
+    """
+
+    def __init__(self, store, gfb):
+        self.store = store
+        self.gfb = gfb
+        self.built = None
+        self.lock = threading.Lock()
+        store.add_listener(self.clear)
+
+    def clear(self):
+        with self.lock:
+            self.built = None
+
+    def index(self):
+        with self.lock:
+            if self.built is None:
+                self.built = ScatterIndex(self.store.frame, self.store.premiums(), self.gfb)
+            return self.built
+
+
+# One scatter index per store, kept by the store
+def get_scatter(store, gfb):
+    return store.derived(__name__, lambda store: QuoteScatter(store, gfb))
+
+
+class QuoteScatterChart(object):
+    """
+    Scatter of the quotes of the X axis range in a session, aggregated again for the viewport once the chart stops
+    moving. Holds the viewport ranges, the sources of the points and of the density image and the summary
+
+    registry = CompanyRegistry of the tab
+    market_store = function returning the store of the market shown
+    gfb_column = premium column drawn against the cheapest competitor
+    market_select, x_axis, range_select = widgets of the tab giving the quotes to draw
+    doc = document of the session
+    points = quotes drawn one by one at most, when more are in view their density is drawn under them on a grid of
+             cells (columns, rows)
+    milliseconds = time without panning or zooming before the quotes in view are aggregated again
+    """
+
+    def __init__(self, registry, market_store, gfb_column, market_select, x_axis, range_select, doc, points=2000,
+                 cells=(120, 60), milliseconds=150):
+        self.market_store = market_store
+        self.gfb = registry.code(gfb_column)
+        self.market_select = market_select
+        self.x_axis = x_axis
+        self.range_select = range_select
+        self.doc = doc
+        self.points = points
+        self.cells = cells
+        self.milliseconds = milliseconds
+        self.pending = []
+        # Quotes and viewport the scatter was last aggregated for
+        self.shown = [None, None]
+        self.x_range = Range1d(0, 1)
+        self.y_range = Range1d(0, 1)
+        for scatter_range in [self.x_range, self.y_range]:
+            scatter_range.on_change('start', self.update_viewport)
+            scatter_range.on_change('end', self.update_viewport)
+        self.status = Div(width=1200)
+        self.points_src = ColumnDataSource({'x': [], 'y': [], 'value': []})
+        self.density_src = ColumnDataSource({'image': [], 'x': [], 'y': [], 'dw': [], 'dh': []})
+
+    def make_dataset(self):
+        """
+        Data of the points and of the density image of the quotes of the X axis range inside the viewport of the
+        scatter, with a summary. The viewport is fitted to the quotes first when they changed
+        """
+        current = self.market_store()
+        x_column, (range_start, range_end) = self.x_axis.value, self.range_select.value
+        index = get_scatter(current, self.gfb).index()
+        selected = index.select(x_column, range_start, range_end)
+        selection = (self.market_select.value, current.version, x_column, (range_start, range_end))
+        if selection != self.shown[0]:
+            extent = index.extent(selected) or ((0, 1), (0, 1))
+            for scatter_range, (start, end) in zip([self.x_range, self.y_range], extent):
+                margin = max((end - start) * 0.05, 1)
+                scatter_range.update(start=start - margin, end=end + margin, reset_start=start - margin,
+                                     reset_end=end + margin)
+        viewport = ((self.x_range.start, self.x_range.end), (self.y_range.start, self.y_range.end))
+        if [selection, viewport] == self.shown:
+            return None
+        self.shown[:] = [selection, viewport]
+        count, positions, density = index.view(selected, viewport[0], viewport[1], self.points, *self.cells)
+        points = {'x': selected.x[positions], 'y': selected.y[positions],
+                  'value': selected.values[positions].astype(np.float32)}
+        if density is None:
+            image = {'image': [], 'x': [], 'y': [], 'dw': [], 'dh': []}
+            summary = 'All %d quotes in view of the %d with %s from %g to %g' % (
+                count, len(selected.x), x_column, range_start, range_end)
+        else:
+            # Empty cells are left transparent
+            image = {'image': [np.where(density > 0, density, np.nan).astype(np.float32)],
+                     'x': [viewport[0][0]], 'y': [viewport[1][0]], 'dw': [viewport[0][1] - viewport[0][0]],
+                     'dh': [viewport[1][1] - viewport[1][0]]}
+            summary = ('A sample of %d of the %d quotes in view over their density, of the %d with %s from %g to %g.'
+                       ' Zoom in to see them all' % (len(positions), count, len(selected.x), x_column, range_start,
+                                                    range_end))
+        return points, image, summary
+
+    def make_plot(self, points_src, density_src, x_range, y_range, status):
+        """
+        GFB premium of each quote against the cheapest competitor premium, over the density of the quotes when
+        they are too many to send. Quotes under the dashed line are cheaper with GFB
+        """
+        p = figure(plot_width=1200, plot_height=500, title='Georgia Farm Against the Cheapest Competitor',
+                   x_axis_label='Cheapest Competitor Premium', y_axis_label='Georgia Farm Premium',
+                   x_range=x_range, y_range=y_range, tools='pan,wheel_zoom,box_zoom,reset',
+                   active_scroll='wheel_zoom')
+        mapper = LogColorMapper(palette=Viridis256, low=1, nan_color=(0, 0, 0, 0))
+        p.image(image='image', x='x', y='y', dw='dw', dh='dh', source=density_src, color_mapper=mapper,
+                global_alpha=0.7)
+        circles = p.circle(x='x', y='y', source=points_src, size=3, color='navy', alpha=0.5)
+        p.add_layout(Slope(gradient=1, y_intercept=0, line_color='gray', line_dash='dashed'))
+        p.xaxis.formatter = NumeralTickFormatter(format='$0,0')
+        p.yaxis.formatter = NumeralTickFormatter(format='$0,0')
+        p.add_tools(HoverTool(renderers=[circles], tooltips=[('Cheapest Competitor', '@x{$0,}'),
+                                                             ('Georgia Farm', '@y{$0,}'), ('X Axis', '@value')],
+                              toggleable=False))
+        p.toolbar.logo = None
+        return column(p, status, name='scatter')
+
+    def refresh(self):
+        shown = self.make_dataset()
+        if shown is not None:
+            self.points_src.data, self.density_src.data, self.status.text = shown
+
+    def aggregate_viewport(self):
+        del self.pending[:]
+        self.refresh()
+
+    # The quotes in view are aggregated again once the scatter stops moving
+    def update_viewport(self, attr, old, new):
+        for callback in self.pending:
+            self.doc.remove_timeout_callback(callback)
+        self.pending[:] = [self.doc.add_timeout_callback(self.aggregate_viewport, self.milliseconds)]
@@ -0,0 +1,136 @@
+import threading
+import numpy as np
+from bokeh.models import ColumnDataSource, HoverTool, NumeralTickFormatter
+from bokeh.palettes import viridis
+from bokeh.plotting import figure
+from QuantileSketch import QuantileSketch, SketchTree
+from Companies import premium_matrix
+from Kernels import rank_counts
+
+
+class RankAggregates(object):
+    """
+    Position of every company's premium within each quote, aggregated per distinct value of a target column.
+    The rank counts of each value come from one rank_counts kernel pass over the premium matrix and the gaps to
+    the cheapest premium go into one quantile sketch per value and company, so a range only sums counts and
+    merges sketches.
+    Zero and missing premiums are not ranked, as they are left out of the average premium bars, and ties keep
+    the lowest_columns order like idxmin.
+
+    data = dataframe of quotes
+    columns = premium columns in lowest_columns order
+    premiums = premium matrix of data in columns order, extracted from data when not given
+    """
+
+    def __init__(self, data, columns, target_column, premiums=None):
+        target = data[target_column].to_numpy(dtype=float)
+        keep = ~np.isnan(target)
+        premiums = (premium_matrix(data, columns) if premiums is None else premiums)[keep]
+        self.values, inverse = np.unique(target[keep], return_inverse=True)
+        n, k = len(self.values), len(columns)
+
+        # Quotes of each value where each company ranks 1st, 2nd..., and the rank of every quoted premium
+        self.ranks, rank = rank_counts(inverse, n, premiums)
+
+        # Gap to the cheapest premium of the quotes a company does not win
+        quoted = rank >= 0
+        cheapest = np.where(quoted, premiums, np.inf).min(axis=1)
+        gap = premiums - np.where(quoted.any(axis=1), cheapest, 0)[:, None]
+        behind = rank > 0
+        # The rows are grouped by value once, the sketches sort their own values
+        by_value = np.argsort(inverse, kind='stable')
+        self.trees = []
+        for i in range(k):
+            lost = by_value[behind[by_value, i]]
+            cuts = np.searchsorted(inverse[lost], np.arange(n + 1))
+            self.trees.append(SketchTree([QuantileSketch.from_values(gap[lost[cuts[v]:cuts[v + 1]], i])
+                                          for v in range(n)]))
+
+    def statistics(self, range_start, range_end):
+        """
+        For range_start <= target_column < range_end, the share of each company's ranked quotes at each
+        position (companies x positions), the number of its ranked quotes and its median gap to the cheapest
+        premium when it is not the cheapest
+        """
+        first = np.searchsorted(self.values, range_start, side='left')
+        last = np.searchsorted(self.values, range_end, side='left')
+        ranks = self.ranks[first:last].sum(axis=0)
+        quoted = ranks.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            shares = ranks / quoted[:, None]
+        gaps = np.array([tree.query(first, last).quantile(0.5) for tree in self.trees])
+        return shares, quoted, gaps
+
+
+class RankStatistics(object):
+    """
+    Rank aggregates of a store, built per target column the first time it is asked for and dropped when the
+    store changes
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.aggregates = {}
+        self.lock = threading.Lock()
+        store.add_listener(self.aggregates.clear)
+
+    def statistics(self, range_start, range_end, target_column):
+        with self.lock:
+            if target_column not in self.aggregates:
+                self.aggregates[target_column] = RankAggregates(self.store.frame, self.store.lowest_columns,
+                                                                target_column, self.store.premiums())
+            aggregates = self.aggregates[target_column]
+        return aggregates.statistics(range_start, range_end)
+
+
+# One set of rank aggregates per store, kept by the store
+def get_ranks(store):
+    return store.derived(__name__, RankStatistics)
+
+
+class RankChart(object):
+    """
+    Price position of each company over the X axis range in a session: the share of its non zero quotes at each
+    position, cheapest first, and its median gap to the cheapest premium when it is not the cheapest. Holds the
+    source of the chart
+
+    registry = CompanyRegistry of the tab
+    companies = keys of the companies, in the order they are drawn
+    market_store = function returning the store of the market shown
+    x_axis, range_select = widgets of the tab giving the X axis column and its range
+    """
+
+    def __init__(self, registry, companies, market_store, x_axis, range_select):
+        self.companies = [registry[key] for key in companies]
+        self.market_store = market_store
+        self.x_axis = x_axis
+        self.range_select = range_select
+        self.positions = ['1st', '2nd', '3rd'] + ['%dth' % (position + 1) for position in range(3, len(registry))]
+        self.src = ColumnDataSource(self.make_dataset())
+
+    def make_dataset(self):
+        shares, quoted, gaps = get_ranks(self.market_store()).statistics(self.range_select.value[0],
+                                                                         self.range_select.value[1], self.x_axis.value)
+        index = [company.code for company in self.companies]
+        data = {'name': [company.name for company in self.companies], 'quoted': quoted[index], 'gap': gaps[index]}
+        for position, label in enumerate(self.positions):
+            data[label] = np.nan_to_num(shares[index, position])
+        return data
+
+    def make_plot(self, src):
+        p = figure(plot_height=300, width=400, title="Price Position", y_range=list(src.data['name']),
+                   x_range=(0, 1), toolbar_location=None, tools="")
+        p.hbar_stack(self.positions, y='name', height=0.8, source=src, color=viridis(len(self.positions)),
+                     line_color='white', legend=self.positions, name=self.positions)
+        p.add_tools(HoverTool(tooltips=[('Company', '@name'), ('Position', '$name'), ('Share', '@$name{0.0%}'),
+                                        ('Median Gap', '@gap{$0,}'), ('Ranked Quotes', '@quoted')],
+                              toggleable=False))
+        p.xaxis.formatter = NumeralTickFormatter(format='0%')
+        p.legend.location = "top_right"
+        p.legend.orientation = "horizontal"
+        p.legend.label_text_font_size = '8pt'
+        p.legend.padding = 2
+        return p
+
+    def refresh(self):
+        self.src.data.update(self.make_dataset())
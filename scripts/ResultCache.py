@@ -0,0 +1,173 @@
+import logging
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class _Flight(object):
+    """
+    A computation in progress, the requests for the same key wait on it
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache(object):
+    """
+    Results of the tab queries shared by every session of the process. A result is computed once per key: the
+    requests arriving while it is computed wait for that computation (single flight) instead of running their
+    own, and the finished results are kept in a least recently used cache of size entries.
+    The keys hold everything a result depends on, the version of the store included, so the results of replaced
+    data are never returned and simply age out.
+
+    size = number of results kept
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.entries = OrderedDict()
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        # Prefetched results not asked for yet
+        self.prefetched = set()
+        self.prefetches = 0
+        self.prefetch_hits = 0
+
+    def get(self, key, compute):
+        """
+        The result of key, from the cache, from the computation already running for it, or from compute()
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                if key in self.prefetched:
+                    self.prefetched.discard(key)
+                    self.prefetch_hits += 1
+                return self.entries[key]
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = compute()
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+                if flight.error is None:
+                    self._store(key, flight.value)
+            flight.done.set()
+        return flight.value
+
+    def prefetch(self, key, compute):
+        """
+        Computes and keeps the result of key ahead of a request for it, unless it is already cached or being
+        computed. Not counted as a hit or a miss. Returns whether compute() ran
+        """
+        with self.lock:
+            if key in self.entries or key in self.flights:
+                return False
+        value = compute()
+        with self.lock:
+            if key not in self.entries:
+                self._store(key, value)
+                self.prefetched.add(key)
+                self.prefetches += 1
+        return True
+
+    def _store(self, key, value):
+        self.entries[key] = value
+        while len(self.entries) > self.size:
+            self.prefetched.discard(self.entries.popitem(last=False)[0])
+            self.evictions += 1
+
+    def peek(self, key):
+        """
+        Whether key is cached, without counting a hit or moving it
+        """
+        with self.lock:
+            return key in self.entries
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.prefetched.clear()
+
+    def metrics(self):
+        """
+        Hits, misses, requests that waited on a running computation, evicted and cached results, hit rate, and
+        the prefetched results with the number of them a request used
+        """
+        with self.lock:
+            requests = self.hits + self.misses + self.coalesced
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced,
+                    'evictions': self.evictions, 'entries': len(self.entries),
+                    'hit_rate': (self.hits + self.coalesced) / float(requests) if requests else 0.0,
+                    'prefetches': self.prefetches, 'prefetch_hits': self.prefetch_hits}
+
+    def log_metrics(self):
+        log.info("Result cache: %(hits)d hits, %(coalesced)d coalesced, %(misses)d misses, %(evictions)d "
+                 "evictions, %(entries)d entries, hit rate %(hit_rate).2f, %(prefetch_hits)d of %(prefetches)d "
+                 "prefetched results used", self.metrics())
+
+
+# One cache for the whole process, every session and tab shares it
+result_cache = ResultCache()
+
+
+class SharedResults(object):
+    """
+    Data of the sources of a session from the results shared by all the sessions of the process, the sessions
+    asking for the same data at once wait for a single computation. The key of a result holds the tab module,
+    the settings and the widgets the data depends on; the other arguments of a build must be the same for every
+    session. Sampled answers are not kept
+
+    module = name of the tab module
+    backend = engine of the tab, or None for the pandas code
+    sample = optional SampledBackend of the tab
+    market_select, market_store = market selector of the tab and the function returning the store it selects
+    rate = RateChange of the tab
+    """
+
+    def __init__(self, module, backend, sample, market_select, market_store, rate):
+        self.module = module
+        self.backend = backend
+        self.sample = sample
+        self.market_select = market_select
+        self.market_store = market_store
+        self.rate = rate
+
+    def key(self, name, settings):
+        return (self.module, name, type(self.backend).__name__, self.market_select.value,
+                self.market_store().version, self.rate.key()) + tuple(sorted(settings.items()))
+
+    def data(self, name, build, engine, *args, **settings):
+        if self.sample is not None and engine is self.sample:
+            return dict(build(*args, engine=engine, **settings).data)
+        return dict(result_cache.get(self.key(name, settings),
+                                     lambda: dict(build(*args, engine=engine, **settings).data)))
+
+    def prefetch(self, name, build, *args, **settings):
+        """
+        Task computing the data ahead of a request for it, for the Prefetcher
+        """
+        return lambda: result_cache.prefetch(self.key(name, settings), lambda: dict(build(*args, **settings).data))
@@ -0,0 +1,166 @@
+import threading
+import numpy as np
+from DataStore import binned_averages
+from Companies import premium_matrix
+
+# Normal quantile of the 95% confidence intervals
+z_score = 1.96
+
+
+class StratifiedSample(object):
+    """
+    Sample of the quotes stratified on the distinct values of one target column. Every slider range and bin is
+    a union of strata, so counts stay exact and only the premium statistics are estimated.
+
+    data = dataframe of quotes
+    columns = premium columns in lowest_columns order
+    size = number of rows kept, spread over the strata in proportion to their size (at least 2 per stratum)
+    premiums = premium matrix of data in columns order, extracted from data when not given
+    """
+
+    def __init__(self, data, columns, target_column, size=20000, seed=0, premiums=None):
+        target = data[target_column].to_numpy(dtype=float)
+        rows = np.flatnonzero(~np.isnan(target))
+        values, stratum, population = np.unique(target[rows], return_inverse=True, return_counts=True)
+        wanted = np.minimum(population, np.maximum(2, np.round(size * population / len(rows)))).astype(np.int64)
+
+        # Shuffle within each stratum and keep the first rows of every stratum
+        order = np.lexsort((np.random.RandomState(seed).random_sample(len(rows)), stratum))
+        start = np.concatenate(([0], np.cumsum(population)[:-1]))
+        rank = np.arange(len(rows)) - start[stratum[order]]
+        keep = order[rank < wanted[stratum[order]]]
+
+        self.columns = list(columns)
+        self.values = values
+        self.population = population
+        self.sampled = wanted
+        self.policy_count = np.bincount(stratum, weights=data['Policy No'].notna().to_numpy()[rows],
+                                        minlength=len(values)) if 'Policy No' in data else np.zeros(len(values))
+        self.stratum = stratum[keep]
+        self.premiums = (premium_matrix(data, self.columns) if premiums is None else premiums)[rows[keep]]
+        missing = np.isnan(self.premiums)
+        lowest = np.where(missing, np.inf, self.premiums).argmin(axis=1)
+        self.lowest = np.where(missing.all(axis=1), -1, lowest)
+
+    def _strata(self, range_start, range_end, include_end=False):
+        return (np.searchsorted(self.values, range_start, side='left'),
+                np.searchsorted(self.values, range_end, side='right' if include_end else 'left'))
+
+    def _by_stratum(self, weights, first, last):
+        selected = (self.stratum >= first) & (self.stratum < last)
+        return np.bincount(self.stratum[selected] - first, weights=weights[selected], minlength=last - first)
+
+    def ratio(self, numerator, denominator, first, last):
+        """
+        Stratified ratio estimate of sum(numerator) / sum(denominator) with the half width of its 95% interval
+        """
+        weight = (self.population / self.sampled)[first:last]
+        n = self.sampled[first:last]
+        y = self._by_stratum(numerator, first, last)
+        x = self._by_stratum(denominator, first, last)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            estimate = (weight * y).sum() / (weight * x).sum()
+            # Linearised variance of the ratio, residuals summed per stratum
+            residual = np.nan_to_num(numerator - estimate * denominator)
+            squares = self._by_stratum(residual ** 2, first, last)
+            sums = self._by_stratum(residual, first, last)
+            spread = np.where(n > 1, (squares - sums ** 2 / n) / np.maximum(n - 1, 1), 0)
+            variance = (self.population[first:last] ** 2 * (1 - n / self.population[first:last]) * spread /
+                        n).sum() / (weight * x).sum() ** 2
+        return estimate, z_score * np.sqrt(variance)
+
+
+class SampledBackend(object):
+    """
+    Answers the tab queries from a stratified sample of the store, so a query costs the same whatever the
+    size of the data. The samples are built per target column on first use and dropped when the store changes.
+
+    store = the DataStore of the tab
+    size = rows per sample
+    """
+
+    def __init__(self, store, size=20000):
+        self.store = store
+        self.size = size
+        self.samples = {}
+        self.lock = threading.Lock()
+        store.add_listener(self.samples.clear)
+
+    def sample(self, target_column):
+        with self.lock:
+            if target_column not in self.samples:
+                self.samples[target_column] = StratifiedSample(self.store.frame, self.store.lowest_columns,
+                                                               target_column, size=self.size,
+                                                               premiums=self.store.premiums())
+            return self.samples[target_column]
+
+    def average_premium_intervals(self, codes, range_start, range_end, target_column):
+        """
+        Estimated average of the non zero premiums of each company, by code, and the half width of its 95% interval
+        """
+        sample = self.sample(target_column)
+        first, last = sample._strata(range_start, range_end)
+        averages, intervals = [], []
+        for code in codes:
+            premium = sample.premiums[:, code]
+            nonzero = ~np.isnan(premium) & (premium != 0)
+            average, interval = sample.ratio(np.where(nonzero, premium, 0), nonzero.astype(float), first, last)
+            averages.append(average)
+            intervals.append(interval)
+        return averages, intervals
+
+    def average_premiums(self, codes, range_start, range_end, target_column):
+        return self.average_premium_intervals(codes, range_start, range_end, target_column)[0]
+
+    def histogram(self, codes, range_start, range_end, bin_width, target_column, wins=False):
+        """
+        wins = also return the estimated number of quotes where each of the lowest columns is the cheapest, per
+               bin, from the same strata
+        """
+        sample = self.sample(target_column)
+        first, last = sample._strata(range_start, range_end, include_end=True)
+        weight = (sample.population / sample.sampled)[first:last]
+        index = list(codes)
+        premiums = sample.premiums[:, index]
+        # Scale the sampled sums up to the strata so the bins average them like the exact engines
+        premium_sum = np.column_stack([sample._by_stratum(np.nan_to_num(premiums[:, i]), first, last) * weight
+                                       for i in range(len(index))]).reshape(last - first, len(index))
+        premium_missing = np.column_stack([sample._by_stratum(np.isnan(premiums[:, i]).astype(float), first, last)
+                                           for i in range(len(index))]).reshape(last - first, len(index))
+        lowest = None
+        if wins:
+            lowest = np.column_stack([sample._by_stratum((sample.lowest == i).astype(float), first, last) * weight
+                                      for i in range(len(sample.columns))]).reshape(last - first, len(sample.columns))
+        return binned_averages(sample.values[first:last], sample.population[first:last], premium_sum,
+                               premium_missing, range_start, range_end, bin_width, lowest)
+
+    def lowest_intervals(self, range_start, range_end, target_column):
+        """
+        Estimated number of quotes where each company is the cheapest, the half width of the 95% interval of
+        each share, both by code, and the number of policies in the range
+        """
+        sample = self.sample(target_column)
+        first, last = sample._strata(range_start, range_end)
+        quoted = (sample.lowest >= 0).astype(float)
+        total = sample.ratio(quoted, np.ones(len(quoted)), first, last)[0] * sample.population[first:last].sum()
+        counts, intervals = [], []
+        for i in range(len(sample.columns)):
+            share, interval = sample.ratio((sample.lowest == i).astype(float), np.ones(len(quoted)), first, last)
+            counts.append(share * sample.population[first:last].sum())
+            intervals.append(interval)
+        counts = np.round(np.nan_to_num(counts)).astype(np.int64)
+        # Shares of the quoted policies rather than of all the rows in the range
+        intervals = np.nan_to_num(intervals) * sample.population[first:last].sum() / max(total, 1)
+        return counts, intervals, int(sample.policy_count[first:last].sum())
+
+    def lowest_counts(self, range_start, range_end, target_column):
+        counts, intervals, subset_count = self.lowest_intervals(range_start, range_end, target_column)
+        return counts, subset_count
+
+    def policy_count(self):
+        return self.store.policy_count()
+
+
+# One sampled backend per store, kept by the store
+def get_sample(store, size=20000):
+    return store.derived(__name__, lambda store: SampledBackend(store, size))
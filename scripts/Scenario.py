@@ -0,0 +1,205 @@
+import logging
+import threading
+import weakref
+import numpy as np
+import pandas as pd
+from bokeh.layouts import row
+from bokeh.models import ColumnDataSource, HoverTool, NumeralTickFormatter
+from bokeh.plotting import figure
+from DataStore import histogram_bins
+from Companies import premium_matrix
+
+log = logging.getLogger(__name__)
+
+
+def policy_keys(data):
+    """
+    'Policy No' and occurrence of each quote, so the quotes sharing a policy number (one per vehicle on the vehicle
+    data) are paired in the order they come in. Returns the keys and the number of quotes repeating a policy number
+    """
+    occurrence = data.groupby('Policy No').cumcount()
+    # Quotes without a policy number are never joined
+    occurrence = occurrence.where(data['Policy No'].notna(), -1).to_numpy(dtype=np.int64)
+    return pd.MultiIndex.from_arrays([data['Policy No'].to_numpy(), occurrence]), int((occurrence > 0).sum())
+
+
+class ScenarioComparison(object):
+    """
+    Compares two snapshots of the same quotes, before and after a rate filing. The snapshots are joined once on
+    'Policy No' and the occurrence of the policy number, and each target column is then aggregated per distinct value in a single pass over the joined
+    rows, so every range and bin width is answered without going back to either snapshot.
+
+    baseline = dataframe of the quotes before the change
+    current = dataframe of the quotes after the change, its target columns place the policies in the bins
+    columns = premium columns in lowest_columns order, ties for the cheaper company go to the first one
+    gfb_column = premium column the win rates are computed for, against each of the other columns
+    baseline_premiums, current_premiums = premium matrices of the two snapshots in columns order, extracted from
+                                          the dataframes when not given
+    """
+
+    def __init__(self, baseline, current, columns, gfb_column, baseline_premiums=None, current_premiums=None):
+        self.columns = list(columns)
+        self.gfb = self.columns.index(gfb_column)
+        if baseline_premiums is None:
+            baseline_premiums = premium_matrix(baseline, self.columns)
+        if current_premiums is None:
+            current_premiums = premium_matrix(current, self.columns)
+        baseline_keys, self.baseline_duplicates = policy_keys(baseline)
+        current_keys, self.current_duplicates = policy_keys(current)
+        rows = baseline_keys.get_indexer(current_keys)
+        matched = (rows >= 0) & (current_keys.get_level_values(1) >= 0)
+        self.current = current[matched]
+        self.baseline_premiums = baseline_premiums[rows[matched]]
+        self.current_premiums = current_premiums[matched]
+        self.matched = int(matched.sum())
+        self.added = int(len(current) - self.matched)
+        self.removed = int(len(baseline) - self.matched)
+        log.info("Joined the baseline with the current quotes: %d matched, %d added, %d removed, %d and %d quotes "
+                 "repeating a policy number", self.matched, self.added, self.removed, self.baseline_duplicates,
+                 self.current_duplicates)
+        self.aggregates = {}
+        self.lock = threading.Lock()
+
+    def _wins(self, premiums):
+        """
+        Whether the GFB column is cheaper than each column and whether either of the two quoted,
+        with the idxmin rules: missing quotes lose and ties go to the first column
+        """
+        gfb = premiums[:, [self.gfb]]
+        gfb_quoted = ~np.isnan(gfb)
+        first = self.gfb < np.arange(len(self.columns))
+        wins = gfb_quoted & (np.isnan(premiums) | (gfb < premiums) | ((gfb == premiums) & first))
+        contested = gfb_quoted | ~np.isnan(premiums)
+        return wins, contested
+
+    def _aggregate(self, target_column):
+        target = self.current[target_column].to_numpy(dtype=float)
+        keep = ~np.isnan(target)
+        values, inverse = np.unique(target[keep], return_inverse=True)
+        n, k = len(values), len(self.columns)
+        cell = (inverse[:, None] * k + np.arange(k)).ravel()
+
+        def by_cell(weights):
+            return np.bincount(cell, weights=weights.ravel(), minlength=n * k).reshape(n, k)
+
+        aggregates = {'values': values, 'count': np.bincount(inverse, minlength=n)}
+        for name, premiums in [('baseline', self.baseline_premiums[keep]), ('current', self.current_premiums[keep])]:
+            nonzero = ~np.isnan(premiums) & (premiums != 0)
+            wins, contested = self._wins(premiums)
+            aggregates[name + '_sum'] = by_cell(np.where(nonzero, premiums, 0))
+            aggregates[name + '_count'] = by_cell(nonzero.astype(float))
+            aggregates[name + '_wins'] = by_cell(wins.astype(float))
+            aggregates[name + '_contested'] = by_cell(contested.astype(float))
+        return aggregates
+
+    def compare(self, columns, range_start, range_end, bin_width, target_column):
+        """
+        Per bin, bins as np.histogram over the current target column, of the matched policies: their count,
+        the change of the average non zero premium of each column and the change of the share of the quotes
+        where GFB is cheaper than each column (NaN for GFB itself)
+        """
+        with self.lock:
+            if target_column not in self.aggregates:
+                self.aggregates[target_column] = self._aggregate(target_column)
+            aggregates = self.aggregates[target_column]
+        index = [self.columns.index(column) for column in columns]
+        bins, edges = histogram_bins(aggregates['values'], range_start, range_end, bin_width)
+        inside = bins >= 0
+        bins, nbins = bins[inside], len(edges) - 1
+
+        def binned(name):
+            return np.column_stack([np.bincount(bins, weights=aggregates[name][inside, i], minlength=nbins)
+                                    for i in index]).reshape(nbins, len(index))
+
+        counts = np.bincount(bins, weights=aggregates['count'][inside], minlength=nbins).astype(np.int64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            deltas = (binned('current_sum') / binned('current_count') -
+                      binned('baseline_sum') / binned('baseline_count'))
+            shifts = (binned('current_wins') / binned('current_contested') -
+                      binned('baseline_wins') / binned('baseline_contested'))
+        shifts[:, [n for n, i in enumerate(index) if i == self.gfb]] = np.nan
+        return counts, edges, deltas, shifts
+
+
+# One comparison per pair of stores, kept by the current store as long as the baseline store lives, and rebuilt
+# when the version of either store changed
+_comparisons_lock = threading.Lock()
+
+
+def get_comparison(baseline_store, current_store, gfb_column):
+    comparisons = current_store.derived(__name__, lambda store: weakref.WeakKeyDictionary())
+    versions = (baseline_store.version, current_store.version)
+    with _comparisons_lock:
+        found = comparisons.get(baseline_store)
+        if found is None or found[0] != versions:
+            found = comparisons[baseline_store] = (versions, ScenarioComparison(
+                baseline_store.frame, current_store.frame, current_store.lowest_columns, gfb_column,
+                baseline_store.premiums(), current_store.premiums()))
+        return found[1]
+
+
+class ScenarioChart(object):
+    """
+    Change since the baseline of the average premium of each company and of the GFB win rate against it, per bin
+    of the X axis in a session. Holds the source of the two charts
+
+    registry = CompanyRegistry of the tab
+    companies = keys of the companies, in the order they are drawn
+    market_store, baseline_store = functions returning the current and the baseline store of the market shown
+    gfb_column = premium column the win rates are computed for
+    x_axis, range_select, binwidth_select = widgets of the tab giving the X axis column and its bins
+    """
+
+    def __init__(self, registry, companies, market_store, baseline_store, gfb_column, x_axis, range_select,
+                 binwidth_select):
+        self.companies = [registry[key] for key in companies]
+        self.market_store = market_store
+        self.baseline_store = baseline_store
+        self.gfb_column = gfb_column
+        self.x_axis = x_axis
+        self.range_select = range_select
+        self.binwidth_select = binwidth_select
+        self.src = ColumnDataSource(self.make_dataset())
+
+    def make_dataset(self):
+        comparison = get_comparison(self.baseline_store(), self.market_store(), self.gfb_column)
+        counts, edges, deltas, shifts = comparison.compare([company.column for company in self.companies],
+                                                           self.range_select.value[0], self.range_select.value[1],
+                                                           self.binwidth_select.value, self.x_axis.value)
+        data = pd.DataFrame({'left': edges[:-1], 'right': edges[1:], 'count': counts})
+        data['_interval'] = ['%d to %d' % (left, right) for left, right in zip(data['left'], data['right'])]
+        for n, company in enumerate(self.companies):
+            data[company.average_column.replace('average_premium', 'premium_delta')] = deltas[:, n]
+            data[company.average_column.replace('average_premium', 'win_shift')] = shifts[:, n]
+        return ColumnDataSource.from_df(data)
+
+    def make_plot(self, src):
+        """
+        Premium changes of every company and GFB win rate changes against each competitor, per bin
+        """
+        delta = figure(plot_width=600, plot_height=250, title='Premium Change Since Baseline',
+                       y_axis_label='Premium', tools="pan,wheel_zoom,reset")
+        shift = figure(plot_width=600, plot_height=250, title='Georgia Farm Win Rate Change Since Baseline',
+                       y_axis_label='Win Rate', x_range=delta.x_range, tools="pan,wheel_zoom,reset")
+        for company in self.companies:
+            name = company.average_column
+            delta.line(x='left', y=name.replace('average_premium', 'premium_delta'), source=src, color=company.color,
+                       line_width=2, legend=company.name, name=name.replace('average_premium', 'premium_delta'))
+            if company.column != self.gfb_column:
+                shift.line(x='left', y=name.replace('average_premium', 'win_shift'), source=src, color=company.color,
+                           line_width=2, legend='vs ' + company.name, name=name.replace('average_premium', 'win_shift'))
+        delta.yaxis.formatter = NumeralTickFormatter(format='$0,')
+        shift.yaxis.formatter = NumeralTickFormatter(format='+0%')
+        for p, value in [(delta, '@$name{$0,}'), (shift, '@$name{+0.0%}')]:
+            p.add_tools(HoverTool(tooltips=[('Change', value), ('Interval', '[@_interval)'),
+                                            ('Policy Count', '@count')], mode='mouse', toggleable=False))
+            p.toolbar.logo = None
+            p.legend.location = "top_right"
+            p.legend.click_policy = "hide"
+            p.legend.label_text_font_size = '8pt'
+            p.legend.spacing = 1
+            p.legend.padding = 5
+        return row(delta, shift)
+
+    def refresh(self):
+        self.src.data.update(self.make_dataset())
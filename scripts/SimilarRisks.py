@@ -0,0 +1,169 @@
+import threading
+import numpy as np
+from bokeh.layouts import column, row
+from bokeh.models import ColumnDataSource
+from bokeh.models.widgets import Button, DataTable, Div, NumberFormatter, Slider, TableColumn, TextInput
+
+
+class RiskIndex(object):
+    """
+    KD-tree over the rating variables of the quotes, each centred on its mean and divided by its standard
+    deviation so that a year of age and a point of credit score weigh by how much the quotes vary in them.
+    Quotes missing any of the variables are left out. The tree keeps the scaled variables only, the premiums are
+    read from the premium matrix of the store by row.
+
+    data = dataframe of quotes
+    columns = rating variables, the target columns of the tab
+    """
+
+    def __init__(self, data, columns):
+        # Only the lookup needs scipy
+        from scipy.spatial import cKDTree
+        self.columns = list(columns)
+        values = data[self.columns].to_numpy(dtype=float)
+        keep = ~np.isnan(values).any(axis=1)
+        self.rows = np.flatnonzero(keep)
+        values = values[keep]
+        self.center = values.mean(axis=0) if len(values) else np.zeros(len(self.columns))
+        scale = values.std(axis=0) if len(values) else np.ones(len(self.columns))
+        self.scale = np.where(scale > 0, scale, 1.0)
+        self.tree = cKDTree((values - self.center) / self.scale)
+
+    def nearest(self, profile, k=50):
+        """
+        Rows of the k quotes nearest to profile (one value per column) and their scaled distances, nearest first
+        """
+        k = min(k, len(self.rows))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        distances, positions = self.tree.query((np.asarray(profile, dtype=float) - self.center) / self.scale, k=k)
+        return self.rows[np.atleast_1d(positions)], np.atleast_1d(distances)
+
+
+def local_statistics(premiums, gfb):
+    """
+    Average non zero premium of each company over some quotes, and the share of the quoted ones where the GFB
+    column is the cheapest (missing premiums skipped, ties to the first column as idxmin)
+
+    premiums = premium matrix of the quotes, rows x companies in code order
+    gfb = code of GFB
+    """
+    missing = np.isnan(premiums)
+    nonzero = ~missing & (premiums != 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        averages = np.where(nonzero, premiums, 0).sum(axis=0) / nonzero.sum(axis=0)
+    quoted = ~missing.all(axis=1)
+    cheapest = np.where(missing, np.inf, premiums).argmin(axis=1)
+    win_rate = (cheapest[quoted] == gfb).mean() if quoted.any() else np.nan
+    return averages, win_rate
+
+
+class SimilarRisks(object):
+    """
+    Risk indexes of a store, one per set of rating variables, built on the first lookup and dropped when the
+    store changes
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.indexes = {}
+        self.lock = threading.Lock()
+        store.add_listener(self.indexes.clear)
+
+    def index(self, columns):
+        with self.lock:
+            if tuple(columns) not in self.indexes:
+                self.indexes[tuple(columns)] = RiskIndex(self.store.frame, columns)
+            return self.indexes[tuple(columns)]
+
+    def lookup(self, columns, profile, k, gfb):
+        """
+        The k quotes nearest to profile: their rows, distances and premium matrix, with the average premium of
+        each company and the GFB win rate among them
+        """
+        rows, distances = self.index(columns).nearest(profile, k)
+        premiums = self.store.premiums()[rows]
+        averages, win_rate = local_statistics(premiums, gfb)
+        return rows, distances, premiums, averages, win_rate
+
+
+# One set of risk indexes per store, kept by the store
+def get_similar(store):
+    return store.derived(__name__, SimilarRisks)
+
+
+class SimilarRisksTable(object):
+    """
+    Quotes nearest to the profile of a risk entered in a session, with what each company charges for them. Holds
+    an input per rating variable, the number of quotes to list, the button running the lookup, and the source and
+    summary of the table
+
+    registry = CompanyRegistry of the tab
+    market_store = function returning the store of the market shown
+    target_columns = rating variables of the profile
+    gfb_column = premium column the win rate is computed for
+    """
+
+    def __init__(self, registry, market_store, target_columns, gfb_column):
+        self.registry = registry
+        self.market_store = market_store
+        self.target_columns = list(target_columns)
+        self.gfb = registry.code(gfb_column)
+        self.inputs = [TextInput(title=target_column, value='', width=150) for target_column in self.target_columns]
+        self.count = Slider(start=10, end=200, step=10, value=50, title='Similar Quotes')
+        self.button = Button(label='Find Similar Quotes', width=200)
+        self.button.on_click(self.refresh)
+        self.status = Div(width=1200)
+        self.src = ColumnDataSource(self.make_dataset()[0])
+
+    def make_dataset(self):
+        """
+        The quotes nearest to the profile entered, over the target columns scaled by their spread, with the premium
+        of every company and the cheapest one. Returns the data and a summary with the GFB win rate and the average
+        premiums among them, None when a value of the profile is missing
+        """
+        registry = self.registry
+        data = dict((name, []) for name in ['policy', 'distance', 'cheapest'] +
+                    ['value_%d' % i for i in range(len(self.target_columns))] +
+                    ['premium_%d' % company.code for company in registry])
+        try:
+            profile = [float(widget.value) for widget in self.inputs]
+        except ValueError:
+            return data, None
+        current = self.market_store()
+        rows, distances, premiums, averages, win_rate = get_similar(current).lookup(
+            self.target_columns, profile, self.count.value, self.gfb)
+        frame = current.frame
+        data['policy'] = (frame['Policy No'].to_numpy()[rows] if 'Policy No' in frame else rows).tolist()
+        data['distance'] = distances
+        for i, target_column in enumerate(self.target_columns):
+            data['value_%d' % i] = frame[target_column].to_numpy(dtype=float)[rows]
+        cheapest = np.where(np.isnan(premiums), np.inf, premiums).argmin(axis=1)
+        data['cheapest'] = [registry[int(code)].name if quoted else ''
+                            for code, quoted in zip(cheapest, ~np.isnan(premiums).all(axis=1))]
+        for company in registry:
+            data['premium_%d' % company.code] = premiums[:, company.code]
+        summary = 'Georgia Farm is the cheapest for %s of the %d nearest quotes. Average premiums: %s' % (
+            'n/a' if np.isnan(win_rate) else '{:.0%}'.format(win_rate), len(rows),
+            ', '.join('%s %s' % (company.name, 'n/a' if np.isnan(averages[company.code]) else
+                                 '${:,.0f}'.format(averages[company.code])) for company in registry))
+        return data, summary
+
+    def make_plot(self, src, count, button, status, *inputs):
+        """
+        Profile inputs and table of the nearest quotes
+        """
+        columns = ([TableColumn(field='policy', title='Policy No'),
+                    TableColumn(field='distance', title='Distance', formatter=NumberFormatter(format='0.00'))] +
+                   [TableColumn(field='value_%d' % i, title=target_column)
+                    for i, target_column in enumerate(self.target_columns)] +
+                   [TableColumn(field='premium_%d' % company.code, title=company.name,
+                                formatter=NumberFormatter(format='$0,0')) for company in self.registry] +
+                   [TableColumn(field='cheapest', title='Cheapest')])
+        table = DataTable(source=src, columns=columns, width=1200, height=300, sortable=True, index_position=None)
+        return column(row(*inputs), row(count, button), status, table, name='similar')
+
+    def refresh(self):
+        data, summary = self.make_dataset()
+        self.src.data = data
+        self.status.text = summary or 'Enter a value for every rating variable to find the most similar quotes'
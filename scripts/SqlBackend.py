@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import numpy as np
+from DataStore import binned_averages
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+engines = ['duckdb', 'sqlite']
+
+
+def _quote(column):
+    """
+    Quote a column name for SQL, the premium columns contain spaces, colons and parentheses
+    """
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _lowest_case(lowest_columns):
+    """
+    SQL expression of the position in lowest_columns of the cheapest company, as idxmin(axis=1): missing quotes
+    are skipped, ties go to the first column, NULL when none quoted
+    """
+    quoted = [_quote(column) for column in lowest_columns]
+    cases = []
+    for i, column in enumerate(quoted):
+        # Only the later columns need checking, an earlier minimum would have matched its own case first
+        checks = ['%s IS NOT NULL' % column] + ['(%s IS NULL OR %s <= %s)' % (other, column, other)
+                                                for other in quoted[i + 1:]]
+        cases.append('WHEN %s THEN %d' % (' AND '.join(checks), i))
+    return 'CASE %s END' % ' '.join(cases)
+
+
+class SqlBackend(object):
+    """
+    Pushes the range filter and the per company aggregation of a tab down to an embedded SQL engine.
+
+    data = the dataframe the tab was built with
+    lowest_columns = premium columns the cheapest company is found among for the per bin wins, ties to the first
+    name = short name of the tab, used for the file names
+    engine = 'duckdb' (parquet file, multi-threaded scans) or 'sqlite' (indexed table), defaults to duckdb
+             when it is installed
+    directory = where the columnar file / database is written, defaults to a temporary directory
+    """
+
+    def __init__(self, data, lowest_columns, name='quotes', engine=None, directory=None):
+        if engine is None:
+            engine = 'duckdb' if duckdb is not None else 'sqlite'
+        assert engine in engines, "Engine must be one of %s" % engines
+        if engine == 'duckdb' and duckdb is None:
+            raise ImportError("The duckdb engine needs the duckdb package, use engine='sqlite' instead")
+
+        self.engine = engine
+        self.name = name
+        self.lowest_columns = list(lowest_columns)
+        self.directory = directory or tempfile.mkdtemp(prefix='dashboard_')
+        self.indexed = set()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.con, self.parts = self._connect(data)
+
+    def _connect(self, data):
+        """
+        Loads the data into a new connection, file names carry a generation so a reload can be built next to
+        the data being served
+        """
+        if self.engine == 'duckdb':
+            # One parquet file per appended batch, the view reads all of them
+            con = duckdb.connect()
+            parts = []
+            self._write_part(con, parts, data)
+        else:
+            parts = [os.path.join(self.directory, '%s-%04d.sqlite' % (self.name, self.generation))]
+            if os.path.exists(parts[0]):
+                os.remove(parts[0])
+            # Callbacks and background threads share the connection, access is serialised with the lock
+            con = sqlite3.connect(parts[0], check_same_thread=False)
+            data.to_sql('quotes', con, index=False)
+        return con, parts
+
+    def _write_part(self, con, parts, data):
+        path = os.path.join(self.directory, '%s-%04d-%04d.parquet' % (self.name, self.generation, len(parts)))
+        con.register('frame', data)
+        con.execute("COPY (SELECT * FROM frame) TO '%s' (FORMAT PARQUET)" % path.replace("'", "''"))
+        con.unregister('frame')
+        parts.append(path)
+        con.execute("CREATE OR REPLACE VIEW quotes AS SELECT * FROM read_parquet([%s], union_by_name=true)"
+                    % ', '.join("'%s'" % part.replace("'", "''") for part in parts))
+
+    def append(self, batch):
+        """
+        Adds a batch of quotes, only the batch is written
+        """
+        with self.lock:
+            if self.engine == 'duckdb':
+                self._write_part(self.con, self.parts, batch)
+            else:
+                batch.to_sql('quotes', self.con, if_exists='append', index=False)
+
+    def replace(self, data):
+        """
+        Swaps in a reloaded dataset. The new generation is loaded while the current one keeps serving queries
+        """
+        with self.lock:
+            self.generation += 1
+        con, parts = self._connect(data)
+        with self.lock:
+            old, old_parts = self.con, self.parts
+            self.con, self.parts = con, parts
+            self.indexed = set()
+        old.close()
+        for part in old_parts:
+            if os.path.exists(part):
+                os.remove(part)
+
+    def _columns(self, codes):
+        return [self.lowest_columns[code] for code in codes]
+
+    def _query(self, sql, parameters=()):
+        with self.lock:
+            return self.con.execute(sql, parameters).fetchall()
+
+    def _index(self, target_column):
+        """
+        SQLite needs an index on the slider column for the range predicate, parquet has min/max statistics instead.
+        The index is named after the column, so sessions indexing columns at the same time never share a name
+        """
+        if self.engine != 'sqlite':
+            return
+        with self.lock:
+            if target_column not in self.indexed:
+                self.con.execute('CREATE INDEX IF NOT EXISTS %s ON quotes (%s)'
+                                 % (_quote('idx_' + target_column), _quote(target_column)))
+                self.indexed.add(target_column)
+
+    def average_premiums(self, codes, range_start, range_end, target_column):
+        """
+        Average of the non zero premiums of each company for range_start <= target_column < range_end,
+        in the same order as codes (NaN when a company has no quotes in the range)
+        """
+        self._index(target_column)
+        select = ', '.join('AVG(CASE WHEN %s != 0 THEN %s END)' % (_quote(column), _quote(column))
+                           for column in self._columns(codes))
+        row = self._query('SELECT %s FROM quotes WHERE ? <= %s AND %s < ?'
+                          % (select, _quote(target_column), _quote(target_column)),
+                          (range_start, range_end))[0]
+        return [float('nan') if value is None else value for value in row]
+
+    def histogram(self, codes, range_start, range_end, bin_width, target_column, wins=False):
+        """
+        Count and average premium (zeros included) per bin, as np.histogram and binned_statistic.
+        The engine groups by distinct value, the few groups are then rolled up into the bins
+
+        wins = also return the number of quotes where each of lowest_columns is the cheapest, per bin, counted in
+               the same query
+        """
+        self._index(target_column)
+        target = _quote(target_column)
+        select = ', '.join(['COUNT(*)'] + ['SUM(%s), COUNT(*) - COUNT(%s)' % (_quote(column), _quote(column))
+                                           for column in self._columns(codes)])
+        source = 'quotes'
+        if wins:
+            select += ''.join(', SUM(CASE WHEN lowest = %d THEN 1 ELSE 0 END)' % i
+                              for i in range(len(self.lowest_columns)))
+            source = '(SELECT *, %s AS lowest FROM quotes)' % _lowest_case(self.lowest_columns)
+        rows = self._query('SELECT %s, %s FROM %s WHERE ? <= %s AND %s <= ? GROUP BY %s ORDER BY %s'
+                           % (target, select, source, target, target, target, target), (range_start, range_end))
+        k = 2 * len(codes)
+        grouped = np.array(rows, dtype=float).reshape(len(rows), 2 + k + (len(self.lowest_columns) if wins else 0))
+        return binned_averages(grouped[:, 0], grouped[:, 1], np.nan_to_num(grouped[:, 2:2 + k:2]),
+                               grouped[:, 3:2 + k:2], range_start, range_end, bin_width,
+                               grouped[:, 2 + k:] if wins else None)
+
+    def lowest_counts(self, range_start, range_end, target_column):
+        """
+        Number of quotes where each company is the cheapest for range_start <= target_column < range_end, by
+        code. Matches idxmin(axis=1): missing quotes are skipped and ties go to the first column of
+        lowest_columns. Returns the counts and the number of policies in the range
+        """
+        self._index(target_column)
+        lowest = _lowest_case(self.lowest_columns)
+        where = '? <= %s AND %s < ?' % (_quote(target_column), _quote(target_column))
+        rows = self._query('SELECT %s AS lowest, COUNT(*) FROM quotes WHERE %s GROUP BY lowest'
+                           % (lowest, where), (range_start, range_end))
+        counts = np.zeros(len(self.lowest_columns), dtype=np.int64)
+        for code, value in rows:
+            if code is not None:
+                counts[int(code)] = value
+        subset_count = self._query('SELECT COUNT("Policy No") FROM quotes WHERE %s' % where,
+                                   (range_start, range_end))[0][0]
+        return counts, subset_count
+
+    def policy_count(self):
+        return self._query('SELECT COUNT("Policy No") FROM quotes')[0][0]
+
+    def close(self):
+        with self.lock:
+            self.con.close()
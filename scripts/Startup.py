@@ -0,0 +1,57 @@
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# Startup report of every session of the process
+reports = []
+# Stores already counted in a report, their loading is only paid by the first session
+_seen = set()
+
+
+class StartupProfile(object):
+    """
+    Times the start of a session in phases: imports, reading the data files, building the per value aggregates
+    and building the document. Imports and loads only cost anything for the first session of the process.
+
+    started = perf_counter value the session started at, before the imports
+    """
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.last = self.started
+        self.phases = {}
+
+    def mark(self, phase):
+        """
+        Ends a phase, its time runs from the end of the previous one
+        """
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def report(self, stores, aggregated):
+        """
+        Splits the loading into file selection and reading, the document build into aggregation and the rest
+
+        stores = the stores of the session
+        aggregated = their total aggregate_seconds before the document was built
+        """
+        new = [store for store in stores if store.name not in _seen]
+        _seen.update(store.name for store in new)
+        load = sum((store.load_seconds for store in new), 0.0)
+        aggregation = sum(store.aggregate_seconds for store in stores) - aggregated
+        phases = {'import': self.phases.get('import', 0.0),
+                  # The file dialogs wait for the user
+                  'file_selection': max(self.phases.get('load', 0.0) - load, 0.0),
+                  'load': load,
+                  'aggregation': aggregation,
+                  'document': self.phases.get('document', 0.0) - aggregation,
+                  'total': self.last - self.started}
+        report = dict(('%s_seconds' % phase, seconds) for phase, seconds in phases.items())
+        report['first_session'] = bool(new)
+        reports.append(report)
+        log.info("Session started in %(total_seconds).3fs: import %(import_seconds).3fs, "
+                 "file selection %(file_selection_seconds).3fs, load %(load_seconds).3fs, "
+                 "aggregation %(aggregation_seconds).3fs, document %(document_seconds).3fs", report)
+        return report
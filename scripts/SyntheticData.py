@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import PolicyTab
+import VehicleTab
+import HomeTab
+
+# Tab modules and the range of the values of their slider columns
+tabs = {'policy': PolicyTab, 'vehicle': VehicleTab, 'home': HomeTab}
+target_ranges = {'policy': {'Age Max': (16, 95), 'Age Min': (16, 95),
+                            'Credit Score Max': (300, 900), 'Credit Score Min': (300, 900),
+                            'Vehicle Newest': (1980, 2022), 'Vehicle Oldest': (1975, 2022)},
+                 'vehicle': {'Age': (16, 95), 'Credit': (300, 900), 'Model Year': (1980, 2022)},
+                 'home': {'Credit Score': (300, 900), 'Year Built': (1900, 2022)}}
+# Markets and their share of the quotes
+markets = {'GA': 0.55, 'AL': 0.2, 'FL': 0.15, 'SC': 0.07, 'TN': 0.03}
+
+
+def quotes(tab, rows=100000, seed=0, missing=0.05, zeros=0.05, rounding=0.01):
+    """
+    Random quotes with the columns of a tab, for benchmarks and checks when no real file is at hand
+
+    tab = 'policy', 'vehicle' or 'home'
+    rows = number of quotes
+    missing = share of the premiums left empty (company did not quote)
+    zeros = share of the premiums set to 0
+    rounding = premiums are rounded to this, a coarse rounding makes ties between companies frequent
+    The market of each quote is in the State column
+    """
+    rng = np.random.RandomState(seed)
+    data = {column: rng.randint(low, high + 1, rows) for column, (low, high) in target_ranges[tab].items()}
+    data['Policy No'] = np.arange(rows)
+    data['State'] = rng.choice(list(markets), rows, p=list(markets.values()))
+    for column in tabs[tab].lowest_columns:
+        premium = np.round(rng.gamma(4, 300, rows) / rounding) * rounding
+        premium[rng.random_sample(rows) < zeros] = 0
+        premium[rng.random_sample(rows) < missing] = np.nan
+        data[column] = premium
+    return pd.DataFrame(data)
@@ -0,0 +1,206 @@
+import logging
+import threading
+import numpy as np
+import bokeh
+from bokeh.model import Model, collect_filtered_models
+from bokeh.settings import settings
+from bokeh.util import serialization
+
+log = logging.getLogger(__name__)
+
+# The copies write the property stores of the models, the owners of their containers and the id counter of bokeh
+# directly, as bokeh 1.3.4 keeps them. Any other release builds every graph as if there were no templates
+tested_versions = ['1.3.4']
+try:
+    from bokeh.core.property.wrappers import PropertyValueContainer
+    supported = bokeh.__version__ in tested_versions and hasattr(serialization, '_simple_id_lock')
+except ImportError:
+    supported = False
+if not supported:
+    log.warning("Model templates are disabled, they need bokeh %s and bokeh %s is installed",
+                ' or '.join(tested_versions), bokeh.__version__)
+
+
+def new_ids(count):
+    """
+    count new model ids, taken from the bokeh counter at once rather than one by one
+    """
+    if not settings.simple_ids(True):
+        return iter([serialization.make_globally_unique_id() for _ in range(count)])
+    with serialization._simple_id_lock:
+        first = serialization._simple_id + 1
+        serialization._simple_id += count
+    return iter([str(first + i) for i in range(count)])
+
+
+def _blank(cls, ids=None):
+    """
+    Model of class cls with a new id (the next of ids when given) and no property set, skipping the validation
+    of __init__
+    """
+    model = cls.__new__(cls) if ids is None else cls.__new__(cls, id=next(ids))
+    model._property_values = {}
+    model._unstable_default_values = {}
+    model._unstable_themed_values = {}
+    model._callbacks = {}
+    model._event_callbacks = {}
+    return model
+
+
+def copy_models(value, clones, ids=None):
+    """
+    Copy of value where every model reachable from it is replaced by a copy of its own, with new ids. Property
+    values are copied as they are, without validation; lists and dicts are copied, arrays and strings shared.
+
+    value = a model, or a property value holding models
+    clones = models already copied or substituted, by id() of the original, updated with the new copies. Models
+    found there are not descended into
+    ids = iterator of the ids of the copies, new ones are made when not given
+    """
+    if isinstance(value, Model):
+        found = clones.get(id(value))
+        if found is not None:
+            return found
+        cls = type(value)
+        model = clones[id(value)] = _blank(cls, ids)
+        # The unstable defaults hold the models created on first access, the toolbar of a plot for one
+        for values, copies in [(value._property_values, model._property_values),
+                               (value._unstable_default_values, model._unstable_default_values)]:
+            for name, item in values.items():
+                descriptor = getattr(cls, name)
+                item = descriptor.property.wrap(copy_models(item, clones, ids))
+                if isinstance(item, PropertyValueContainer):
+                    item._register_owner(model, descriptor)
+                copies[name] = item
+        return model
+    if isinstance(value, dict):
+        return dict((key, copy_models(item, clones, ids)) for key, item in value.items())
+    if isinstance(value, list):
+        return [copy_models(item, clones, ids) for item in value]
+    if isinstance(value, tuple):
+        return tuple(copy_models(item, clones, ids) for item in value)
+    return value
+
+
+def _state(value):
+    """
+    Comparable form of a property value, models and arrays by identity
+    """
+    if isinstance(value, (Model, np.ndarray)):
+        return type(value).__name__, id(value)
+    if isinstance(value, dict):
+        return tuple((key, _state(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_state(item) for item in value)
+    return value
+
+
+def _states(model, defaults=True):
+    values = dict(model._unstable_default_values) if defaults else {}
+    values.update(model._property_values)
+    return dict((name, _state(value)) for name, value in values.items())
+
+
+def _python_callbacks(model):
+    return sum(len(callbacks) for callbacks in model._callbacks.values()) + \
+           sum(len(callbacks) for callbacks in model._event_callbacks.values())
+
+
+class ModelTemplate(object):
+    """
+    Model graph returned by build(*args), kept to be copied for every later session instead of built again.
+    The arguments are the models of the session the graph uses without owning them (its data sources and
+    widgets); a copy uses the arguments it is given in their place. The properties build sets on its arguments,
+    such as JavaScript callbacks on a source, are set again on the arguments of every copy.
+    build must reach any other model of the session only through args, and must not add Python callbacks, which
+    cannot be copied.
+
+    root = graph returned by build
+    args = models of the session building the template, the template keeps none of them
+    before = property states and Python callback counts of args before build ran
+    """
+
+    def __init__(self, build, root, args, before):
+        for arg, (states, callbacks) in zip(args, before):
+            if _python_callbacks(arg) != callbacks:
+                raise ValueError("%s adds Python callbacks to %s, they cannot be copied" % (build.__name__, arg))
+        arg_ids = set(id(arg) for arg in args)
+        if any(_python_callbacks(model) for model in collect_filtered_models(lambda model: id(model) in arg_ids,
+                                                                                 root)):
+            raise ValueError("%s adds Python callbacks to the models it builds, they cannot be copied" %
+                             build.__name__)
+        # Detached stand-ins for the arguments
+        self.args = [_blank(type(arg)) for arg in args]
+        clones = dict((id(arg), placeholder) for arg, placeholder in zip(args, self.args))
+        self.root = copy_models(root, clones)
+        # Properties of the arguments set by build, with the values of the copy. Defaults build only read are
+        # left alone
+        self.changes = []
+        for i, (arg, (states, callbacks)) in enumerate(zip(args, before)):
+            for name, state in _states(arg, defaults=False).items():
+                if name not in states or states[name] != state:
+                    self.changes.append((i, name, copy_models(getattr(arg, name), clones)))
+        # Models of a copy
+        self.size = len(clones) - len(args)
+
+    @classmethod
+    def build(cls, build, args):
+        """
+        Runs build(*args) and makes a template of the graph, returns both
+        """
+        before = [(_states(arg), _python_callbacks(arg)) for arg in args]
+        root = build(*args)
+        return cls(build, root, args, before), root
+
+    def copy(self, *args):
+        """
+        A new copy of the graph using args in place of the arguments of the template
+        """
+        clones = dict((id(placeholder), arg) for placeholder, arg in zip(self.args, args))
+        ids = new_ids(self.size)
+        root = copy_models(self.root, clones, ids)
+        for i, name, value in self.changes:
+            setattr(args[i], name, copy_models(value, clones, ids))
+        return root
+
+
+class TemplateCache(object):
+    """
+    Templates of the model graphs of the tabs, built by the first session of the process that needs each one and
+    copied for the sessions after it. A copy costs a small part of a build: the properties are neither validated
+    nor defaulted again, and the legends are not looked up through the whole plot for every glyph.
+    The keys hold everything a graph depends on besides its arguments.
+
+    enabled = copy the templates, when False (or when the installed bokeh is not supported) every graph is built as
+    if there were none
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.templates = {}
+        self.lock = threading.Lock()
+        self.builds = 0
+        self.copies = 0
+
+    def get(self, key, build, *args):
+        """
+        The graph of build(*args), built the first time key is asked for and a copy of the template after that
+        """
+        if not self.enabled or not supported:
+            return build(*args)
+        with self.lock:
+            template = self.templates.get(key)
+            if template is None:
+                self.templates[key], root = ModelTemplate.build(build, args)
+                self.builds += 1
+                # The session building the template keeps what it built
+                return root
+            self.copies += 1
+        return template.copy(*args)
+
+    def log_metrics(self):
+        log.info("Model templates: %d built, %d copies", self.builds, self.copies)
+
+
+# One template cache for the whole process
+templates = TemplateCache()
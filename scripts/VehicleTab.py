@@ -1,12 +1,28 @@
 import pandas as pd
 import numpy as np
-from scipy.stats import binned_statistic
 from math import pi
-from bokeh.transform import cumsum
+from bokeh.transform import cumsum, stack
 from bokeh.plotting import figure
-from bokeh.models import ColumnDataSource, HoverTool, WheelZoomTool, LabelSet
+from bokeh.models import ColumnDataSource, HoverTool, WheelZoomTool, LabelSet, Whisker, NumeralTickFormatter
+from bokeh.models import TapTool
 from bokeh.models.widgets import Panel, Slider, RangeSlider, Select
+from bokeh.models.widgets import DataTable
 from bokeh.layouts import row, WidgetBox, column
+from bokeh.io import curdoc
+from DataStore import DataStore, band_statistics, statistic_label
+from ClientSide import tab_config, rebin_callback
+from Scenario import ScenarioChart
+from WhatIf import RateChange
+from Ranks import RankChart
+from Companies import CompanyRegistry
+from GridCube import HeatmapChart
+from PremiumChart import premium_lines, premium_statistic
+from ResultCache import SharedResults
+from Templates import templates
+from Prefetch import Prefetcher
+from DrillDown import DrillDownTable
+from SimilarRisks import SimilarRisksTable
+from QuoteScatter import QuoteScatterChart
 
 companies = ['Progressive', 'Country', 'Auto_Owners',
              'StateFarm', 'USAA', 'Liberty', 'GFB']
@@ -42,24 +58,132 @@ policy_dictionary = {
             'Farm Bureau Mutual: Total Vehicle Premium',
             '#d53e4f', 'solid', 'Georgia Farm']}
 
+# Column order decides ties for the cheapest company
+lowest_columns = ['Auto Owners (Auto-Owners): Total Vehicle Premium',
+                  'Country Companies (Mutual CMIC): Total Vehicle Premium',
+                  'Farm Bureau Mutual: Total Vehicle Premium',
+                  'LM General Insurance Company (LM Ins Co): Total Vehicle Premium',
+                  'Prog Mountain: Total Vehicle Premium',
+                  'State Farm Auto (SFM): Total Vehicle Premium',
+                  'USAA Auto (USAA): Total Vehicle Premium']
+
+# Distribution column holding the average premium of each premium column
+average_columns = {'Farm Bureau Mutual: Total Vehicle Premium': 'gfb_average_premium',
+                   'Prog Mountain: Total Vehicle Premium': 'progressive_average_premium',
+                   'Country Companies (Mutual CMIC): Total Vehicle Premium': 'country_average_premium',
+                   'Auto Owners (Auto-Owners): Total Vehicle Premium': 'auto_owners_average_premium',
+                   'State Farm Auto (SFM): Total Vehicle Premium': 'state_farm_average_premium',
+                   'USAA Auto (USAA): Total Vehicle Premium': 'usaa_average_premium',
+                   'LM General Insurance Company (LM Ins Co): Total Vehicle Premium': 'liberty_average_premium'}
+
+# Companies of the tab by code, code i is column i of lowest_columns and of the premium matrix of the store
+registry = CompanyRegistry(policy_dictionary, lowest_columns, average_columns)
+
+
+def _tab(policy_data, backend=None, sample=None, client=False, baseline=None, prefetch=None):
+    """
+    policy_data = dataframe of quotes, or the DataStore shared by all sessions. A store partitioned by market
+                  (market_column) adds a market selector
+    backend = optional engine the range filter and aggregation are pushed down to (SqlBackend or DataStore),
+              the pandas code below is used when none is given
+    sample = optional SampledBackend answering while the widgets move, exact numbers follow once they stop
+    client = re-bin in the browser while the range and bin width sliders move, the server only recomputes
+             when the X axis changes
+    baseline = optional dataframe or DataStore of the same quotes before a rate change, adds the premium and
+               win rate changes since then
+    prefetch = optional PrefetchBudget, the slider states next to the shown one are computed within it while the
+               session is idle
+    """
+    if isinstance(policy_data, DataStore):
+        store = policy_data
+    else:
+        store = DataStore(policy_data, lowest_columns)
+    if baseline is not None and not isinstance(baseline, DataStore):
+        baseline = DataStore(baseline, lowest_columns, name=store.name + '-baseline')
+    # Percentile bands on the premium chart when the store sketches the premiums for them
+    bands = all(statistic in store.statistics for statistic in band_statistics)
+
+    doc = curdoc()
+    prefetcher = Prefetcher(doc, prefetch) if prefetch is not None else None
+    # Milliseconds without widget changes before the sampled numbers are replaced by exact ones
+    refine_milliseconds = 400
+    pending_refine = []
+    pending_panels = []
+    all_markets = 'All'
+
+    def market_store():
+        """
+        Store of the selected market, the whole store when all the markets are shown
+        """
+        if market_select.value == all_markets:
+            return store
+        return store.partition(market_select.value)
+
+    def baseline_store():
+        if market_select.value == all_markets:
+            return baseline
+        return baseline.partition(market_select.value)
+
+    def tab_engine(engine):
+        """
+        Engine of a query: the given one or else the backend of the tab, the partition of a selected market
+        """
+        if market_select.value != all_markets:
+            return market_store()
+        return backend if engine is None else engine
+
+    def slider_sources(range_start, range_end, bin_width):
+        """
+        The (name, build, args, settings) of the sources the range and bin width sliders change
+        """
+        return [('dataset', make_dataset, [companies],
+                 dict(range_start=range_start, range_end=range_end, target_column=x_axis.value)),
+                ('distribution', make_dataset_distribution, [market_store()],
+                 dict(range_start=range_start, range_end=range_end, bin_width=bin_width,
+                      statistic=statistic_select.value, target_column=x_axis.value)),
+                ('winrate', make_dataset_winrate, [companies],
+                 dict(range_start=range_start, range_end=range_end, target_column=x_axis.value))]
+
+    def prefetch_neighbours():
+        """
+        Computes the results of the slider states one step away while the session is idle
+        """
+        if prefetcher is not None and not client_rebins():
+            prefetcher.schedule_neighbours(shared, slider_sources, range_select, binwidth_select)
 
-def _tab(policy_data):
-    def make_dataset_distribution(policy_data, range_start=0, range_end=1000, bin_width=20, target_column='Age'):
+    def make_dataset_distribution(store, range_start=0, range_end=1000, bin_width=20, target_column='Age',
+                                  statistic='mean', engine=None):
         """
         districts = list of districts we will iterate through
         range_start = start of the slider for the x-axis
         range_end = end of the slider for the x-axis
         bin_width = the amount of bins for which the data will be placed into
+        statistic = premium statistic of the premium chart, the ones other than the average come from the store
+        engine = backend to use instead of the one of the tab
         """
+        engine = tab_engine(engine)
         # Check to make sure the start is less than the end!
         assert range_start < range_end, "Start must be less than end!"
 
         range_extent = range_end - range_start
 
-        # Create a histogram with specified bins and range
-        arr_hist, edges = np.histogram(policy_data[target_column],
-                                       bins=int(range_extent / bin_width),
-                                       range=[range_start, range_end])
+        if engine is not None:
+            # Cheapest company counts per bin come out of the same pass as the histogram
+            arr_hist, edges, averages, bin_wins = engine.histogram(registry.codes(average_columns), range_start,
+                                                                   range_end, bin_width, target_column, wins=True)
+        else:
+            policy_data = store.frame
+            # Create a histogram with specified bins and range
+            arr_hist, edges = np.histogram(policy_data[target_column],
+                                           bins=int(range_extent / bin_width),
+                                           range=[range_start, range_end])
+            # Cheapest company of each quote, counted per bin
+            subset = policy_data[(range_start <= policy_data[target_column]) &
+                                 (policy_data[target_column] <= range_end)]
+            bin_index = pd.Series(np.clip(np.digitize(subset[target_column], edges) - 1, 0, len(edges) - 2),
+                                  index=subset.index)
+            bin_wins = pd.crosstab(bin_index, subset[lowest_columns].idxmin(axis=1)).reindex(
+                index=range(len(edges) - 1), columns=lowest_columns, fill_value=0).to_numpy()
 
         # Divide the counts by the total to get a proportion and create df
         arr_df = pd.DataFrame({'proportion': arr_hist / np.sum(arr_hist),
@@ -74,38 +198,63 @@ def _tab(policy_data):
 
         arr_df['count'] = arr_hist
 
-        arr_df['gfb_average_premium'] = binned_statistic(policy_data[target_column],
-                                                         policy_data['Farm Bureau Mutual: Total Vehicle Premium'],
-                                                         bins=int(range_extent / bin_width),
-                                                         range=[range_start, range_end])[0]
-        arr_df['progressive_average_premium'] = binned_statistic(policy_data[target_column],
-                                                                 policy_data['Prog Mountain: Total Vehicle Premium'],
-                                                                 bins=int(range_extent / bin_width),
-                                                                 range=[range_start, range_end])[0]
-        arr_df['country_average_premium'] = binned_statistic(policy_data[target_column],
-                                                             policy_data[
-                                                                 'Country Companies (Mutual CMIC): Total Vehicle Premium'],
+        # Share of the quotes of each bin where each company is the cheapest
+        quoted = bin_wins.sum(axis=1)
+        for i, column in enumerate(lowest_columns):
+            arr_df[average_columns[column].replace('average_premium', 'win_share')] = np.where(
+                quoted > 0, bin_wins[:, i] / np.maximum(quoted, 1), 0.0)
+
+        # Aggregated by the store in the same pass as the sums, whatever engine the tab runs on
+        extra = list(band_statistics) if bands else []
+        if statistic != 'mean' and statistic not in extra:
+            extra.append(statistic)
+        statistics = store.premium_statistics(registry.codes(average_columns), range_start, range_end, bin_width,
+                                              target_column, extra) if extra else {}
+        for name in band_statistics if bands else []:
+            for n, column in enumerate(average_columns):
+                arr_df[average_columns[column].replace('average', name)] = statistics[name][:, n]
+
+        if statistic != 'mean':
+            for n, column in enumerate(average_columns):
+                arr_df[average_columns[column]] = statistics[statistic][:, n]
+        elif engine is not None:
+            for n, column in enumerate(average_columns):
+                arr_df[average_columns[column]] = averages[:, n]
+        else:
+            # Only the pandas reference path needs scipy
+            from scipy.stats import binned_statistic
+            arr_df['gfb_average_premium'] = binned_statistic(policy_data[target_column],
+                                                             policy_data['Farm Bureau Mutual: Total Vehicle Premium'],
                                                              bins=int(range_extent / bin_width),
                                                              range=[range_start, range_end])[0]
-        arr_df['auto_owners_average_premium'] = binned_statistic(policy_data[target_column],
+            arr_df['progressive_average_premium'] = binned_statistic(policy_data[target_column],
+                                                                     policy_data['Prog Mountain: Total Vehicle Premium'],
+                                                                     bins=int(range_extent / bin_width),
+                                                                     range=[range_start, range_end])[0]
+            arr_df['country_average_premium'] = binned_statistic(policy_data[target_column],
                                                                  policy_data[
-                                                                     'Auto Owners (Auto-Owners): Total Vehicle Premium'],
+                                                                     'Country Companies (Mutual CMIC): Total Vehicle Premium'],
+                                                                 bins=int(range_extent / bin_width),
+                                                                 range=[range_start, range_end])[0]
+            arr_df['auto_owners_average_premium'] = binned_statistic(policy_data[target_column],
+                                                                     policy_data[
+                                                                         'Auto Owners (Auto-Owners): Total Vehicle Premium'],
+                                                                     bins=int(range_extent / bin_width),
+                                                                     range=[range_start, range_end])[0]
+            arr_df['state_farm_average_premium'] = binned_statistic(policy_data[target_column],
+                                                                    policy_data[
+                                                                        'State Farm Auto (SFM): Total Vehicle Premium'],
+                                                                    bins=int(range_extent / bin_width),
+                                                                    range=[range_start, range_end])[0]
+            arr_df['usaa_average_premium'] = binned_statistic(policy_data[target_column],
+                                                              policy_data['USAA Auto (USAA): Total Vehicle Premium'],
+                                                              bins=int(range_extent / bin_width),
+                                                              range=[range_start, range_end])[0]
+            arr_df['liberty_average_premium'] = binned_statistic(policy_data[target_column],
+                                                                 policy_data[
+                                                                     'LM General Insurance Company (LM Ins Co): Total Vehicle Premium'],
                                                                  bins=int(range_extent / bin_width),
                                                                  range=[range_start, range_end])[0]
-        arr_df['state_farm_average_premium'] = binned_statistic(policy_data[target_column],
-                                                                policy_data[
-                                                                    'State Farm Auto (SFM): Total Vehicle Premium'],
-                                                                bins=int(range_extent / bin_width),
-                                                                range=[range_start, range_end])[0]
-        arr_df['usaa_average_premium'] = binned_statistic(policy_data[target_column],
-                                                          policy_data['USAA Auto (USAA): Total Vehicle Premium'],
-                                                          bins=int(range_extent / bin_width),
-                                                          range=[range_start, range_end])[0]
-        arr_df['liberty_average_premium'] = binned_statistic(policy_data[target_column],
-                                                             policy_data[
-                                                                 'LM General Insurance Company (LM Ins Co): Total Vehicle Premium'],
-                                                             bins=int(range_extent / bin_width),
-                                                             range=[range_start, range_end])[0]
         # Convert dataframe to column data source
         return ColumnDataSource(arr_df)
 
@@ -129,9 +278,34 @@ def _tab(policy_data):
             mode='vline', toggleable=False)
 
         p.add_tools(hover)
+        # Clicking a bar lists its quotes in the drill-down table
+        p.add_tools(TapTool())
         p.toolbar.logo = None
         return p
 
+    def make_plot_winrate_bins(src):
+        """
+        Share of the quotes of each bin where each company is the cheapest, stacked in lowest_columns order
+        """
+        p = figure(plot_width=1200, plot_height=250, title='Cheapest Company by Bin',
+                   x_axis_label='Age Max', y_axis_label='Win Rate', y_range=(0, 1), tools="")
+        shares = [company.average_column.replace('average_premium', 'win_share') for company in registry]
+        for company in registry:
+            i = company.code
+            p.quad(source=src, left='left', right='right', bottom=stack(*shares[:i]) if i else 0,
+                   top=stack(*shares[:i + 1]), color=company.color, fill_alpha=0.8, line_color='white',
+                   legend=company.name, name=shares[i])
+        p.yaxis.formatter = NumeralTickFormatter(format='0%')
+        p.add_tools(HoverTool(tooltips=[('Interval', '[@_interval)'), ('Win Rate', '@$name{0.0%}'),
+                                        ('Policy Count', '@count')], mode='mouse', toggleable=False))
+        p.toolbar.logo = None
+        p.legend.location = "top_right"
+        p.legend.click_policy = "hide"
+        p.legend.label_text_font_size = '8pt'
+        p.legend.spacing = 1
+        p.legend.padding = 5
+        return p
+
     def make_plot_premium(src):
         """
         Creates the graph based on the inputed source
@@ -140,64 +314,16 @@ def _tab(policy_data):
         p = figure(plot_width=1200, plot_height=250, title='',
                    x_axis_label='', y_axis_label='Premium',
                    tools="pan,wheel_zoom,reset")
-        #
-        p.line(x='left', y='progressive_average_premium', source=src, color='#79b6dc',
-               line_width=4, legend='Progressive')
-        p.circle(x='left', y='progressive_average_premium', source=src, color='#79b6dc',
-                 fill_color='white', size=6, legend='Progressive', name='Progressive')
-
-        p.line(x='left', y='country_average_premium', source=src, color='#febe0c',
-               line_width=4, legend='Country')
-        p.circle(x='left', y='country_average_premium', source=src, color='#febe0c',
-                 fill_color='white', size=6, legend='Country', name='Country')
-
-        p.line(x='left', y='auto_owners_average_premium', source=src, color='#2f4f4f',
-               line_width=4, legend='Auto Owners')
-        p.circle(x='left', y='auto_owners_average_premium', source=src, color='#2f4f4f',
-                 fill_color='white', size=6, legend='Auto Owners', name='Auto Owners')
-
-        p.line(x='left', y='state_farm_average_premium', source=src, color='#5e4fa2',
-               line_width=4, legend='State Farm')
-        p.circle(x='left', y='state_farm_average_premium', source=src, color='#5e4fa2',
-                 fill_color='white', size=6, legend='State Farm', name='State Farm')
-
-        p.line(x='left', y='usaa_average_premium', source=src, color='#65c05d',
-               line_width=4, legend='USAA')
-        p.circle(x='left', y='usaa_average_premium', source=src, color='#65c05d',
-                 fill_color='white', size=6, legend='USAA', name='USAA')
-
-        p.line(x='left', y='liberty_average_premium', source=src, color='#ac5370',
-               line_width=4, legend='Liberty')
-        p.circle(x='left', y='liberty_average_premium', source=src, color='#ac5370',
-                 fill_color='white', size=6, legend='Liberty', name='Liberty')
-
-        p.line(x='left', y='gfb_average_premium', source=src, color='#d53e4f',
-               line_width=4, legend='Georgia Farm')
-        p.circle(x='left', y='gfb_average_premium', source=src, color='#d53e4f',
-                 fill_color='white', size=6, legend='Georgia Farm', name='Georgia Farm')
+        # One line and one point per company and bin, hidden from the legend company by company
+        premium_lines(p, src, [
+            ('Progressive', 'progressive_average_premium', '#79b6dc'),
+            ('Country', 'country_average_premium', '#febe0c'),
+            ('Auto Owners', 'auto_owners_average_premium', '#2f4f4f'),
+            ('State Farm', 'state_farm_average_premium', '#5e4fa2'),
+            ('USAA', 'usaa_average_premium', '#65c05d'),
+            ('Liberty', 'liberty_average_premium', '#ac5370'),
+            ('Georgia Farm', 'gfb_average_premium', '#d53e4f')], bands=bands)
 
-        # Hover tool with vline mode
-        p.add_tools(HoverTool(names=['Progressive'], tooltips=[
-            ('Progressive Average Premium', '@progressive_average_premium{$0,}'),
-            ('Interval', '[@_interval)')], mode='mouse', toggleable=False))
-        p.add_tools(HoverTool(names=['Country'], tooltips=[
-            ('Country Average Premium', '@country_average_premium{$0,}'),
-            ('Interval', '[@_interval)')], mode='mouse', toggleable=False))
-        p.add_tools(HoverTool(names=['Auto Owners'], tooltips=[
-            ('Auto Owners Average Premium', '@auto_owners_average_premium{$0,}'),
-            ('Interval', '[@_interval)')], mode='mouse', toggleable=False))
-        p.add_tools(HoverTool(names=['State Farm'], tooltips=[
-            ('State Farm Average Premium', '@state_farm_average_premium{$0,}'),
-            ('Interval', '[@_interval)')], mode='mouse', toggleable=False))
-        p.add_tools(HoverTool(names=['USAA'], tooltips=[
-            ('USAA Average Premium', '@usaa_average_premium{$0,}'),
-            ('Interval', '[@_interval)')], mode='mouse', toggleable=False))
-        p.add_tools(HoverTool(names=['Liberty'], tooltips=[
-            ('Liberty Average Premium', '@liberty_average_premium{$0,}'),
-            ('Interval', '[@_interval)')], mode='mouse', toggleable=False))
-        p.add_tools(HoverTool(names=['Georgia Farm'], tooltips=[
-            ('Georgia Farm Average Premium', '@gfb_average_premium{$0,}'),
-            ('Interval', '[@_interval)')], mode='mouse', toggleable=False))
         p.toolbar.logo = None
         p.legend.location = "top_right"
         p.legend.click_policy = "hide"
@@ -208,33 +334,39 @@ def _tab(policy_data):
         p.legend.spacing = 1
         p.legend.padding = 10
         p.legend.margin = 0
+
         p.toolbar.active_scroll = p.select_one(WheelZoomTool)
         return p
 
-    def make_dataset(companies, range_start=0, range_end=1000, target_column='Age'):
-
-        subset = policy_data[(range_start <= policy_data[target_column]) & (policy_data[target_column] < range_end)]
-        by_companies = {}
-
-        # Iterate through all the districts
-        for i, company_name in enumerate(companies):
-            # Subset to the companies
-            by_companies[company_name] = policy_dictionary[company_name]
+    def make_dataset(companies, range_start=0, range_end=1000, target_column='Age', engine=None):
+        engine = rate.engine(tab_engine(engine))
+        codes = registry.codes(companies)
 
         # Overall dataframe
         # ===========================================================================
-        x_axis = []
-        for i in by_companies:
-            x_axis.append(by_companies[i][4])
-
         data = pd.DataFrame()
-        data['x'] = list(x_axis)
-        data['top'] = [subset[subset[by_companies[list(
-            by_companies.keys())[i]][1]] != 0][by_companies[list(by_companies.keys())[i]][1]].mean()
-                       for i in range(len(by_companies.keys()))]
-        data['color'] = [by_companies[list(by_companies.keys())[i]][2] for i in range(len(by_companies.keys()))]
+        data['x'] = [registry[code].name for code in codes]
+        if sample is not None and engine is sample:
+            # Estimated from the sample, with the 95% confidence interval
+            data['top'], intervals = sample.average_premium_intervals(codes, range_start, range_end, target_column)
+            data['lower'] = data['top'] - intervals
+            data['upper'] = data['top'] + intervals
+        elif engine is not None:
+            data['top'] = engine.average_premiums(codes, range_start, range_end, target_column)
+        else:
+            # The pandas reference, on the premium columns of the company dictionary
+            by_companies = dict((company_name, policy_dictionary[company_name]) for company_name in companies)
+            policy_data = store.frame
+            subset = policy_data[(range_start <= policy_data[target_column]) &
+                                 (policy_data[target_column] < range_end)]
+            data['top'] = [subset[subset[by_companies[list(
+                by_companies.keys())[i]][1]] != 0][by_companies[list(by_companies.keys())[i]][1]].mean()
+                           for i in range(len(by_companies.keys()))]
+        if 'lower' not in data:
+            data['lower'] = data['upper'] = np.nan
+        data['color'] = [registry[code].color for code in codes]
         data['text'] = data['top'].apply(lambda x: '$' + '{0:.0f}'.format(x))
-        for n, company in enumerate(by_companies):
+        for n, company in enumerate(companies):
             value = data['top'][n]
             data[company] = data.apply(lambda row: (1 - (value / row['top'])), axis=1)
             # data[company] = data.apply(lambda row: "{:.0%}".format((1 - (row['top']/value))), axis=1)
@@ -270,6 +402,8 @@ def _tab(policy_data):
         # graph settings
         # ===========================================================================
         p.add_layout(text_notation)
+        # Confidence interval of the estimate, only drawn while the sample is shown
+        p.add_layout(Whisker(source=src, base='x', lower='lower', upper='upper', line_color='#808080'))
         p.add_tools(HoverTool(names=['State'], tooltips="""
             <div align="left">
                 <span style="font-size: 12px; font-weight: bold;"> @x </span>&nbsp;
@@ -316,36 +450,40 @@ def _tab(policy_data):
         # ===========================================================================
         return p
 
-    def make_dataset_winrate(companies, range_start=0, range_end=1000, target_column='Age'):
-        by_companies = {}
-
-        # Iterate through all the districts
-        for i, company_name in enumerate(companies):
-            # Subset to the companies
-            by_companies[company_name] = policy_dictionary[company_name]
-
-        subset = policy_data[(range_start <= policy_data[target_column]) & (policy_data[target_column] < range_end)]
-        subset['lowest_col'] = subset.loc[:, ['Auto Owners (Auto-Owners): Total Vehicle Premium',
-                                              'Country Companies (Mutual CMIC): Total Vehicle Premium',
-                                              'Farm Bureau Mutual: Total Vehicle Premium',
-                                              'LM General Insurance Company (LM Ins Co): Total Vehicle Premium',
-                                              'Prog Mountain: Total Vehicle Premium',
-                                              'State Farm Auto (SFM): Total Vehicle Premium',
-                                              'USAA Auto (USAA): Total Vehicle Premium']].idxmin(axis=1)
-        x = subset['lowest_col'].value_counts(dropna=False)
+    def make_dataset_winrate(companies, range_start=0, range_end=1000, target_column='Age', engine=None):
+        engine = rate.engine(tab_engine(engine))
+        if sample is not None and engine is sample:
+            counts, intervals, subset_count = sample.lowest_intervals(range_start, range_end, target_column)
+            policy_count = sample.policy_count()
+        elif engine is not None:
+            counts, subset_count = engine.lowest_counts(range_start, range_end, target_column)
+            policy_count = engine.policy_count()
+        else:
+            # The pandas reference, cheapest premium column by idxmin
+            policy_data = store.frame
+            subset = policy_data[(range_start <= policy_data[target_column]) & (policy_data[target_column] < range_end)]
+            subset['lowest_col'] = subset.loc[:, lowest_columns].idxmin(axis=1)
+            x = subset['lowest_col'].value_counts(dropna=False)
+            policy_count = policy_data.count()['Policy No']
+            subset_count = subset.count()['Policy No']
+        if engine is not None:
+            x = registry.ranked(counts)
         data = pd.Series(x).reset_index(name='value').rename(columns={'index': 'VS'})
         data['angle'] = data['value'] / data['value'].sum() * 2 * pi
         data['ratio'] = data['value'].apply(lambda x: '{0:.4f}'.format(x / data['value'].sum()))
         data['text'] = data['value'].apply(lambda x: '{:.0%}'.format(x / data['value'].sum()))
-        data['key'] = data['VS'].apply(lambda x: companies_comvert[x])
-        data['name'] = data['key'].apply(lambda x: by_companies[x][4])
-        data['color'] = data['key'].apply(lambda x: by_companies[x][2])
+        if sample is not None and engine is sample:
+            data['text'] = data['text'] + [' \u00b1{:.0%}'.format(interval)
+                                           for interval in intervals[registry.codes(x.index)]]
+        data['key'] = [registry[column].key for column in data['VS']]
+        data['name'] = [registry[column].name for column in data['VS']]
+        data['color'] = [registry[column].color for column in data['VS']]
         data['cumulative_angle'] = [(sum(data['value'][0:i + 1]) - (item / 2)) / sum(data['value']) * 2 * pi for i, item
                                     in enumerate(data['value'])]
         data['cos'] = np.cos(data['cumulative_angle']) * 0.3
         data['sin'] = np.sin(data['cumulative_angle']) * 0.3
-        data['policy_count'] = policy_data.count()['Policy No']
-        data['subset_count'] = subset.count()['Policy No']
+        data['policy_count'] = policy_count
+        data['subset_count'] = subset_count
         # Convert dataframe to column data source
         return ColumnDataSource(data)
 
@@ -376,35 +514,108 @@ def _tab(policy_data):
         p.grid.grid_line_color = None
         return p
 
-    # Update function takes three default parameters
-    def update(attr, old, new):
+    # Recompute the sources for the current widgets, engine overrides the backend of the tab
+    def refresh_sources(engine=None):
+        if prefetcher is not None:
+            prefetcher.cancel()
         # ===========================================================================
-        new_src = make_dataset(companies,
+        new_data = shared.data('dataset', make_dataset, engine, companies,
                                range_start=range_select.value[0],
                                range_end=range_select.value[1],
                                target_column=x_axis.value)
         # Update the source
-        src.data.update(new_src.data)
+        src.data.update(new_data)
         # ===========================================================================
-        new_src_dist = make_dataset_distribution(policy_data,
-                                                 range_start=range_select.value[0],
-                                                 range_end=range_select.value[1],
-                                                 bin_width=binwidth_select.value,
-                                                 target_column=x_axis.value)
+        new_data_dist = shared.data('distribution', make_dataset_distribution, engine, market_store(),
+                                    range_start=range_select.value[0],
+                                    range_end=range_select.value[1],
+                                    bin_width=binwidth_select.value,
+                                    statistic=statistic_select.value,
+                                    target_column=x_axis.value)
         # Update the source
-        src_dist.data.update(new_src_dist.data)
+        src_dist.data.update(new_data_dist)
+        rate.update_bins(src_dist.data['_interval'])
         # ===========================================================================
-        new_src_win = make_dataset_winrate(companies,
-                                           range_start=range_select.value[0],
-                                           range_end=range_select.value[1],
-                                           target_column=x_axis.value)
+        new_data_win = shared.data('winrate', make_dataset_winrate, engine, companies,
+                                   range_start=range_select.value[0],
+                                   range_end=range_select.value[1],
+                                   target_column=x_axis.value)
         # Update the source
-        src_win.data.update(new_src_win.data)
+        src_win.data.update(new_data_win)
+        # ===========================================================================
+        if engine is not None:
+            # The panels below have no sampled answer, refine() brings them up to date once the widgets stop
+            return
+        ranks.refresh()
+        heatmap.refresh()
+        drilldown.first_page()
+        scatter.refresh()
         # ===========================================================================
+        if baseline is not None:
+            scenario.refresh()
+        # ===========================================================================
+        prefetch_neighbours()
+
+    def refine():
+        del pending_refine[:]
+        refresh_sources()
+
+    def reschedule(pending, callback):
+        """
+        Runs callback once the widgets have not changed for refine_milliseconds, instead of the call pending
+        """
+        for timeout in pending:
+            doc.remove_timeout_callback(timeout)
+        pending[:] = [doc.add_timeout_callback(callback, refine_milliseconds)]
+
+    # Update function takes three default parameters
+    def update(attr, old, new):
+        if sample is None:
+            refresh_sources()
+            return
+        # Answer from the sample while the widgets move, the exact numbers follow once they stop
+        refresh_sources(engine=sample)
+        reschedule(pending_refine, refine)
+
+    def update_market(attr, old, new):
+        if client:
+            fine_src.data = market_store().fine_bins(x_axis.value)
+        similar.refresh()
+        update(attr, old, new)
+
+    def update_statistic(attr, old, new):
+        w.yaxis.axis_label = 'Premium' if new == 'mean' else 'Premium (%s)' % statistic_label(new)
+        premium_statistic(w, new)
+        update(attr, old, new)
+
+    # Slider moves are re-binned in the browser in client mode, unless the statistic needs the sketches
+    def client_rebins():
+        return (client and statistic_select.value == 'mean' and not bands and baseline is None and
+                rate.rate_select.value == 0)
+
+    def refresh_panels():
+        del pending_panels[:]
+        ranks.refresh()
+        heatmap.refresh()
+        drilldown.refresh()
+        scatter.refresh()
+
+    def update_slider(attr, old, new):
+        if client_rebins():
+            # The rank positions, the heatmap, the drill-down and the scatter come from the server once the
+            # slider stops
+            reschedule(pending_panels, refresh_panels)
+            return
+        update(attr, old, new)
 
     # Update function takes three default parameters
     def update_axis(attr, old, new):
+        if client:
+            # Before the sliders move, so the browser re-bins the new column
+            fine_src.data = market_store().fine_bins(x_axis.value)
         q.xaxis.axis_label = x_axis.value
+        h.xaxis.axis_label = x_axis.value
+        v.xaxis.axis_label = x_axis.value
         if (x_axis.value == 'Credit'):
             range_select.value = (500, 1000)
             range_select.start = 0
@@ -435,29 +646,7 @@ def _tab(policy_data):
             binwidth_select.end = 10
             binwidth_select.step = 1
             binwidth_select.value = 3
-        # ===========================================================================
-        new_src = make_dataset(companies,
-                               range_start=range_select.value[0],
-                               range_end=range_select.value[1],
-                               target_column=x_axis.value)
-        # Update the source
-        src.data.update(new_src.data)
-        # ===========================================================================
-        new_src_dist = make_dataset_distribution(policy_data,
-                                                 range_start=range_select.value[0],
-                                                 range_end=range_select.value[1],
-                                                 bin_width=binwidth_select.value,
-                                                 target_column=x_axis.value)
-        # Update the source
-        src_dist.data.update(new_src_dist.data)
-        # ===========================================================================
-        new_src_win = make_dataset_winrate(companies,
-                                           range_start=range_select.value[0],
-                                           range_end=range_select.value[1],
-                                           target_column=x_axis.value)
-        # Update the source
-        src_win.data.update(new_src_win.data)
-        # ===========================================================================
+        update(attr, old, new)
 
     target_columns = ['Age', 'Credit', 'Model Year']
     # Check box tool
@@ -468,41 +657,134 @@ def _tab(policy_data):
     binwidth_select = Slider(start=2, end=10,
                              step=1, value=3,
                              title='Bin Width')
-    binwidth_select.on_change('value', update)
+    binwidth_select.on_change('value', update_slider)
     # X-axis range slider
     range_select = RangeSlider(start=0, end=120, value=(0, 120),
                                step=5, title='X-axis Range')
-    range_select.on_change('value', update)
+    range_select.on_change('value', update_slider)
     # X-axis range slider
 
-    src_dist = make_dataset_distribution(policy_data,
-                                         range_start=range_select.value[0],
-                                         range_end=range_select.value[1],
-                                         bin_width=binwidth_select.value,
-                                         target_column=x_axis.value)
+    # Premium statistic of the premium chart, offered when the store aggregates more than the average
+    statistic_select = Select(title="Premium Statistic", value='mean',
+                              options=[(statistic, statistic_label(statistic))
+                                       for statistic in ['mean'] + store.statistics])
+    statistic_select.on_change('value', update_statistic)
+
+    # Market selector, offered when the store is partitioned by market
+    market_select = Select(title="Market", value=all_markets, options=[all_markets] + store.markets())
+    market_select.on_change('value', update_market)
+
+    # What-if change of the GFB premiums, in every bin or in the selected one
+    rate = RateChange(market_store, policy_dictionary['GFB'][1], binwidth_select)
+    rate.rate_select.on_change('value', update)
+    rate.rate_bin_select.on_change('value', update)
+
+    # Sessions opened at the same time wait for one computation of the default state
+    shared = SharedResults(__name__, backend, sample, market_select, market_store, rate)
+    src_dist = ColumnDataSource(shared.data('distribution', make_dataset_distribution, None, market_store(),
+                                            range_start=range_select.value[0],
+                                            range_end=range_select.value[1],
+                                            bin_width=binwidth_select.value,
+                                            statistic=statistic_select.value,
+                                            target_column=x_axis.value))
+
+    rate.update_bins(src_dist.data['_interval'])
 
     # Initial source
-    src = make_dataset(companies,
-                       range_start=range_select.value[0],
-                       range_end=range_select.value[1],
-                       target_column=x_axis.value)
+    src = ColumnDataSource(shared.data('dataset', make_dataset, None, companies,
+                                       range_start=range_select.value[0],
+                                       range_end=range_select.value[1],
+                                       target_column=x_axis.value))
 
-    src_win = make_dataset_winrate(companies,
-                                   range_start=range_select.value[0],
-                                   range_end=range_select.value[1],
-                                   target_column=x_axis.value)
-    # Initial graph
-    p = make_plot(src)
-    q = make_plot_distribution(src_dist)
-    w = make_plot_premium(src_dist)
-    u = make_plot_winrate(src_win)
+    src_win = ColumnDataSource(shared.data('winrate', make_dataset_winrate, None, companies,
+                                           range_start=range_select.value[0],
+                                           range_end=range_select.value[1],
+                                           target_column=x_axis.value))
+    # Price position of each company over the X axis range
+    ranks = RankChart(registry, companies, market_store, x_axis, range_select)
+    # GFB competitiveness over the X axis bins by the bins of a second column
+    heatmap = HeatmapChart(market_store, policy_dictionary['GFB'][1], target_columns, 'Credit',
+                           x_axis, range_select, binwidth_select)
+    if baseline is not None:
+        # Changes since the baseline of the quotes of each bin
+        scenario = ScenarioChart(registry, companies, market_store, baseline_store, policy_dictionary['GFB'][1],
+                                 x_axis, range_select, binwidth_select)
+    # Initial graph, built by the first session of the process and copied with their own sources and widgets for
+    # the sessions after it
+    p = templates.get((__name__, 'dataset'), make_plot, src)
+    q = templates.get((__name__, 'distribution'), make_plot_distribution, src_dist)
+    v = templates.get((__name__, 'winrate_bins'), make_plot_winrate_bins, src_dist)
+    w = templates.get((__name__, 'premium', bands), make_plot_premium, src_dist)
+    u = templates.get((__name__, 'winrate'), make_plot_winrate, src_win)
+    r = templates.get((__name__, 'ranks'), ranks.make_plot, ranks.src)
 
     q.x_range = w.x_range
+    v.x_range = w.x_range
+    h = templates.get((__name__, 'heatmap'), heatmap.make_plot, heatmap.src, heatmap.mapper)
+    heatmap.plot = h
+    h.x_range = w.x_range
+    # Quotes of the clicked distribution bar, a page at a time
+    drilldown = DrillDownTable(registry, market_store, src_dist, x_axis, range_select, binwidth_select)
+    d = templates.get((__name__, 'drilldown'), drilldown.make_plot, drilldown.src, drilldown.sort_select,
+                      drilldown.order_select, drilldown.previous_button, drilldown.next_button, drilldown.status)
+    drilldown.table = d.select_one({'type': DataTable})
+    drilldown.refresh()
+    # Profile of a risk, the quotes most like it are listed with what each company charges for them
+    similar = SimilarRisksTable(registry, market_store, target_columns, policy_dictionary['GFB'][1])
+    k = templates.get((__name__, 'similar'), similar.make_plot, similar.src, similar.count, similar.button,
+                      similar.status, *similar.inputs)
+    similar.refresh()
+    # Quotes of the X axis range by their cheapest competitor and GFB premiums
+    scatter = QuoteScatterChart(registry, market_store, policy_dictionary['GFB'][1], market_select, x_axis,
+                                range_select, doc)
+    s = templates.get((__name__, 'scatter'), scatter.make_plot, scatter.points_src, scatter.density_src,
+                      scatter.x_range, scatter.y_range, scatter.status)
+    scatter.refresh()
+
+    if client:
+        # Fine bins of the X axis column, shipped once per column
+        fine_src = ColumnDataSource(market_store().fine_bins(x_axis.value))
+        rebin = rebin_callback(fine_src, tab_config(companies, policy_dictionary, lowest_columns, average_columns,
+                                                    companies_comvert),
+                               src, src_dist, src_win, range_select, binwidth_select, statistic_select, bands,
+                               rate.rate_select, baseline is not None)
+        range_select.js_on_change('value', rebin)
+        binwidth_select.js_on_change('value', rebin)
+
+    # The neighbours of the first state are ready before the first slider move
+    prefetch_neighbours()
+
+    def refresh_store():
+        if client:
+            fine_src.data = market_store().fine_bins(x_axis.value)
+        refresh_sources()
+
+    # Recompute this session when new quotes are appended to the shared store
+    def refresh():
+        doc.add_next_tick_callback(refresh_store)
+
+    store.add_listener(refresh)
+    doc.on_session_destroyed(lambda session_context: store.remove_listener(refresh))
+    if baseline is not None:
+        baseline.add_listener(refresh)
+        doc.on_session_destroyed(lambda session_context: baseline.remove_listener(refresh))
+
     # Put controls in a single element
-    controls = WidgetBox(x_axis, range_select, binwidth_select)
+    controls = WidgetBox(x_axis, range_select, binwidth_select, rate.rate_select, rate.rate_bin_select,
+                         heatmap.y_axis, heatmap.metric_select)
+    if store.statistics:
+        controls.children.append(statistic_select)
+    if store.markets():
+        controls.children.append(market_select)
 
     # Create a row layout
-    layout = row(controls, column(row(p, u), w, q))
+    charts = [row(p, u, r), w, q, d, v, h, s, k]
+    if baseline is not None:
+        g = templates.get((__name__, 'scenario'), scenario.make_plot, scenario.src)
+        for chart in g.children:
+            chart.x_range = w.x_range
+        charts.append(g)
+    layout = row(controls, column(*charts))
 
     # Make a tab with the layout
     tab = Panel(child=layout, title='PPA - Vehicle Level')
@@ -0,0 +1,208 @@
+import threading
+import numpy as np
+from bokeh.models.widgets import Select, Slider
+from DataStore import histogram_bins
+
+# Rate change bin option of every bin at once
+all_bins = 'all'
+
+
+def segmented_search(ratio, first, starts, ends, factors):
+    """
+    Binary search of every segment [start, end) of rows sorted by (ratio, first) at once: the first row where GFB
+    is the cheapest at the factor of its segment, that is ratio above the factor or equal to it with first set
+    """
+    low, high = starts.copy(), ends.copy()
+    while True:
+        active = low < high
+        if not active.any():
+            return low
+        middle = np.minimum((low + high) // 2, len(ratio) - 1)
+        below = (ratio[middle] < factors) | ((ratio[middle] == factors) & ~first[middle])
+        low = np.where(active & below, middle + 1, low)
+        high = np.where(active & ~below, middle, high)
+
+
+class RateSimulator(object):
+    """
+    What-if averages and cheapest company counts when the GFB premiums are multiplied by a factor.
+    Each quote is reduced once to the ratio of the cheapest other premium to the GFB premium: GFB is the cheapest
+    at any factor below that ratio, and at the ratio itself when it comes first in lowest_columns. The quotes are
+    sorted by ratio within each value of a target column, so a factor costs a binary search per value instead of
+    an argmin over all the companies, and the factor can differ from one value to the next.
+
+    store = the DataStore of the tab
+    gfb_column = premium column the factor applies to
+    """
+
+    def __init__(self, store, gfb_column):
+        self.store = store
+        self.columns = store.lowest_columns
+        self.gfb = self.columns.index(gfb_column)
+        self.indexes = {}
+        self.lock = threading.Lock()
+        store.add_listener(self.indexes.clear)
+
+    def _index(self, target_column):
+        with self.lock:
+            if target_column not in self.indexes:
+                self.indexes[target_column] = self._build(target_column)
+            return self.indexes[target_column]
+
+    def _build(self, target_column):
+        target = self.store.frame[target_column].to_numpy(dtype=float)
+        keep = ~np.isnan(target)
+        premiums = self.store.premiums()[keep]
+        gfb = premiums[:, self.gfb]
+        others = premiums.copy()
+        others[:, self.gfb] = np.nan
+        missing = np.isnan(others)
+        # Cheapest other company, which is the cheapest of all whenever GFB is not
+        cheapest = np.where(missing.all(axis=1), -1, np.where(missing, np.inf, others).argmin(axis=1))
+        cheapest_premium = np.where(cheapest >= 0, others[np.arange(len(others)), np.maximum(cheapest, 0)], np.nan)
+        first = (cheapest < 0) | (self.gfb < cheapest)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = cheapest_premium / gfb
+        # Ties at a zero GFB premium, then no other quote, then no GFB quote
+        ratio = np.where(np.isnan(ratio), np.where(first, np.inf, -np.inf), ratio)
+        ratio[cheapest < 0] = np.inf
+        ratio[np.isnan(gfb)] = -np.inf
+
+        values, inverse = np.unique(target[keep], return_inverse=True)
+        order = np.lexsort((first, ratio, inverse))
+        k = len(self.columns)
+        # Rows of each company as the cheapest other one, counted along the sorted order
+        winner = np.zeros((len(order), k), dtype=np.int32)
+        quoted = cheapest[order] >= 0
+        winner[np.flatnonzero(quoted), cheapest[order][quoted]] = 1
+        cumulative = np.vstack([np.zeros((1, k), dtype=np.int32), np.cumsum(winner, axis=0, dtype=np.int32)])
+        return {'values': values,
+                'starts': np.searchsorted(inverse[order], np.arange(len(values)), side='left'),
+                'ends': np.searchsorted(inverse[order], np.arange(len(values)), side='right'),
+                'ratio': ratio[order], 'first': first[order], 'cumulative': cumulative}
+
+    def lowest_counts(self, range_start, range_end, target_column, factors):
+        """
+        Number of quotes where each company is the cheapest for range_start <= target_column < range_end, by
+        code, and the number of policies in the range
+
+        factors = function giving the GFB factor of each of the target values it is given
+        """
+        index = self._index(target_column)
+        first_value = np.searchsorted(index['values'], range_start, side='left')
+        last_value = np.searchsorted(index['values'], range_end, side='left')
+        starts = index['starts'][first_value:last_value]
+        ends = index['ends'][first_value:last_value]
+        position = segmented_search(index['ratio'], index['first'], starts, ends,
+                                    factors(index['values'][first_value:last_value]))
+        counts = (index['cumulative'][position] - index['cumulative'][starts]).sum(axis=0)
+        counts[self.gfb] += (ends - position).sum()
+        with self.store.lock:
+            aggregates = self.store._aggregates(target_column)
+            selected = aggregates._range(range_start, range_end)
+            subset_count = int(aggregates.policy_count[selected].sum())
+        return counts, subset_count
+
+    def average_premiums(self, codes, range_start, range_end, target_column, factors):
+        """
+        Average of the non zero premiums of each company, by code, for range_start <= target_column < range_end,
+        the GFB premiums multiplied by their factor
+        """
+        with self.store.lock:
+            aggregates = self.store._aggregates(target_column)
+            selected = aggregates._range(range_start, range_end)
+            sums = aggregates.nonzero_sum[selected].copy()
+            counts = aggregates.nonzero_count[selected]
+            sums[:, self.gfb] *= factors(aggregates.values[selected])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return list(sums[:, codes].sum(axis=0) / counts[:, codes].sum(axis=0))
+
+    def engine(self, factor, bin_width=None, bin=None):
+        return WhatIfEngine(self, factor, bin_width, bin)
+
+
+class WhatIfEngine(object):
+    """
+    Answers the average premium and win rate queries of a tab with the GFB premiums multiplied by factor,
+    in every bin or only in one bin of the distribution
+
+    bin = index of the bin of width bin_width over the slider range, None for all of them
+    """
+
+    def __init__(self, simulator, factor, bin_width=None, bin=None):
+        self.simulator = simulator
+        self.factor = factor
+        self.bin_width = bin_width
+        self.bin = bin
+
+    def _factors(self, range_start, range_end):
+        def factors(values):
+            result = np.full(len(values), float(self.factor))
+            if self.bin is not None:
+                bins, edges = histogram_bins(values, range_start, range_end, self.bin_width)
+                result[bins != self.bin] = 1.0
+            return result
+        return factors
+
+    def average_premiums(self, codes, range_start, range_end, target_column):
+        return self.simulator.average_premiums(codes, range_start, range_end, target_column,
+                                               self._factors(range_start, range_end))
+
+    def lowest_counts(self, range_start, range_end, target_column):
+        return self.simulator.lowest_counts(range_start, range_end, target_column,
+                                            self._factors(range_start, range_end))
+
+    def policy_count(self):
+        return self.simulator.store.policy_count()
+
+
+# One simulator per store, kept by the store
+def get_simulator(store, gfb_column):
+    return store.derived(__name__, lambda store: RateSimulator(store, gfb_column))
+
+
+class RateChange(object):
+    """
+    What-if change of the GFB premiums set in a session, in every bin of the distribution or in the one selected,
+    for the averages and the win rate. Holds the rate and bin widgets, the bins offered follow the distribution
+
+    market_store = function returning the store of the market shown
+    gfb_column = premium column the change applies to
+    binwidth_select = bin width widget of the tab
+    """
+
+    def __init__(self, market_store, gfb_column, binwidth_select):
+        self.market_store = market_store
+        self.gfb_column = gfb_column
+        self.binwidth_select = binwidth_select
+        self.rate_select = Slider(start=-30, end=30, step=1, value=0, title='GFB Rate Change (%)')
+        self.rate_bin_select = Select(title="Rate Change Bins", value=all_bins, options=[(all_bins, 'All Bins')])
+        self.bins = []
+
+    def engine(self, engine):
+        """
+        Rate simulator of the market shown while a change is set, engine otherwise
+        """
+        if self.rate_select.value == 0:
+            return engine
+        rate_bin = None if self.rate_bin_select.value == all_bins else int(self.rate_bin_select.value)
+        simulator = get_simulator(self.market_store(), self.gfb_column)
+        return simulator.engine(1 + self.rate_select.value / 100.0, self.binwidth_select.value, rate_bin)
+
+    def key(self):
+        """
+        Widgets the results depend on while a change is set, None otherwise
+        """
+        if self.rate_select.value == 0:
+            return None
+        return self.rate_select.value, self.rate_bin_select.value, self.binwidth_select.value
+
+    def update_bins(self, intervals):
+        """
+        One option per bin of the distribution, the selected bin is kept while the bins stay the same
+        """
+        options = [(all_bins, 'All Bins')] + [(str(i), interval) for i, interval in enumerate(intervals)]
+        if options != self.bins:
+            self.bins[:] = options
+            self.rate_bin_select.options = options
+            self.rate_bin_select.value = all_bins